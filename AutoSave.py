@@ -0,0 +1,203 @@
+# AutoSave.py
+# Append only change log of the scene, written in the background and compacted into a snapshot from time to time
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import itertools
+import json
+import os
+import threading
+
+from SceneFile import saveBinaryScene, iterBinaryScene
+
+SNAPSHOT = "snapshot.scb"
+LOG = "changes.log"
+LOCK = "lock"
+
+### log entries, every entry carries absolute values so replaying an entry twice does no harm:
+###   {"op": "add", "id": 3, "state": {...}}
+###   {"op": "set", "id": 3, "values": {"pos": [100, 0]}}
+###   {"op": "del", "id": 3}
+
+def lockDirectory(directory):
+    ### exclusive lock on the lock file of directory, None if another instance holds it
+    ### the operating system releases the lock when the process ends, also after a crash
+    handle = open(os.path.join(directory, LOCK), "a+")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+
+    return handle
+
+def claimAutoSave(base):
+    ### (directory, lock) of a new instance below base: the directory of an instance that did not exit properly if there is
+    ### one, so its changes can be recovered, otherwise a new one named after the process
+    os.makedirs(base, exist_ok=True)
+
+    orphans = [os.path.join(base, x) for x in os.listdir(base)]
+    orphans = sorted([x for x in orphans if os.path.isdir(x) and hasAutoSave(x)], key=os.path.getmtime, reverse=True)
+    for directory in orphans:
+        lock = lockDirectory(directory)
+        if lock is None:
+            continue
+
+        ### the owner may have exited properly in the meantime
+        if hasAutoSave(directory):
+            return directory, lock
+        lock.close()
+
+    for k in itertools.count():
+        directory = os.path.join(base, str(os.getpid()) + (f"-{k}" if k > 0 else ""))
+        os.makedirs(directory, exist_ok=True)
+        lock = lockDirectory(directory)
+        if lock is not None:
+            return directory, lock
+
+class AutoSave:
+    def __init__(self, directory, getStates, interval = 2.0, compactEntries = 2000, lock = None):
+        ### getStates returns the states of all elements including their "id", it is called on the caller's thread
+        ### lock is the lock of directory if the caller holds it already (see claimAutoSave)
+        self.directory = directory
+        self.getStates = getStates
+        self.interval = interval
+        self.compactEntries = compactEntries
+
+        os.makedirs(directory, exist_ok=True)
+
+        ### only one instance writes to a directory
+        self.lockFile = lock if lock is not None else lockDirectory(directory)
+        if self.lockFile is None:
+            raise RuntimeError(f"Autosave directory {directory} is used by another instance")
+
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = False
+
+        ### entries not written yet and a snapshot waiting to replace the log
+        self.pending = []
+        self.snapshotStates = None
+        self.count = 0
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def append(self, op, elementId, **data):
+        entry = {"op": op, "id": elementId}
+        entry.update(data)
+
+        with self.lock:
+            ### a drag produces many position entries, only the last one per element has to be written
+            if op == "set" and len(self.pending) > 0:
+                last = self.pending[-1]
+                if last["op"] == "set" and last["id"] == elementId and last["values"].keys() == entry["values"].keys():
+                    self.pending[-1] = entry
+                    return
+
+            self.pending.append(entry)
+            self.count += 1
+            compact = self.count >= self.compactEntries
+
+        if compact:
+            self.snapshot()
+
+    def snapshot(self):
+        ### the states are collected here, converting and writing them is left to the background thread
+        states = self.getStates()
+
+        with self.lock:
+            self.snapshotStates = states
+            self.pending = []
+            self.count = 0
+
+        self.wake.set()
+
+    def run(self):
+        while not self.stopped:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+            states, self.snapshotStates = self.snapshotStates, None
+
+        if states is not None:
+            ### write the snapshot under a temporary name first, then start a new log
+            ### a crash in between only leaves entries behind that are already part of the snapshot
+            tmp = os.path.join(self.directory, SNAPSHOT + ".tmp")
+            saveBinaryScene(tmp, states)
+            with open(tmp, "rb+") as f:
+                os.fsync(f.fileno())
+            os.replace(tmp, os.path.join(self.directory, SNAPSHOT))
+
+            open(os.path.join(self.directory, LOG), "w").close()
+
+        if len(pending) > 0:
+            with open(os.path.join(self.directory, LOG), "a") as writer:
+                writer.write("".join(json.dumps(x) + "\n" for x in pending))
+                writer.flush()
+                os.fsync(writer.fileno())
+
+    def close(self, discard = False):
+        ### write everything that is left, discard removes the files and the directory after a regular exit
+        self.stopped = True
+        self.wake.set()
+        self.thread.join()
+        self.flush()
+
+        if discard:
+            for name in (SNAPSHOT, LOG):
+                path = os.path.join(self.directory, name)
+                if os.path.exists(path):
+                    os.remove(path)
+
+        self.lockFile.close()
+
+        if discard:
+            ### another instance may have taken the empty directory in the meantime
+            try:
+                os.remove(os.path.join(self.directory, LOCK))
+                os.rmdir(self.directory)
+            except OSError:
+                pass
+
+def hasAutoSave(directory):
+    return any(os.path.exists(os.path.join(directory, x)) for x in (SNAPSHOT, LOG))
+
+def loadAutoSave(directory):
+    ### last snapshot plus the replayed log, the work depends on the number of changes since the snapshot
+    elements = {}
+
+    path = os.path.join(directory, SNAPSHOT)
+    if os.path.exists(path):
+        for state in iterBinaryScene(path):
+            elements[state["id"]] = state
+
+    path = os.path.join(directory, LOG)
+    if os.path.exists(path):
+        with open(path, "r") as reader:
+            for line in reader:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    ### the last line may be cut off by the crash
+                    break
+
+                elementId = entry["id"]
+                if entry["op"] == "add":
+                    elements[elementId] = dict(entry["state"], id=elementId)
+                elif entry["op"] == "del":
+                    elements.pop(elementId, None)
+                elif entry["op"] == "set" and elementId in elements:
+                    elements[elementId].update(entry["values"])
+
+    return list(elements.values())
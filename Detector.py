@@ -0,0 +1,139 @@
+# Detector.py
+# Detector accumulators: histograms of position, angle and wavelength of the rays arriving at an element, folded in during the trace
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import numpy as np
+
+from TraceEngine import TraceGeometry, iterTrace, rotate, cross, dot, INTENSITY_THRESHOLD, MAX_DEPTH, RAY_LENGTH
+
+HISTOGRAMS = ["position", "angle", "wl"]
+
+class Detector:
+    ### intensity weighted histograms (V, bins) of the hits on an element (state index) of a geometry, per variant:
+    ### position across the element (its local y, 0 is the center), angle of incidence to the interface normal in degrees
+    ### and wavelength, plus running sums for the centroid and the rms size, no rays are kept
+    def __init__(self, geometry, element, bins = 100, angleRange = (-90.0, 90.0), wlRange = (0.2, 2.0), iface = None):
+        self.element = element
+        self.iface = iface
+        self.variants = geometry.variants
+
+        V = self.variants
+        x = geometry.elementsByIndex[element]
+        self.pos = np.broadcast_to(x.pos, (V, 2)).copy()
+        self.rot = np.broadcast_to(x.rot, (V,)).copy()
+
+        height = np.max(getattr(x, "h", np.full(1, 254.0)))
+        self.edges = {
+            "position": np.linspace(-height/2, height/2, bins + 1),
+            "angle": np.linspace(angleRange[0], angleRange[1], bins + 1),
+            "wl": np.linspace(wlRange[0], wlRange[1], bins + 1),
+        }
+        self.histograms = {k: np.zeros((V, bins)) for k in HISTOGRAMS}
+
+        ### source rays carry all their wavelengths until the first hit
+        self.spectra = {x.index: np.broadcast_to(x.wl, (V, x.wl.shape[1])) for x in geometry.sources}
+
+        self.count = np.zeros(V, dtype=np.int64)
+        self.power = np.zeros(V)
+        self.sum = np.zeros(V)
+        self.sumSquares = np.zeros(V)
+
+    def add(self, segments):
+        ### fold in a generation of iterTrace (or the columns of a TraceResult)
+        mask = segments["element"] == self.element
+        if self.iface is not None:
+            mask &= segments["iface"] == self.iface
+        rows = np.flatnonzero(mask)
+        if len(rows) == 0:
+            return
+
+        wl = segments["wl"][rows]
+        direct = segments["depth"][rows] == 0
+        if direct.any():
+            pieces = [(rows[~direct], wl[~direct])]
+            source = segments["source"][rows]
+            for index in np.unique(source[direct]):
+                x = rows[direct & (source == index)]
+                spectrum = self.spectra[index]
+                pieces.append((np.repeat(x, spectrum.shape[1]), spectrum[segments["variant"][x]].reshape(-1)))
+            rows = np.concatenate([x for x, _ in pieces])
+            wl = np.concatenate([x for _, x in pieces])
+
+        V = self.variants
+        variant = segments["variant"][rows]
+        weights = segments["intensity"][rows]
+        d = segments["direction"][rows]
+
+        ### normals point out of the element, the angle is taken to the one facing the ray
+        normal = segments["normal"][rows]
+        normal = normal * np.sign(dot(normal, d))[:, None]
+
+        values = {
+            "position": rotate(segments["end"][rows] - self.pos[variant], -self.rot[variant])[:, 1],
+            "angle": np.degrees(np.arctan2(cross(normal, d), dot(normal, d))),
+            "wl": wl,
+        }
+
+        for key, value in values.items():
+            edges = self.edges[key]
+            bins = len(edges) - 1
+            index = np.searchsorted(edges, value, side="right") - 1
+            index[value == edges[-1]] = bins - 1
+            inside = (index >= 0) & (index < bins)
+            self.histograms[key] += np.bincount(variant[inside]*bins + index[inside], weights[inside], minlength=V*bins).reshape(V, bins)
+
+        y = values["position"]
+        self.count += np.bincount(variant, minlength=V)
+        self.power += np.bincount(variant, weights, minlength=V)
+        self.sum += np.bincount(variant, weights*y, minlength=V)
+        self.sumSquares += np.bincount(variant, weights*y**2, minlength=V)
+
+    def merge(self, other):
+        ### add the hits of another detector of the same element and binning (e.g. of another chunk of rays)
+        for key in HISTOGRAMS:
+            self.histograms[key] += other.histograms[key]
+        self.count += other.count
+        self.power += other.power
+        self.sum += other.sum
+        self.sumSquares += other.sumSquares
+        return self
+
+    def getCenters(self, key):
+        edges = self.edges[key]
+        return (edges[1:] + edges[:-1]) / 2
+
+    def getHistogram(self, key):
+        ### (bin centers, (V, bins) power per bin)
+        return self.getCenters(key), self.histograms[key]
+
+    def getIrradiance(self):
+        ### (bin centers, (V, bins) power per unit length across the element)
+        return self.getCenters("position"), self.histograms["position"] / np.diff(self.edges["position"])
+
+    def getPower(self):
+        return self.power
+
+    def getCount(self):
+        return self.count
+
+    def getCentroid(self):
+        ### (V,) intensity weighted mean position, nan without hits
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.sum / self.power
+
+    def getRms(self):
+        ### (V,) intensity weighted rms size around the centroid
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.sum / self.power
+            return np.sqrt(np.maximum(self.sumSquares / self.power - mean**2, 0))
+
+def detect(states, element, overrides = None, threshold = INTENSITY_THRESHOLD, maxDepth = MAX_DEPTH, rayLength = RAY_LENGTH, **kwargs):
+    ### trace states and fold every generation into a Detector of element (state index), kwargs as for Detector
+    geometry = TraceGeometry(states, overrides)
+    detector = Detector(geometry, element, **kwargs)
+
+    for segments in iterTrace(geometry, threshold, maxDepth, rayLength):
+        detector.add(segments)
+
+    return detector
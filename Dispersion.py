@@ -0,0 +1,129 @@
+# Dispersion.py
+# Group delay, GDD and TOD of a source traced on a dense wavelength grid in one batch, and the pulse shape behind the system
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import numpy as np
+
+from Wavefront import wavefront
+from TraceEngine import INTENSITY_THRESHOLD, MAX_DEPTH, RAY_LENGTH
+
+### speed of light in um/fs and the length of a scene unit (0.1 mm) in um, phases are in rad, omega in rad/fs,
+### group delay in fs, GDD in fs^2 and TOD in fs^3
+SPEED_OF_LIGHT = 0.299792458
+SCENE_UNIT = 100.0
+
+def getGrid(center, span, samples):
+    ### wavelengths (um) equally spaced in omega over center +- span/2, omega ascending
+    omega = 2*np.pi*SPEED_OF_LIGHT / np.array([center + span/2, center - span/2])
+    omega = np.linspace(omega[0], omega[1], samples)
+    return 2*np.pi*SPEED_OF_LIGHT / omega
+
+def getFwhm(x, y):
+    ### full width at half maximum of a single peak, linearly interpolated between the samples
+    above = np.flatnonzero(y >= np.max(y) / 2)
+    if len(above) == 0:
+        return np.nan
+    a, b = above[0], above[-1]
+    half = np.max(y) / 2
+
+    left = x[a] if a == 0 else x[a - 1] + (half - y[a - 1]) / (y[a] - y[a - 1]) * (x[a] - x[a - 1])
+    right = x[b] if b == len(x) - 1 else x[b] + (y[b] - half) / (y[b] - y[b + 1]) * (x[b + 1] - x[b])
+    return right - left
+
+class Dispersion:
+    ### spectral phase of a source at a plane on a grid of wavelengths (um, equally spaced in omega), from the optical path
+    ### length of the strongest crossing of every wavelength; wavelengths not arriving are nan
+    def __init__(self, wl, opl, intensity, position, center):
+        self.wl = wl
+        self.opl = opl
+        self.intensity = intensity
+        self.position = position
+        self.center = center
+
+        self.omega = 2*np.pi*SPEED_OF_LIGHT / wl
+        self.omega0 = 2*np.pi*SPEED_OF_LIGHT / center
+        self.phase = self.omega * opl * SCENE_UNIT / SPEED_OF_LIGHT
+        self.valid = ~np.isnan(opl)
+
+    def __len__(self):
+        return len(self.wl)
+
+    def getGroupDelay(self):
+        ### (W,) d phase / d omega in fs, the optical path of the group
+        return np.gradient(self.phase, self.omega, edge_order=2)
+
+    def getGdd(self):
+        return np.gradient(self.getGroupDelay(), self.omega, edge_order=2)
+
+    def getTod(self):
+        return np.gradient(self.getGdd(), self.omega, edge_order=2)
+
+    def getCoefficients(self, order = 4):
+        ### Taylor coefficients of the phase at the center [phase, GD, GDD, TOD, ...] from a polynomial fit over the grid
+        rows = np.flatnonzero(self.valid)
+        if len(rows) <= order:
+            return np.full(order + 1, np.nan)
+
+        x = self.omega[rows] - self.omega0
+        scale = np.max(np.abs(x))
+        fit = np.polynomial.polynomial.polyfit(x / scale, self.phase[rows], order)
+        k = np.arange(order + 1)
+        return fit * np.cumprod(np.maximum(k, 1)) / scale**k
+
+    def getResidualPhase(self, order = 1):
+        ### (W,) phase without its Taylor terms up to order (1 removes the constant phase and the group delay)
+        c = self.getCoefficients(max(order, 4))
+        x = self.omega - self.omega0
+        k = np.arange(order + 1)
+        return self.phase - np.sum(c[:order + 1] / np.cumprod(np.maximum(k, 1)) * x[:, None]**k, axis=1)
+
+    def getSpectrum(self, bandwidth):
+        ### (W,) field amplitude of a gaussian spectrum with an intensity FWHM of bandwidth (um) around the center,
+        ### zero where the wavelength does not arrive
+        width = 2*np.pi*SPEED_OF_LIGHT * bandwidth / self.center**2
+        amplitude = np.exp(-2*np.log(2)*(self.omega - self.omega0)**2 / width**2)
+        return np.where(self.valid, amplitude*np.sqrt(np.nan_to_num(self.intensity)), 0.0)
+
+    def getPulse(self, bandwidth, padding = 16, limited = False):
+        ### (t in fs, intensity normalized to 1) of a gaussian pulse behind the system by FFT of its spectrum with the residual
+        ### phase, limited ignores the phase (the transform limit), padding refines the time steps
+        field = self.getSpectrum(bandwidth).astype(complex)
+        if not limited:
+            field *= np.exp(-1j*np.nan_to_num(self.getResidualPhase()))
+
+        n = len(field)*padding
+        step = self.omega[1] - self.omega[0]
+        pulse = np.abs(np.fft.fftshift(np.fft.ifft(field, n)))**2
+        t = (np.arange(n) - n//2) * 2*np.pi / (n*step)
+        return t, pulse / np.max(pulse)
+
+    def getDuration(self, bandwidth, limited = False, padding = 16):
+        ### FWHM of the pulse intensity in fs
+        return getFwhm(*self.getPulse(bandwidth, padding, limited))
+
+def dispersion(states, source, point, normal, center = 1.03, span = 0.1, samples = 1024, overrides = None, variant = 0,
+    threshold = INTENSITY_THRESHOLD, maxDepth = MAX_DEPTH, rayLength = RAY_LENGTH):
+    ### Dispersion of source (state index) at the plane through point with normal: the source (the axis ray of a beam) gets
+    ### samples wavelengths over center +- span/2 and splits into all of them at the first hit, they are traced together
+    wl = getGrid(center, span, samples)
+    states = list(states)
+    states[source] = dict(states[source], wl=list(wl))
+    if states[source]["type"] == "BeamElement":
+        states[source]["count"] = 1
+
+    w = wavefront(states, source, point, normal, overrides, variant, threshold, maxDepth, rayLength)
+
+    ### strongest crossing of every wavelength
+    opl, intensity, position = np.full(samples, np.nan), np.full(samples, np.nan), np.full(samples, np.nan)
+    if len(w) > 0:
+        k = np.searchsorted(-wl, -w.wl)
+        order = np.lexsort((w.intensity, k))
+        last = np.append(k[order][1:] != k[order][:-1], True)
+        rows = order[last]
+
+        opl[k[rows]] = w.opl[rows]
+        intensity[k[rows]] = w.intensity[rows]
+        position[k[rows]] = w.position[rows]
+
+    return Dispersion(wl, opl, intensity, position, center)
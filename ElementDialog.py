@@ -4,7 +4,7 @@
 # Released under GNU Public License (GPL)
 
 from PyQt5.QtWidgets import QDialog, QFormLayout, QComboBox, QListWidget, QVBoxLayout, QHBoxLayout, QPushButton, \
-        QWidget, QLabel, QColorDialog, QDoubleSpinBox, QShortcut, QListWidgetItem, QCheckBox
+        QWidget, QLabel, QColorDialog, QDoubleSpinBox, QShortcut, QListWidgetItem, QCheckBox, QSpinBox, QLineEdit
 
 from PyQt5 import QtGui, QtCore
 from OpticalElement import *
@@ -238,6 +238,29 @@ class ElementDialog(QDialog):
                 self.cbMat.setCurrentText(self.state["mat"])
                 self.cbMat.currentIndexChanged.connect(self.matChanged)
                 layout.addRow("Material", self.cbMat)
+            elif k == "mode":
+                self.cbMode = QComboBox()
+                self.cbMode.addItems(self.element.modes)
+                self.cbMode.setCurrentText(self.state["mode"])
+                self.cbMode.currentIndexChanged.connect(self.modeChanged)
+                layout.addRow("Mode", self.cbMode)
+            elif k == "fresnel":
+                self.cbFresnel = QComboBox()
+                self.cbFresnel.addItems(self.element.fresnelModes)
+                self.cbFresnel.setCurrentText(self.state["fresnel"])
+                self.cbFresnel.currentIndexChanged.connect(self.fresnelChanged)
+                layout.addRow("Fresnel", self.cbFresnel)
+            elif k in ("count", "seed", "bins"):
+                sbInt = QSpinBox()
+                sbInt.setMinimum(0 if k == "seed" else 1)
+                sbInt.setMaximum(2**31-1 if k == "seed" else 100000)
+                sbInt.setValue(self.state[k])
+                sbInt.valueChanged.connect(lambda x,k=k: self.valChange(x, k))
+                layout.addRow(k, sbInt)
+            elif k in ("orders", "efficiencies"):
+                leList = QLineEdit(", ".join(f"{x:g}" for x in v))
+                leList.textChanged.connect(lambda x,k=k: self.listChanged(x, k))
+                layout.addRow(k, leList)
             else:
                 sbEdit = QDoubleSpinBox()
                 sbEdit.setMinimum(-10000)
@@ -265,8 +288,25 @@ class ElementDialog(QDialog):
         # print(key, value)
         self.state[key] = value
                 
+    def listChanged(self, text, key):
+        ### comma separated numbers, the last valid list is kept while typing
+        try:
+            values = [float(x) for x in text.replace(",", " ").split()]
+        except ValueError:
+            return
+
+        if key == "orders":
+            values = [int(x) for x in values]
+        self.state[key] = values
+
     def matChanged(self, idx):
         self.state["mat"] = self.cbMat.currentText()
+
+    def modeChanged(self, idx):
+        self.state["mode"] = self.cbMode.currentText()
+
+    def fresnelChanged(self, idx):
+        self.state["fresnel"] = self.cbFresnel.currentText()
         
         
     def delWLEntry(self):
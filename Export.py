@@ -0,0 +1,91 @@
+# Export.py
+# Columnar export of traced segments to npz, Arrow (Feather) or Parquet, written from the arrays of the vectorized trace
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import os
+
+import numpy as np
+
+from TraceEngine import TraceResult
+
+FORMATS = {".npz": "npz", ".arrow": "arrow", ".feather": "arrow", ".parquet": "parquet"}
+
+def getColumns(segments, elementIds = None):
+    ### flat 1-D columns of a generation or the columns of a TraceResult, (n, 2) columns are split into <key>_x / <key>_y
+    ### element and source are mapped from state indices to the ids in elementIds (array by state index) if given,
+    ### misses keep -1; derivative columns (n, P, 2) are left out
+    columns = {}
+    for key, value in segments.items():
+        value = np.asarray(value)
+        if value.ndim == 1:
+            if elementIds is not None and key in ("element", "source"):
+                value = np.append(elementIds, -1)[value]
+            columns[key] = value
+        elif value.ndim == 2 and value.shape[1] == 2:
+            columns[key + "_x"] = np.ascontiguousarray(value[:, 0])
+            columns[key + "_y"] = np.ascontiguousarray(value[:, 1])
+    return columns
+
+def getFormat(fileName, format = None):
+    if format is not None:
+        return format
+    ext = os.path.splitext(fileName)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f"Unknown export format {ext}")
+    return FORMATS[ext]
+
+def exportSegments(fileName, generations, elementIds = None, format = None):
+    ### write an iterable of generations (Stream.iterSegments, iterTrace or [result.columns]) to one table,
+    ### Arrow and Parquet are written batch by batch, npz needs all rows at once
+    ### returns the number of rows
+    format = getFormat(fileName, format)
+    rows = 0
+
+    if format == "npz":
+        parts = [getColumns(x, elementIds) for x in generations]
+        if len(parts) == 0:
+            parts = [getColumns(TraceResult.emptyColumns(), elementIds)]
+        columns = {k: np.concatenate([x[k] for x in parts]) for k in parts[0]}
+        np.savez(fileName, **columns)
+        return len(columns["variant"])
+
+    import pyarrow as pa
+
+    def toBatch(segments):
+        ### contiguous numeric arrays are wrapped without copies
+        return pa.RecordBatch.from_pydict({k: pa.array(v) for k, v in getColumns(segments, elementIds).items()})
+
+    def openWriter(schema):
+        if format == "arrow":
+            return pa.ipc.new_file(fileName, schema)
+        elif format == "parquet":
+            import pyarrow.parquet as pq
+            return pq.ParquetWriter(fileName, schema)
+        raise ValueError(f"Unknown export format {format}")
+
+    writer = None
+    try:
+        for segments in generations:
+            batch = toBatch(segments)
+            if writer is None:
+                writer = openWriter(batch.schema)
+
+            if format == "arrow":
+                writer.write_batch(batch)
+            else:
+                writer.write_table(pa.Table.from_batches([batch]))
+            rows += batch.num_rows
+
+        ### an empty trace still gets a file with all columns
+        if writer is None:
+            writer = openWriter(toBatch(TraceResult.emptyColumns()).schema)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return rows
+
+def exportResult(fileName, result, elementIds = None, format = None):
+    ### all segments of a TraceResult
+    return exportSegments(fileName, [result.columns], elementIds, format)
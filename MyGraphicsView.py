@@ -81,9 +81,13 @@ class MyGraphicsView(QGraphicsView):
                 x = GratingElement()
             elif item.text() == "Beamblock":
                 x = BeamBlockElement()
+            elif item.text() == "Detector":
+                x = DetectorElement()
             elif item.text() == "Ray":
                 x = RayElement(0,0,2000,0)
                 x.setWavelength([0.8,0.9,1.0,1.1,1.2])
+            elif item.text() == "Beam":
+                x = BeamElement()
                 
             else:
                 return
@@ -131,8 +135,9 @@ class MyGraphicsView(QGraphicsView):
             if ctrl:
                 self.copyItems = [x.getState() for x in itms]
                 self.copyPos = self.mapFromGlobal(QtGui.QCursor().pos())
-                for itm in itms:
-                    self.scene().removeElement(itm)
+                with self.scene().batchUpdate():
+                    for itm in itms:
+                        self.scene().removeElement(itm)
                 
         if key == QtCore.Qt.Key.Key_V:
             if ctrl:
@@ -140,17 +145,18 @@ class MyGraphicsView(QGraphicsView):
                 delta = pastePos - self.copyPos
 
                 if self.copyItems is not None:
-                    for itm in self.copyItems:
-                        el = self.scene().createElementFromState(itm)
-                        el.setPos(el.pos()+delta)
-                        self.scene().addElement(el)
+                    with self.scene().batchUpdate():
+                        for itm in self.copyItems:
+                            el = self.scene().createElementFromState(itm)
+                            el.setPos(el.pos()+delta)
+                            self.scene().addElement(el)
                         
 
         if len(itms) == 0:
             return super().keyPressEvent(event)
 
         for itm in itms:
-            if not isinstance(itm, OpticalElement) and not isinstance(itm, RayElement):
+            if not isinstance(itm, (OpticalElement, RayElement, BeamElement)):
                 continue
             
             ### only act on parent rays
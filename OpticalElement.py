@@ -11,10 +11,10 @@ from PyQt5 import QtGui, QtCore
 from PyQt5.QtWidgets import QApplication
 
 import math
+import numpy as np
 from Material import Materials
 import vectors
 
-from UndoRedo import UndoRedoItem, UndoRedoType
 from ElementDialog import *
 
 def blendColors(color1 : QtGui.QColor, color2: QtGui.QColor, ratio : float = 0.5):
@@ -35,27 +35,39 @@ def blendColors(color1 : QtGui.QColor, color2: QtGui.QColor, ratio : float = 0.5
 class RayElement(QGraphicsObject):
     itemMovedOrRotated = QtCore.pyqtSignal()
 
+    fresnelModes = ["off", "s", "p", "unpolarized"]
+
     def __init__(self, x1=0, y1=0, x2=2000, y2=0, intensity = 1.0, wl=[1.03], color = None, showArrow = False, parent = None):
         super(RayElement, self).__init__()
 
         self._line = QtCore.QLineF(x1,y1,x2,y2)
+        self._shape = None
         # self.setCacheMode(QGraphicsObject.CacheMode.ItemCoordinateCache)
 
-        self.setFlag(QGraphicsLineItem.GraphicsItemFlag.ItemSendsGeometryChanges)
-
         self.setCacheMode(QGraphicsObject.CacheMode.NoCache)
         
         self.setFlag(QGraphicsLineItem.GraphicsItemFlag.ItemIsSelectable)
         
+        ### only source rays can be moved, traced segments are placed by the scene without notifications
         if parent is None:            
             self.setFlag(QGraphicsLineItem.GraphicsItemFlag.ItemIsMovable)
+            self.setFlag(QGraphicsLineItem.GraphicsItemFlag.ItemSendsGeometryChanges)
 
         self.handled = False
         self.intensity = intensity
 
         self.parent = parent
 
-        self.children = []
+        ### Fresnel mode of the source (see TraceEngine.FRESNEL) and the part of the intensity in s polarization
+        self.fresnel = "off"
+        self.sFraction = 0.5
+
+        ### position in the scene's ray tree, set when the ray is added to a TraceScene
+        self.tree = None
+        self.treeIndex = -1
+
+        ### id of a source ray in the scene, used by the undo / redo journal
+        self.elementId = None
 
         # self.color = color
         self.setWavelength(wl)
@@ -70,8 +82,17 @@ class RayElement(QGraphicsObject):
         self.snap = True
         self.brMargin = QtCore.QMarginsF(10,10,10,10)
 
-        if self.parent is not None:
-            self.parent.addChild(self)
+    def setSegment(self, x1, y1, x2, y2, intensity, wl, color, showArrow, parent):
+        ### reinitialize a pooled segment instead of constructing a new item
+        self.setLine(QtCore.QLineF(x1,y1,x2,y2))
+        self.handled = False
+        self.intensity = intensity
+        self.parent = parent
+        self.wl = wl
+        self.color = [color]
+        self.showArrow = showArrow
+        self.fresnel = "off"
+        self.sFraction = 0.5
 
     def setWavelength(self, wl):
         self.wl = wl
@@ -104,7 +125,8 @@ class RayElement(QGraphicsObject):
             "rot": self.rotation(),
             "intensity": self.intensity,
             "wl": self.wl,
-            "arrows": self.showArrow
+            "arrows": self.showArrow,
+            "fresnel": self.fresnel
         }
 
         state_dict["color"] = None
@@ -141,6 +163,10 @@ class RayElement(QGraphicsObject):
             self.showArrow = state_dict["arrows"]
         except KeyError:
             pass
+        try:
+            self.fresnel = state_dict["fresnel"]
+        except KeyError:
+            pass
         
         ### load colors
         colors = state_dict["color"]
@@ -170,6 +196,11 @@ class RayElement(QGraphicsObject):
         return dlg
 
     def getParents(self, first = False):
+        if self.tree is not None:
+            for idx in self.tree.getPath(self.treeIndex):
+                yield self.tree.getItem(idx)
+            return
+
         if self.parent is not None:
             for ray in self.parent.getParents():
                 yield ray
@@ -177,12 +208,18 @@ class RayElement(QGraphicsObject):
         yield self
 
     def setLine(self, line):
+        self.prepareGeometryChange()
         self._line = line
+        self._shape = None
 
     def line(self) -> QtCore.QLineF:
         return self._line
 
     def shape(self) -> QtGui.QPainterPath:
+        ### the scene asks for the shape on every collision test, it only changes with the line
+        if self._shape is not None:
+            return self._shape
+
         path = QtGui.QPainterPath(self.line().p1())
         path.lineTo(self.line().p2())
         path.closeSubpath()
@@ -192,28 +229,39 @@ class RayElement(QGraphicsObject):
         stroker.setJoinStyle(QtCore.Qt.PenJoinStyle.MiterJoin)
         cpath = (stroker.createStroke(path) + path).simplified()
 
-            
+        self._shape = cpath
         return cpath
         # return super().shape()
 
     def boundingRect(self) -> QtCore.QRectF:
-        rect = QtCore.QRectF(self.line().p1(), self.line().p2())
+        ### normalized, the scene index does not find items with a negative width or height
+        rect = QtCore.QRectF(self.line().p1(), self.line().p2()).normalized()
         return rect.marginsAdded(self.brMargin)
 
-    def addChild(self, child):
-        self.children.append(child)
-        
-    def getChildren(self):
-        return self.children
+    def getRoot(self):
+        if self.tree is not None:
+            return self.tree.getItem(self.tree.getRoot(self.treeIndex))
 
-    def removeChildren(self):
-        for child in self.children:
-            child.removeChildren()
+        ray = self
+        while ray.parent is not None:
+            ray = ray.parent
+        return ray
 
-            if self.scene() is not None:
-                self.scene().removeItem(child)
+    def getDepth(self):
+        if self.tree is not None:
+            return self.tree.getDepth(self.treeIndex)
 
-        self.children = []
+        return 0 if self.parent is None else self.parent.getDepth() + 1
+
+    def getChildren(self):
+        if self.tree is None:
+            return []
+
+        return [self.tree.getItem(x) for x in self.tree.getChildren(self.treeIndex)]
+
+    def removeChildren(self):
+        if self.scene() is not None:
+            self.scene().removeRaySubtree(self, includeSelf=False)
 
     def setEndPoint(self, p:QtCore.QPointF):
         line = self.line()
@@ -237,6 +285,7 @@ class RayElement(QGraphicsObject):
 
     def setLinewidth(self, lw):
         self.linewidth = lw
+        self._shape = None
 
     def getLinewidth(self):
         return self.linewidth
@@ -271,26 +320,32 @@ class RayElement(QGraphicsObject):
             if self.snap and not ctrl:
                 delta = self.getSnapPos(delta)
 
-            return self.pos() + delta
+            value = self.pos() + delta
+            self.scene().recordChange(self, "pos", [self.pos().x(), self.pos().y()], [value.x(), value.y()])
 
-        elif change == QGraphicsItem.GraphicsItemChange.ItemPositionHasChanged or change == QGraphicsItem.GraphicsItemChange.ItemRotationHasChanged:
-            self.removeChildren()
+            return value
 
-            if self.parent is not None:
-                self.parent.handled = False
-                self.parent.setLength(2000)
-                self.parent.removeChildren()
-            else:
-                self.handled = False
+        elif change == QGraphicsItem.GraphicsItemChange.ItemRotationChange:
+            self.scene().recordChange(self, "rot", self.rotation(), value)
+
+        elif change == QGraphicsItem.GraphicsItemChange.ItemPositionHasChanged or change == QGraphicsItem.GraphicsItemChange.ItemRotationHasChanged:
+            self.scene().invalidateRays([self])
             
             self.itemMovedOrRotated.emit()
 
         return super().itemChange(change, value)
 
+    def getViewScale(self):
+        ### zoom of the first view, scenes rendered without a view (export, batch) are drawn unscaled
+        views = self.scene().views()
+        if len(views) < 1:
+            return 1.0
+        return views[0].transform().m11()
+
     def drawArror(self, painter : QtGui.QPainter, point : QtCore.QPointF(), dir: QtCore.QPointF(), arrowWidth=10, arrowHeight=8, centered = True):
         ndir = vectors.normalDir(point, point+dir)
         
-        scale = self.scene().views()[0].transform().m11()
+        scale = self.getViewScale()
         if arrowWidth / scale > arrowWidth:
             arrowWidth /= scale
         
@@ -306,7 +361,7 @@ class RayElement(QGraphicsObject):
             
     def paint(self, painter: QtGui.QPainter, option: QStyleOptionGraphicsItem, widget):
 
-        scale = self.scene().views()[0].transform().m11()
+        scale = self.getViewScale()
         lw = int(self.linewidth / scale)
         
         if lw < self.linewidth:
@@ -373,14 +428,265 @@ class RayElement(QGraphicsObject):
     def __repr__(self) -> str:
         return f"<{self.__class__.__name__}: {self.pos()} {self.line()}>"
 
+class BeamElement(QGraphicsObject):
+    ### a bundle of rays moved and selected as one item, traced in one batch by the scene (see TraceScene.traceBeams)
+    itemMovedOrRotated = QtCore.pyqtSignal()
+
+    modes = ["collimated", "point", "gaussian"]
+    fresnelModes = ["off", "s", "p", "unpolarized"]
+
+    def __init__(self, mode = "collimated", count = 101, width = 200.0, divergence = 10.0, intensity = 1.0, wl = [1.03], seed = 0,
+        fresnel = "off"):
+        super(BeamElement, self).__init__()
+
+        self.setCacheMode(QGraphicsObject.CacheMode.NoCache)
+
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsSelectable)
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsMovable)
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemSendsGeometryChanges)
+
+        self.mode = mode
+        self.count = count
+        self.width = width
+        self.divergence = divergence
+        self.intensity = intensity
+        self.seed = seed
+        self.fresnel = fresnel
+        self.setWavelength(wl)
+
+        self.elementId = None
+
+        ### traced segments in item coordinates grouped to (color index, intensity level, lines), set by the scene
+        self.lines = []
+        self.traceRect = QtCore.QRectF()
+        self.traceKey = None
+
+        self.linewidth = 2
+        self.snap = True
+        self.brMargin = QtCore.QMarginsF(10,10,10,10)
+
+    def setWavelength(self, wl):
+        self.wl = wl
+        self.color = self.getColors()
+
+    def getColors(self, wl = None):
+        if wl is None:
+            wl = self.wl
+        return [QtGui.QColor().fromHslF((1-((x+1)/(len(wl))))*0.9, 0.95, 0.5, 0.75) for x in range(len(wl))]
+
+    def getPixmap(self, pix_size = QtCore.QSize(200,200)):
+
+        pm = QtGui.QPixmap(pix_size)
+        pm.fill(QtCore.Qt.GlobalColor.transparent)
+        painter = QtGui.QPainter(pm)
+        painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+        painter.setPen(QtGui.QPen(QtGui.QColor("black"),2))
+        painter.drawLine(QtCore.QLineF(pix_size.width()/4,pix_size.height()/4,pix_size.width()/4,pix_size.height()*3/4))
+        for k in range(5):
+            y = pix_size.height()*(1+k)/6
+            painter.drawLine(QtCore.QLineF(pix_size.width()/4,y,pix_size.width()*3/4,y))
+        painter.end()
+
+        return pm
+
+    def getState(self):
+        state_dict = {
+            "type": self.__class__.__name__,
+            "pos": [self.pos().x(), self.pos().y()],
+            "rot": self.rotation(),
+            "mode": self.mode,
+            "count": self.count,
+            "width": self.width,
+            "divergence": self.divergence,
+            "seed": self.seed,
+            "intensity": self.intensity,
+            "wl": self.wl,
+            "fresnel": self.fresnel,
+        }
+
+        state_dict["color"] = None
+        if self.color is not None:
+            state_dict["color"] = [x.getRgb() for x in self.color]
+
+        return state_dict
+
+    def setState(self, state_dict):
+        try:
+            pos = state_dict["pos"]
+            self.setPos(QtCore.QPointF(pos[0], pos[1]))
+        except KeyError:
+            pass
+
+        try:
+            self.setRotation(state_dict["rot"])
+        except KeyError:
+            pass
+
+        self.prepareGeometryChange()
+        for k in ("mode", "count", "width", "divergence", "seed", "intensity", "fresnel"):
+            try:
+                setattr(self, k, state_dict[k])
+            except KeyError:
+                pass
+        self.count = int(self.count)
+        self.seed = int(self.seed)
+
+        try:
+            self.setWavelength(state_dict["wl"])
+        except KeyError:
+            pass
+
+        ### load colors
+        colors = state_dict.get("color")
+        if colors is not None:
+            self.color = [QtGui.QColor().fromRgb(*x) for x in colors]
+
+        self.update()
+
+    def getDialog(self):
+        return ElementDialog(self)
+
+    def setTrace(self, start, end, wl, intensity):
+        ### segments in scene coordinates, wl nan for segments carrying all wavelengths of the beam
+        self.prepareGeometryChange()
+        self.lines = []
+        self.traceRect = QtCore.QRectF()
+
+        if len(start) == 0:
+            return
+
+        alpha = -math.radians(self.rotation())
+        c, s = math.cos(alpha), math.sin(alpha)
+        pos = np.array([self.pos().x(), self.pos().y()])
+
+        def toItem(p):
+            p = p - pos
+            return np.stack([p[:, 0]*c - p[:, 1]*s, p[:, 0]*s + p[:, 1]*c], axis=1)
+
+        points = np.concatenate([toItem(start), toItem(end)], axis=1)
+
+        ### few pens: one per wavelength and quarter of the intensity
+        color = np.full(len(wl), -1)
+        for k, x in enumerate(self.wl):
+            color[np.isclose(wl, x)] = k
+        level = np.clip(np.ceil(np.asarray(intensity)*4), 1, 4).astype(int)
+
+        for k, l in sorted(set(zip(color.tolist(), level.tolist()))):
+            mask = (color == k) & (level == l)
+            self.lines.append((k, l/4, [QtCore.QLineF(*x) for x in points[mask].tolist()]))
+
+        lo = np.minimum(points[:, :2], points[:, 2:]).min(axis=0)
+        hi = np.maximum(points[:, :2], points[:, 2:]).max(axis=0)
+        self.traceRect = QtCore.QRectF(lo[0], lo[1], hi[0] - lo[0], hi[1] - lo[1])
+
+    def getMarkerRect(self):
+        h = max(self.width, 40) if self.mode != "point" else 40
+        return QtCore.QRectF(-10, -h/2-10, 120, h+20)
+
+    def shape(self) -> QtGui.QPainterPath:
+        ### only the source marker selects the beam, not its rays
+        path = QtGui.QPainterPath()
+        path.addRect(self.getMarkerRect())
+        return path
+
+    def boundingRect(self) -> QtCore.QRectF:
+        return self.getMarkerRect().united(self.traceRect).marginsAdded(self.brMargin)
+
+    def setSnap(self, state):
+        self.snap = state
+
+    def getSnap(self):
+        return self.snap
+
+    def getSnapPos(self, point, step = None):
+        if step is None:
+            step = self.scene().getGridSize()
+        return QtCore.QPointF(round(point.x() / step)*step, round(point.y() / step)*step)
+
+    def itemChange(self, change: QGraphicsItem.GraphicsItemChange, value):
+
+        if self.scene() is None:
+            return super().itemChange(change, value)
+
+        if change == QGraphicsItem.GraphicsItemChange.ItemPositionChange:
+
+            mod = QApplication.keyboardModifiers()
+
+            ctrl = mod & QtCore.Qt.KeyboardModifier.ControlModifier
+
+            delta = value - self.pos()
+
+            if self.snap and not ctrl:
+                delta = self.getSnapPos(delta)
+
+            value = self.pos() + delta
+            self.scene().recordChange(self, "pos", [self.pos().x(), self.pos().y()], [value.x(), value.y()])
+
+            return value
+
+        elif change == QGraphicsItem.GraphicsItemChange.ItemRotationChange:
+            self.scene().recordChange(self, "rot", self.rotation(), value)
+
+        elif change == QGraphicsItem.GraphicsItemChange.ItemPositionHasChanged or change == QGraphicsItem.GraphicsItemChange.ItemRotationHasChanged:
+            self.itemMovedOrRotated.emit()
+
+        return super().itemChange(change, value)
+
+    def getViewScale(self):
+        views = self.scene().views() if self.scene() is not None else []
+        if len(views) < 1:
+            return 1.0
+        return views[0].transform().m11()
+
+    def paint(self, painter: QtGui.QPainter, option: QStyleOptionGraphicsItem, widget):
+
+        ### rays with one pixel wide pens, intensity compressed as for single rays
+        comp = 0.3
+        for k, level, lines in self.lines:
+            if k >= 0:
+                col = self.color[k]
+            else:
+                col = self.color[0]
+                for c in self.color[1:]:
+                    col = blendColors(col, c)
+
+            r,g,b,a = col.getRgbF()
+            pen = QtGui.QPen(QtGui.QColor().fromRgbF(r,g,b,math.sin(a*level*math.pi/2)*(1-comp)+comp), 1)
+            pen.setCosmetic(True)
+            painter.setPen(pen)
+            painter.drawLines(lines)
+
+        scale = self.getViewScale()
+        lw = int(self.linewidth / scale)
+        if lw < self.linewidth:
+            lw = self.linewidth
+        if option.state & QStyle.StateFlag.State_Selected:
+            lw *= 2
+
+        painter.setPen(QtGui.QPen(QtGui.QColor("black"), lw, QtCore.Qt.PenStyle.SolidLine, QtCore.Qt.PenCapStyle.RoundCap))
+
+        ### aperture of the beam, a point source is drawn as a dot
+        if self.mode == "point":
+            painter.drawEllipse(QtCore.QPointF(0, 0), 10, 10)
+        else:
+            painter.drawLine(QtCore.QLineF(0, -self.width/2, 0, self.width/2))
+        painter.drawLine(QtCore.QLineF(0, 0, 100, 0))
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__}: {self.pos()} {self.mode} {self.count}>"
+
                         
 class Interface(QtGui.QPainterPath):
-    def __init__(self, t = 1.0, r = 0.0, lines = None, pen = None):
+    def __init__(self, t = 1.0, r = 0.0, lines = None, pen = None, orders = (-1,), efficiencies = (1.0,)):
         super(Interface, self).__init__()
         self.t = t
         self.r = r
         self.lines = lines
 
+        ### diffraction orders of a grating (lines) and the part of the light going into each of them
+        self.orders = orders
+        self.efficiencies = efficiencies
+
         if self.r == 0 and self.t == 0:
             pen = QtGui.QPen(QtGui.QColor("black"), 4)
             
@@ -416,7 +722,6 @@ class OpticalElement(QGraphicsObject):
         self.normalScaleLength = 20
         self.brMargin = QtCore.QMarginsF(10,10,10,10)
 
-        self.rays = []
         self.setZValue(100)
 
         self.snap = True
@@ -424,6 +729,9 @@ class OpticalElement(QGraphicsObject):
         
         self.oldPos = QtCore.QPointF()        
 
+        ### id in the scene, used by the undo / redo journal
+        self.elementId = None
+
         self.update()
 
     def getState(self):
@@ -561,53 +869,28 @@ class OpticalElement(QGraphicsObject):
             itms = self.scene().items(cpath, QtCore.Qt.ItemSelectionMode.IntersectsItemShape)
             itms = [x for x in itms if isinstance(x, OpticalElement) and x is not self]
 
-            if len(itms) > 0:
+            if len(itms) > 0 and self.scene().rejectOverlaps:
                 # print("done: ", self.oldPos)
                 return self.oldPos
 
-            hi = UndoRedoItem(self, UndoRedoType.elementParamChanged,"pos", self.pos())
-                
-            ### if last entry in history is the same, update the value there
-            hist = self.scene().history
-                
-            if not (len(hist) > 0 and hist[-1].getElement() == self and hist[-1].getType() == hi.getType()):
-                hist.append(hi)
-                            
             value = self.pos() + delta
+
+            ### continuous moves are merged into one entry by the journal
+            self.scene().recordChange(self, "pos", [self.pos().x(), self.pos().y()], [value.x(), value.y()])
+
             self.oldPos = value
             # print("done: ", self.oldPos)
             return value
         elif change == QGraphicsItem.GraphicsItemChange.ItemRotationChange:
-            hi = UndoRedoItem(self, UndoRedoType.elementParamChanged, "rot", self.rotation())
-                
-            ### if last entry in history is the same, update the value there
-            hist = self.scene().history
-                
-            if not (len(hist) > 0 and hist[-1].getElement() == self and hist[-1].getType() == hi.getType()):
-                hist.append(hi)
-                            
+            self.scene().recordChange(self, "rot", self.rotation(), value)
 
         elif change == QGraphicsItem.GraphicsItemChange.ItemPositionHasChanged or change == QGraphicsItem.GraphicsItemChange.ItemRotationHasChanged:
-            itms = self.collidingItems(QtCore.Qt.ItemSelectionMode.IntersectsItemBoundingRect)
-
-            rays = [x for x in itms if isinstance(x, RayElement)]
-            rays.extend(self.rays)
-
-            for ray in rays:
-
-                ray.removeChildren()
-
-                if ray.parent is not None:
-                    ray.parent.handled = False
-                    ray.parent.setLength(2000)
-                    ray.parent.removeChildren()
-                else:
-                    ray.handled = False
-
-                # if self.scene() is not None and ray in self.scene().rays:
-                #     print("removing ray from scene.rays")
-                #     self.scene().rays.remove(ray)
+            ### rays that hit the element before the change and rays crossing it now
+            scene = self.scene()
+            rays = scene.getElementRays(self)
+            rays.extend(scene.getCrossingRays(self))
 
+            scene.invalidateRays(rays)
                 
             self.itemMovedOrRotated.emit()
 
@@ -915,6 +1198,23 @@ class BeamBlockElement(MirrorElement):
 
 
         
+class DetectorElement(BeamBlockElement):
+    ### absorbs like a beam block, the hits are binned by TraceScene.detect (see Detector.py)
+    def __init__(self, height=254, thickness=10, bins=100):
+        super(DetectorElement, self).__init__(height=height, thickness=thickness)
+        self.bins = bins
+
+        self.setPen(QtGui.QPen(QtGui.QBrush(QtGui.QColor("darkBlue")), 2, QtCore.Qt.PenStyle.SolidLine, QtCore.Qt.PenCapStyle.RoundCap, QtCore.Qt.PenJoinStyle.RoundJoin))
+
+    def setState(self, state_dict):
+        self.bins = int(state_dict.get("bins", self.bins))
+        super().setState(state_dict)
+
+    def getState(self):
+        dict = super().getState()
+        dict["bins"] = self.bins
+        return dict
+
 class PolygonElement(OpticalElement):
     def __init__(self, material):
         self.polygon = QtGui.QPolygonF()
@@ -1006,11 +1306,13 @@ class PrismElement(PolygonElement):
 
         
 class GratingElement(OpticalElement):
-    def __init__(self, material = "BK7", lines=600, height=254, thickness=60):
+    def __init__(self, material = "BK7", lines=600, height=254, thickness=60, orders=(-1,), efficiencies=(1.0,)):
 
         self.height = height
         self.thickness = thickness
         self.lines = lines
+        self.orders = list(orders)
+        self.efficiencies = list(efficiencies)
         super(GratingElement, self).__init__(material)
 
 
@@ -1029,7 +1331,7 @@ class GratingElement(OpticalElement):
                 
         pen.setDashPattern([dist, 4])
         pen.setCapStyle(QtCore.Qt.PenCapStyle.RoundCap)
-        ifac2 = Interface(lines = self.lines, pen = pen)
+        ifac2 = Interface(lines = self.lines, pen = pen, orders = self.orders, efficiencies = self.efficiencies)
         
         
         ifac2.moveTo(-self.thickness/2, self.height/2)
@@ -1042,12 +1344,19 @@ class GratingElement(OpticalElement):
         dict["lines"] = self.lines
         dict["height"] = self.height
         dict["thickness"] = self.thickness
+        dict["orders"] = list(self.orders)
+        dict["efficiencies"] = list(self.efficiencies)
         return dict
 
     def setState(self, state_dict):
         self.lines = state_dict["lines"]
         self.height = state_dict["height"]
         self.thickness = state_dict["thickness"]
+        self.orders = list(state_dict.get("orders", [-1]))
+
+        ### orders without an efficiency get none
+        efficiencies = list(state_dict.get("efficiencies", [1.0]*len(self.orders)))
+        self.efficiencies = (efficiencies + [0.0]*len(self.orders))[:len(self.orders)]
 
         super().setState(state_dict)
 
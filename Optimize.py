@@ -0,0 +1,266 @@
+# Optimize.py
+# Optimization of element parameters against merit functions, every simplex or population step is traced as one batch
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import numpy as np
+
+from TraceEngine import TraceGeometry, trace, INTENSITY_THRESHOLD, MAX_DEPTH
+
+def _weightedStats(variant, values, weights, V):
+    ### per variant weighted mean and rms deviation of (n,) or (n, 2) values, nan for variants without values
+    values = values.reshape(len(values), -1)
+    w = np.bincount(variant, weights, minlength=V)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.stack([np.bincount(variant, weights*x, minlength=V) for x in values.T], axis=1) / w[:, None]
+        dev = ((values - mean[variant])**2).sum(axis=1)
+        rms = np.sqrt(np.bincount(variant, weights*dev, minlength=V) / w)
+
+    return mean, rms
+
+class Merit:
+    ### merit of the rays arriving at an element, lower is better, (V,) values for a trace of V variants
+    ### a variant that brings fewer rays to the element than the starting design is rejected (inf), otherwise
+    ### a design that loses all but one ray would have the best spot
+    def __init__(self, element, weight = 1.0, iface = None):
+        self.element = element
+        self.index = element
+        self.weight = weight
+        self.iface = iface
+        self.minHits = 1
+
+    def bind(self, items):
+        ### element objects -> state index, for optimizations started from a scene
+        if not isinstance(self.element, (int, np.integer)):
+            self.index = items.index(self.element)
+
+    def getRows(self, result):
+        return result.getElementRows(self.index, self.iface)
+
+    def setReference(self, result):
+        ### result of the starting design, a single variant
+        self.minHits = max(1, len(self.getRows(result)))
+
+    def __call__(self, result, V):
+        rows = self.getRows(result)
+        variant = result["variant"][rows]
+
+        value = self.evaluate(result, rows, variant, V)
+        return np.where(np.bincount(variant, minlength=V) < self.minHits, np.inf, self.weight*value)
+
+    def evaluate(self, result, rows, variant, V):
+        return np.zeros(V)
+
+class SpotSize(Merit):
+    ### intensity weighted rms radius of the hit points
+    def evaluate(self, result, rows, variant, V):
+        return _weightedStats(variant, result["end"][rows], result["intensity"][rows], V)[1]
+
+class Collimation(Merit):
+    ### intensity weighted rms spread of the ray directions in degrees
+    def evaluate(self, result, rows, variant, V):
+        direction = result["direction"][rows]
+        mean = _weightedStats(variant, direction, result["intensity"][rows], V)[0]
+
+        ### angle of every ray to the mean direction of its variant
+        angle = np.arctan2(direction[:, 1]*mean[variant, 0] - direction[:, 0]*mean[variant, 1], (direction*mean[variant]).sum(axis=1))
+        return np.degrees(_weightedStats(variant, angle, result["intensity"][rows], V)[1])
+
+class PathMatching(Merit):
+    ### intensity weighted rms spread of the path lengths from the sources
+    def evaluate(self, result, rows, variant, V):
+        return _weightedStats(variant, result["path"][rows], result["intensity"][rows], V)[1]
+
+class MeritSum:
+    def __init__(self, merits):
+        self.merits = merits
+
+    def bind(self, items):
+        for x in self.merits:
+            x.bind(items)
+
+    def setReference(self, result):
+        for x in self.merits:
+            x.setReference(result)
+
+    def __call__(self, result, V):
+        return sum(x(result, V) for x in self.merits)
+
+class Problem:
+    ### parameters (state index, key, lower, upper) of a scene and the merit, evaluates whole populations at once
+    def __init__(self, states, params, merit, threshold = INTENSITY_THRESHOLD, maxDepth = MAX_DEPTH, rejectOverlaps = True):
+        self.states = [dict(x) for x in states]
+        self.params = params
+        self.merit = merit if not isinstance(merit, (list, tuple)) else MeritSum(merit)
+        self.threshold = threshold
+        self.maxDepth = maxDepth
+        self.rejectOverlaps = rejectOverlaps
+
+        self.lower = np.array([x[2] for x in params], dtype=float)
+        self.upper = np.array([x[3] for x in params], dtype=float)
+        self.x0 = np.array([self.getValue(index, key) for index, key, _, _ in params], dtype=float)
+
+        self.evaluations = 0
+
+        ### pairs that already overlap in the starting design are left alone
+        geometry = TraceGeometry(self.states)
+        self.pairs = geometry.getPairs({x[0] for x in params})
+        if len(self.pairs) > 0:
+            overlaps = geometry.getOverlaps(self.pairs)[0]
+            self.pairs = [x for x, o in zip(self.pairs, overlaps) if not o]
+
+        self.merit.setReference(trace(geometry, threshold, maxDepth))
+
+    def getValue(self, index, key):
+        state = self.states[index]
+        if key in ("x", "y"):
+            return state["pos"]["xy".index(key)]
+        return state[key]
+
+    def getOverrides(self, X):
+        overrides = {}
+        for (index, key, _, _), values in zip(self.params, X.T):
+            overrides.setdefault(index, {})[key] = values
+        return overrides
+
+    def clip(self, X):
+        return np.clip(X, self.lower, self.upper)
+
+    def __call__(self, X):
+        ### (V, P) parameter sets -> (V,) merits, invalid or overlapping candidates are inf and not traced
+        X = np.atleast_2d(X)
+        V = len(X)
+        self.evaluations += V
+
+        geometry = TraceGeometry(self.states, self.getOverrides(X))
+
+        if self.rejectOverlaps and len(self.pairs) > 0:
+            geometry.valid &= ~geometry.getOverlaps(self.pairs).any(axis=1)
+
+        merit = np.asarray(self.merit(trace(geometry, self.threshold, self.maxDepth), V), dtype=float)
+        return np.where(geometry.valid, np.nan_to_num(merit, nan=np.inf), np.inf)
+
+    def getStates(self, x):
+        ### states with the parameter values applied
+        states = [dict(s) for s in self.states]
+        for (index, key, _, _), value in zip(self.params, x):
+            value = float(value)
+            if key in ("x", "y"):
+                pos = list(states[index]["pos"])
+                pos["xy".index(key)] = value
+                states[index]["pos"] = pos
+            else:
+                states[index][key] = value
+        return states
+
+class OptimizeResult:
+    def __init__(self, problem, x, merit, iterations, history):
+        self.x = x
+        self.merit = merit
+        self.iterations = iterations
+        self.history = history
+        self.evaluations = problem.evaluations
+        self.params = problem.params
+        self.states = problem.getStates(x)
+
+    def getValues(self):
+        ### {(state index, key): value}
+        return {(index, key): float(v) for (index, key, _, _), v in zip(self.params, self.x)}
+
+def nelderMead(problem, iterations = 200, step = 0.05, tol = 1e-6):
+    ### Nelder-Mead, the four trial points of a step (reflection, expansion, both contractions) are traced together
+    n = len(problem.x0)
+    x0 = problem.clip(problem.x0)
+
+    simplex = np.repeat(x0[None], n+1, axis=0)
+    simplex[1:] += np.diag(np.where(problem.upper > problem.lower, step*(problem.upper - problem.lower), step))
+    simplex = problem.clip(simplex)
+    f = problem(simplex)
+
+    if not np.isfinite(f[0]):
+        raise ValueError("The starting design is rejected by the merit function")
+
+    history = []
+    coeffs = np.array([1.0, 2.0, 0.5, -0.5])
+
+    done = 0
+    for it in range(iterations):
+        done += 1
+        order = np.argsort(f)
+        simplex = simplex[order]
+        f = f[order]
+        history.append(f[0])
+
+        if np.isfinite(f[-1]) and f[-1] - f[0] <= tol*(abs(f[0]) + tol):
+            break
+
+        centroid = simplex[:-1].mean(axis=0)
+        trial = problem.clip(centroid + coeffs[:, None]*(centroid - simplex[-1]))
+        fr, fe, foc, fic = problem(trial)
+
+        if fr < f[0]:
+            simplex[-1], f[-1] = (trial[1], fe) if fe < fr else (trial[0], fr)
+        elif fr < f[-2]:
+            simplex[-1], f[-1] = trial[0], fr
+        elif fr < f[-1] and foc <= fr:
+            simplex[-1], f[-1] = trial[2], foc
+        elif fr >= f[-1] and fic < f[-1]:
+            simplex[-1], f[-1] = trial[3], fic
+        else:
+            ### shrink towards the best point, all new points in one batch
+            simplex[1:] = problem.clip(simplex[0] + 0.5*(simplex[1:] - simplex[0]))
+            f[1:] = problem(simplex[1:])
+
+    best = np.argmin(f)
+    return OptimizeResult(problem, simplex[best], f[best], done, history)
+
+def differentialEvolution(problem, iterations = 100, popSize = None, F = 0.7, CR = 0.9, seed = None, tol = 1e-6):
+    ### differential evolution (rand/1/bin), each generation of trial designs is traced as one batch
+    rng = np.random.default_rng(seed)
+    n = len(problem.x0)
+    popSize = popSize or max(15*n, 20)
+
+    pop = problem.lower + rng.random((popSize, n))*(problem.upper - problem.lower)
+    pop[0] = problem.clip(problem.x0)
+    f = problem(pop)
+
+    history = []
+    done = 0
+    for it in range(iterations):
+        done += 1
+        history.append(f.min())
+
+        finite = f[np.isfinite(f)]
+        if len(finite) == popSize and finite.max() - finite.min() <= tol*(abs(finite.min()) + tol):
+            break
+
+        ### three distinct partners per member
+        idx = np.argsort(rng.random((popSize, popSize - 1)), axis=1)[:, :3]
+        idx += idx >= np.arange(popSize)[:, None]
+        a, b, c = pop[idx[:, 0]], pop[idx[:, 1]], pop[idx[:, 2]]
+
+        cross = rng.random((popSize, n)) < CR
+        cross[np.arange(popSize), rng.integers(0, n, popSize)] = True
+        trial = problem.clip(np.where(cross, a + F*(b - c), pop))
+
+        ft = problem(trial)
+        better = ft <= f
+        pop[better] = trial[better]
+        f[better] = ft[better]
+
+    best = np.argmin(f)
+    return OptimizeResult(problem, pop[best], f[best], done, history)
+
+def optimize(states, params, merit, method = "simplex", threshold = INTENSITY_THRESHOLD, maxDepth = MAX_DEPTH, rejectOverlaps = True, **kwargs):
+    ### params: list of (state index, key, lower, upper), keys as for sweeps (x, y, rot, r1, r2, lines, apex ...)
+    ### merit: a Merit (SpotSize, Collimation, PathMatching) or a list of them, which are summed
+    ### method: simplex (Nelder-Mead) or evolution (differential evolution), kwargs go to the method
+    problem = Problem(states, params, merit, threshold, maxDepth, rejectOverlaps)
+
+    if method == "simplex":
+        return nelderMead(problem, **kwargs)
+    elif method == "evolution":
+        return differentialEvolution(problem, **kwargs)
+
+    raise ValueError(f"Unknown optimization method {method}")
@@ -0,0 +1,179 @@
+# Paraxial.py
+# First order optics: ray transfer (ABCD) matrices of the interfaces along the chief ray of a source
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import numpy as np
+
+from TraceEngine import TraceGeometry, trace, cross, dot, INTENSITY_THRESHOLD, MAX_DEPTH
+
+def _matrix(A, B, C, D):
+    ### (..., 2, 2) from broadcastable entries
+    m = np.empty(np.broadcast(A, B, C, D).shape + (2, 2))
+    m[..., 0, 0] = A
+    m[..., 0, 1] = B
+    m[..., 1, 0] = C
+    m[..., 1, 1] = D
+    return m
+
+def propagation(distance, n = 1.0):
+    ### free space, rays are (height, n * angle) so that every matrix has determinant 1
+    return _matrix(1.0, np.divide(distance, n), 0.0, 1.0)
+
+def refraction(n1, n2, cosIn, cosOut, radius = np.inf):
+    ### tilted interface in the plane of incidence (tangential), radius > 0 if the center lies after the surface
+    ### a flat tilted surface (or grating) only stretches the beam by cosOut / cosIn
+    return _matrix(np.divide(cosOut, cosIn), 0.0, -(n2*cosOut - n1*cosIn) / (radius*cosIn*cosOut), np.divide(cosIn, cosOut))
+
+def reflection(n, cosIn, cosOut, radius = np.inf):
+    ### tilted mirror (or reflection grating), radius > 0 for a concave surface
+    return _matrix(np.divide(cosOut, cosIn), 0.0, -n*(cosIn + cosOut) / (radius*cosIn*cosOut), np.divide(cosIn, cosOut))
+
+class ParaxialStep:
+    ### free space of the given length in the element (inside) or in air, followed by the interface it ends on
+    def __init__(self, element, iface, distance, inside, reflected, sinIn, radius, lines):
+        self.element = element
+        self.iface = iface
+        self.distance = distance
+        self.inside = inside
+        self.reflected = reflected
+        self.sinIn = sinIn
+        self.radius = radius
+        self.lines = lines
+
+class ParaxialSystem:
+    ### the chief ray of a source (its strongest branch) is traced once at the reference wavelength, the matrices of the
+    ### interfaces along it are then evaluated for any number of wavelengths with the refractive indices of the elements
+    ### the path of the chief ray is kept fixed, dispersion only changes the powers and the angles behind every interface
+    def __init__(self, states, source, element = None, wl = None, threshold = INTENSITY_THRESHOLD, maxDepth = MAX_DEPTH):
+        self.geometry = TraceGeometry(states)
+        self.source = source
+        self.element = element
+
+        state = self.geometry.states[source]
+        self.wl = float(wl if wl is not None else state.get("wl", [1.03])[0])
+
+        result = trace(self.geometry, threshold, maxDepth)
+        self.rows = result.getChiefRows(source, self.wl, element)
+
+        emitted = state.get("wl", [1.03])
+        if not np.isclose(emitted, self.wl).any():
+            raise ValueError(f"Source {source} does not emit wl {self.wl}, only {list(emitted)}")
+        if len(self.rows) < 2:
+            raise ValueError(f"The chief ray of source {source} does not pass any interface")
+
+        self.steps : list[ParaxialStep] = []
+        self.createSteps(result)
+
+    def createSteps(self, result):
+        geometry = self.geometry
+        nseg = geometry.segA.shape[1]
+        active = np.concatenate([geometry.segActive[0], geometry.arcActive[0]])
+        rows = self.rows
+
+        ### the medium is decided as in the trace: a ray starting inside an element runs in the element it hits
+        inside = geometry.contains(result["start"][rows], np.zeros(len(rows), dtype=np.int64))
+
+        for k, row in enumerate(rows[:-1]):
+            index = result["element"][row]
+            iface = result["iface"][row]
+            d = result["direction"][row]
+            normal = result["normal"][row]
+
+            surface = np.flatnonzero((geometry.surfaceElement == index) & (geometry.surfaceIface == iface) & active)[0]
+
+            ### curvature of the hit interface, positive if its center lies ahead of the ray
+            radius = np.inf
+            if surface >= nseg:
+                center = geometry.arcCenter[0, surface - nseg]
+                radius = geometry.arcRadius[0, surface - nseg] * np.sign(dot(center - result["end"][row], d))
+
+            reflected = bool(dot(result["direction"][rows[k+1]], normal)*dot(d, normal) < 0)
+
+            ### a grating counts with the diffraction order the chief ray leaves it in (-1 adds wl / d to the sines)
+            lines = -result["order"][rows[k+1]]*geometry.surfaceLines[0, surface]
+
+            self.steps.append(ParaxialStep(index, iface, self.getDistance(result, row), bool(inside[k]), reflected,
+                float(cross(d, normal)), radius, float(lines)))
+
+        ### free space up to the hit on the end element, otherwise the system ends on the last interface
+        last = rows[-1]
+        if self.element is not None:
+            self.distance = self.getDistance(result, last)
+            self.inside = bool(inside[-1])
+            self.end = result["end"][last]
+        else:
+            self.distance = 0.0
+            self.inside = False
+            self.end = result["end"][rows[-2]] if len(rows) > 1 else result["start"][last]
+        self.direction = result["direction"][last]
+
+    def getDistance(self, result, row):
+        ### the 1 unit gap between a hit and the next ray counts to the distance, as for the path length
+        return float(result["length"][row] + (1.0 if result["depth"][row] > 0 else 0.0))
+
+    def getMatrix(self, wl = None):
+        ### (W, 2, 2) matrices from the source to the end (the hit on element or the last interface), (2, 2) for a single wl
+        scalar = wl is None or np.ndim(wl) == 0
+        wl = np.atleast_1d(np.asarray(self.wl if wl is None else wl, dtype=float))
+        one = np.ones(len(wl))
+
+        ### refractive indices of every element on the path, once per call
+        indices = {x: self.geometry.elementsByIndex[x].getRefractiveIndex(wl) for x in {step.element for step in self.steps} | {self.element}
+            if x is not None}
+
+        m = np.broadcast_to(np.eye(2), wl.shape + (2, 2))
+        for step in self.steps:
+            nElement = indices[step.element]
+            n1 = nElement if step.inside else one
+            n2 = one if step.inside else nElement
+
+            m = propagation(step.distance, n1) @ m
+
+            g = wl*1e-3*step.lines
+            cosIn = np.sqrt(1 - step.sinIn**2)
+            if step.reflected:
+                sinOut = step.sinIn + g
+                m = reflection(n1, cosIn, np.sqrt(np.clip(1 - sinOut**2, 0, 1)), -step.radius) @ m
+            else:
+                sinOut = (n1*step.sinIn + g)/n2
+                m = refraction(n1, n2, cosIn, np.sqrt(np.clip(1 - sinOut**2, 0, 1)), step.radius) @ m
+
+        n = indices[self.element] if self.inside else one
+        m = propagation(self.distance, n) @ m
+
+        return m[0] if scalar else m
+
+    def getFocalLength(self, wl = None):
+        ### effective focal length -1 / C, inf for an afocal system
+        m = self.getMatrix(wl)
+        with np.errstate(divide="ignore"):
+            return -1.0 / m[..., 1, 0]
+
+    def getBackFocus(self, wl = None):
+        ### distance behind the end of the system at which a collimated beam from the source is focused
+        m = self.getMatrix(wl)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return -m[..., 0, 0] / m[..., 1, 0]
+
+    def getFocus(self, wl = None):
+        ### scene position of that focus on the chief ray, (W, 2) or (2,)
+        return self.end + np.asarray(self.getBackFocus(wl))[..., None]*self.direction
+
+    def getImage(self, distance, wl = None):
+        ### object at distance before the source -> (image distance behind the end of the system, magnification)
+        m = self.getMatrix(wl) @ propagation(distance)
+        A, B, C, D = m[..., 0, 0], m[..., 0, 1], m[..., 1, 0], m[..., 1, 1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            image = -B / D
+        return image, A + image*C
+
+    def getStability(self, wl = None):
+        ### (A + D) / 2 of a round trip, e.g. a source inside a cavity and the end element at the same place:
+        ### the cavity is stable for values between -1 and 1
+        m = self.getMatrix(wl)
+        return (m[..., 0, 0] + m[..., 1, 1]) / 2
+
+def paraxial(states, source, element = None, wl = None, threshold = INTENSITY_THRESHOLD, maxDepth = MAX_DEPTH):
+    ### ParaxialSystem of the chief ray of source (state index), up to element (state index) or its last interface
+    return ParaxialSystem(states, source, element, wl, threshold, maxDepth)
@@ -0,0 +1,343 @@
+# RayTree.py
+# Flat array storage of the ray tree (parent / first child / next sibling) used by the scene
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import numpy as np
+
+class RayTree:
+    ### name, fill value and type of every per node column
+    columns = [
+        ("parent", -1, np.int64),
+        ("firstChild", -1, np.int64),
+        ("lastChild", -1, np.int64),
+        ("nextSibling", -1, np.int64),
+        ("root", -1, np.int64),
+        ("depth", 0, np.int64),
+        ("hitElement", -1, np.int64),       # element the segment ends on
+        ("startElement", -1, np.int64),     # element the segment was emitted from
+        ("power", 0.0, np.float64),         # intensity summed over the wavelengths of the segment
+    ]
+
+    def __init__(self, capacity = 256):
+        self.count = 0
+
+        for name, fill, dtype in self.columns:
+            setattr(self, name, np.full(capacity, fill, dtype=dtype))
+
+        ### payload of every node, e.g. the RayElement drawn for the segment
+        self.items = []
+
+        ### preorder enter / exit numbers, rebuilt lazily after the tree changed
+        self.tin = None
+        self.tout = None
+
+        ### element -> id registry and the sorted hit / start columns for lookups
+        self.elementIds = {}
+        self.elements = []
+        self.hitOrder = None
+        self.startOrder = None
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self, size):
+        if size <= len(self.parent):
+            return
+
+        cap = max(size, 2*len(self.parent))
+
+        for name, fill, dtype in self.columns:
+            old = getattr(self, name)
+            new = np.full(cap, fill, dtype=dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def clear(self):
+        items = self.items
+        self.count = 0
+        self.items = []
+
+        for name, fill, dtype in self.columns:
+            getattr(self, name)[:] = fill
+
+        self.tin = None
+        self.tout = None
+        self.elementIds = {}
+        self.elements = []
+        self.hitOrder = None
+        self.startOrder = None
+        return items
+
+    def addNode(self, item, parent = -1, power = 0.0):
+        self._grow(self.count+1)
+
+        idx = self.count
+        self.count += 1
+
+        self.parent[idx] = parent
+        self.firstChild[idx] = -1
+        self.lastChild[idx] = -1
+        self.nextSibling[idx] = -1
+        self.hitElement[idx] = -1
+        self.power[idx] = power
+
+        if parent < 0:
+            self.root[idx] = idx
+            self.depth[idx] = 0
+            self.startElement[idx] = -1
+        else:
+            self.root[idx] = self.root[parent]
+            self.depth[idx] = self.depth[parent] + 1
+            self.startElement[idx] = self.hitElement[parent]
+
+            ### append at the end of the sibling list to keep creation order
+            if self.lastChild[parent] < 0:
+                self.firstChild[parent] = idx
+            else:
+                self.nextSibling[self.lastChild[parent]] = idx
+            self.lastChild[parent] = idx
+
+        self.items.append(item)
+        self.tin = None
+        self.hitOrder = None
+        self.startOrder = None
+
+        return idx
+
+    def getElementId(self, element):
+        if element not in self.elementIds:
+            self.elementIds[element] = len(self.elements)
+            self.elements.append(element)
+
+        return self.elementIds[element]
+
+    def setHit(self, idx, element = None):
+        eid = -1
+        if element is not None:
+            eid = self.getElementId(element)
+
+        if self.hitElement[idx] != eid:
+            self.hitElement[idx] = eid
+            self.hitOrder = None
+
+    def setPower(self, idx, power):
+        self.power[idx] = power
+
+    def _sortedLookup(self, column, index, eid):
+        ### index is the cached (order, sorted keys) pair of the column
+        if index is None:
+            order = np.argsort(column[:self.count], kind="stable")
+            index = (order, column[order])
+
+        order, keys = index
+        lo = np.searchsorted(keys, eid, "left")
+        hi = np.searchsorted(keys, eid, "right")
+
+        return index, order[lo:hi]
+
+    def getIncoming(self, element):
+        ### segments ending on the element
+        if element not in self.elementIds:
+            return np.zeros(0, dtype=np.int64)
+
+        self.hitOrder, idx = self._sortedLookup(self.hitElement, self.hitOrder, self.elementIds[element])
+        return idx
+
+    def getOutgoing(self, element):
+        ### segments emitted by the element (transmitted, reflected, diffracted)
+        if element not in self.elementIds:
+            return np.zeros(0, dtype=np.int64)
+
+        self.startOrder, idx = self._sortedLookup(self.startElement, self.startOrder, self.elementIds[element])
+        return idx
+
+    def getElementSegments(self, element):
+        return np.union1d(self.getIncoming(element), self.getOutgoing(element))
+
+    def getElementPower(self, element):
+        return float(self.power[self.getIncoming(element)].sum())
+
+    def getElementRoots(self, element):
+        return np.unique(self.root[self.getElementSegments(element)])
+
+    def getItem(self, idx):
+        return self.items[idx]
+
+    def getParent(self, idx):
+        return int(self.parent[idx])
+
+    def getRoot(self, idx):
+        return int(self.root[idx])
+
+    def getDepth(self, idx):
+        return int(self.depth[idx])
+
+    def getChildren(self, idx):
+        children = []
+        child = self.firstChild[idx]
+        while child >= 0:
+            children.append(int(child))
+            child = self.nextSibling[child]
+        return children
+
+    def getPath(self, idx):
+        ### indices from the root down to idx, depth is known in advance
+        path = [0] * (int(self.depth[idx]) + 1)
+        for k in range(len(path)-1, -1, -1):
+            path[k] = int(idx)
+            idx = self.parent[idx]
+        return path
+
+    def _buildOrder(self):
+        ### iterative preorder walk over all roots using the child / sibling links
+        n = self.count
+        tin = np.zeros(n, dtype=np.int64)
+        tout = np.zeros(n, dtype=np.int64)
+
+        counter = 0
+        for r in np.nonzero(self.parent[:n] < 0)[0]:
+            stack = [int(r)]
+            while stack:
+                idx = stack[-1]
+                if idx >= 0:
+                    tin[idx] = counter
+                    counter += 1
+                    stack[-1] = ~idx
+
+                    children = self.getChildren(idx)
+                    stack.extend(reversed(children))
+                else:
+                    stack.pop()
+                    tout[~idx] = counter
+
+        self.tin = tin
+        self.tout = tout
+
+    def isAncestor(self, a, b):
+        ### True if a is b or lies on the path from the root to b
+        if self.root[a] != self.root[b] or self.depth[a] > self.depth[b]:
+            return False
+
+        if self.tin is None:
+            self._buildOrder()
+
+        return self.tin[a] <= self.tin[b] and self.tout[b] <= self.tout[a]
+
+    def subtreeMask(self, idx, includeSelf = True):
+        if self.tin is None:
+            self._buildOrder()
+
+        n = self.count
+        mask = (self.tin[:n] >= self.tin[idx]) & (self.tin[:n] < self.tout[idx])
+
+        if not includeSelf:
+            mask[idx] = False
+
+        return mask
+
+    def subtreesMask(self, indices, includeSelf = True):
+        ### union of the subtrees of all indices in one pass over the preorder numbers
+        if self.tin is None:
+            self._buildOrder()
+
+        n = self.count
+        indices = np.asarray(indices, dtype=np.int64)
+        start = self.tin[indices] + (0 if includeSelf else 1)
+
+        delta = np.zeros(n+1, dtype=np.int64)
+        np.add.at(delta, start, 1)
+        np.add.at(delta, self.tout[indices], -1)
+
+        covered = np.cumsum(delta[:n]) > 0
+        return covered[self.tin[:n]]
+
+    def removeSubtree(self, idx, includeSelf = True):
+        return self.removeMask(self.subtreeMask(idx, includeSelf))
+
+    def removeMask(self, mask):
+        ### drop all nodes selected by mask, the mask has to be closed under "descendant of"
+        n = self.count
+        mask = np.asarray(mask, dtype=bool)[:n]
+
+        if not mask.any():
+            return []
+
+        removed = [self.items[i] for i in np.nonzero(mask)[0]]
+
+        keep = ~mask
+        newIndex = np.cumsum(keep) - 1
+        kept = np.nonzero(keep)[0]
+        m = len(kept)
+
+        parent = self.parent[kept]
+        parent = np.where(parent >= 0, newIndex[np.maximum(parent, 0)], -1)
+        root = newIndex[self.root[kept]]
+
+        for name, fill, dtype in self.columns:
+            col = getattr(self, name)
+            col[:m] = col[kept]
+            col[m:n] = fill
+
+        self.parent[:m] = parent
+        self.root[:m] = root
+
+        self.items = [self.items[i] for i in kept]
+        self.count = m
+        self.hitOrder = None
+        self.startOrder = None
+
+        self._relink()
+        self._pruneElements()
+
+        ### hand out the new positions, only for nodes that actually moved
+        for i in np.nonzero(kept != np.arange(m))[0]:
+            self.items[i].treeIndex = int(i)
+
+        return removed
+
+    def _pruneElements(self):
+        ### forget elements no segment ends on or starts from any more and renumber the rest
+        n = self.count
+        used = np.zeros(len(self.elements)+1, dtype=bool)
+        used[self.hitElement[:n]] = True
+        used[self.startElement[:n]] = True
+        used = used[:-1]
+
+        if used.all():
+            return
+
+        newId = np.append(np.cumsum(used) - 1, -1)
+        self.hitElement[:n] = newId[self.hitElement[:n]]
+        self.startElement[:n] = newId[self.startElement[:n]]
+
+        self.elements = [x for x, u in zip(self.elements, used) if u]
+        self.elementIds = {x: i for i, x in enumerate(self.elements)}
+
+    def _relink(self):
+        ### rebuild the child / sibling links from the parent column
+        n = self.count
+        self.firstChild[:] = -1
+        self.lastChild[:] = -1
+        self.nextSibling[:] = -1
+        self.tin = None
+
+        idx = np.nonzero(self.parent[:n] >= 0)[0]
+        if len(idx) == 0:
+            return
+
+        par = self.parent[idx]
+        order = np.lexsort((idx, par))
+        idx = idx[order]
+        par = par[order]
+
+        same = par[1:] == par[:-1]
+        self.nextSibling[idx[:-1][same]] = idx[1:][same]
+
+        first = np.ones(len(idx), dtype=bool)
+        first[1:] = ~same
+        self.firstChild[par[first]] = idx[first]
+
+        last = np.ones(len(idx), dtype=bool)
+        last[:-1] = ~same
+        self.lastChild[par[last]] = idx[last]
@@ -0,0 +1,264 @@
+# SceneFile.py
+# Compact binary scene format (.scb): one table per element type, every state key stored as a typed column
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import struct
+import json
+import numpy as np
+
+MAGIC = b"OTSB"
+VERSION = 2
+
+### column kinds
+SCALAR = ord("s")    # one number per element
+VECTOR = ord("v")    # fixed length list of numbers per element, e.g. pos
+RAGGED = ord("r")    # variable length list of numbers or of fixed length tuples, e.g. wl, color
+STRING = ord("t")    # dictionary encoded strings, e.g. mat
+JSON = ord("j")      # anything else, stored as json text
+
+### null mask values
+PRESENT = 0
+NONE = 1
+MISSING = 2
+
+def isBinaryScene(filename):
+    with open(filename, "rb") as reader:
+        return reader.read(len(MAGIC)) == MAGIC
+
+def _isNumber(x):
+    return isinstance(x, (int, float)) and not isinstance(x, bool)
+
+def _isNumberList(x):
+    return isinstance(x, (list, tuple)) and all(_isNumber(v) or isinstance(v, bool) for v in x)
+
+def _numberArray(values):
+    arr = np.asarray(values)
+    if arr.dtype == bool:
+        return arr
+    if np.issubdtype(arr.dtype, np.integer):
+        return arr.astype(np.int64)
+    return arr.astype(np.float64)
+
+def _encodeColumn(values, mask):
+    ### returns kind, width and the list of arrays stored for the column
+    present = [v for v, m in zip(values, mask) if m == PRESENT]
+    n = len(values)
+
+    if len(present) > 0 and all(isinstance(v, bool) for v in present):
+        return SCALAR, 1, [np.array([v if m == PRESENT else False for v, m in zip(values, mask)], dtype=bool)]
+
+    if all(_isNumber(v) for v in present):
+        data = _numberArray([v if m == PRESENT else 0 for v, m in zip(values, mask)])
+        if len(present) == 0:
+            data = np.zeros(n, dtype=np.float64)
+        return SCALAR, 1, [data]
+
+    if all(isinstance(v, str) for v in present):
+        table = sorted(set(present))
+        lookup = {v: i for i, v in enumerate(table)}
+        codes = np.array([lookup[v] if m == PRESENT else -1 for v, m in zip(values, mask)], dtype=np.int32)
+        blob = [x.encode("utf-8") for x in table]
+        offsets = np.zeros(len(blob)+1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(x) for x in blob])
+        return STRING, 1, [codes, offsets, np.frombuffer(b"".join(blob), dtype=np.uint8)]
+
+    if all(_isNumberList(v) for v in present):
+        lengths = {len(v) for v in present}
+        if len(lengths) == 1:
+            width = lengths.pop()
+            rows = [v if m == PRESENT else [0]*width for v, m in zip(values, mask)]
+            return VECTOR, width, [_numberArray(rows).reshape(n, width)]
+
+        return _encodeRagged(values, mask, 1)
+
+    if all(isinstance(v, (list, tuple)) and all(_isNumberList(x) for x in v) for v in present):
+        ### inner lists of length 1 would come back as a flat list, they are left to json
+        widths = {len(x) for v in present for x in v}
+        if len(widths) == 1 and 1 not in widths:
+            return _encodeRagged(values, mask, widths.pop())
+
+    text = [json.dumps(v) if m == PRESENT else "" for v, m in zip(values, mask)]
+    kind, width, arrays = _encodeColumn(text, mask)
+    return JSON, width, arrays
+
+def _encodeRagged(values, mask, width):
+    lengths = [len(v) if m == PRESENT else 0 for v, m in zip(values, mask)]
+    offsets = np.zeros(len(values)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+
+    flat = [x for v, m in zip(values, mask) if m == PRESENT for x in v]
+    if len(flat) == 0:
+        data = np.zeros((0, width), dtype=np.float64)
+    else:
+        data = _numberArray(flat).reshape(len(flat), width)
+
+    return RAGGED, width, [offsets, data]
+
+def _pad(writer):
+    pos = writer.tell()
+    if pos % 8:
+        writer.write(b"\0" * (8 - pos % 8))
+
+def _writeString(writer, text):
+    data = text.encode("utf-8")
+    writer.write(struct.pack("<H", len(data)))
+    writer.write(data)
+
+def _writeArray(writer, arr):
+    arr = np.ascontiguousarray(arr)
+    dtype = arr.dtype.str.encode("ascii")
+    writer.write(struct.pack("<B", len(dtype)))
+    writer.write(dtype)
+    writer.write(struct.pack("<BQ", arr.ndim, arr.nbytes))
+    writer.write(struct.pack(f"<{arr.ndim}Q", *arr.shape))
+    _pad(writer)
+    writer.write(arr.tobytes())
+
+def saveBinaryScene(filename, states):
+    ### group the element states by type, every type becomes a table
+    ### the position of every element in the scene is kept so the file loads in the original order
+    tables = {}
+    positions = {}
+    for i, state in enumerate(states):
+        tables.setdefault(state["type"], []).append(state)
+        positions.setdefault(state["type"], []).append(i)
+
+    with open(filename, "wb") as writer:
+        writer.write(MAGIC)
+        writer.write(struct.pack("<HHI", VERSION, 0, len(tables)))
+
+        for typeName, rows in tables.items():
+            keys = []
+            for row in rows:
+                for k in row.keys():
+                    if k != "type" and k not in keys:
+                        keys.append(k)
+
+            _writeString(writer, typeName)
+            writer.write(struct.pack("<QI", len(rows), len(keys)))
+            _writeArray(writer, np.array(positions[typeName], dtype=np.int64))
+
+            for k in keys:
+                values = [row.get(k) for row in rows]
+                mask = np.array([PRESENT if k in row and row[k] is not None else (NONE if k in row else MISSING) for row in rows], dtype=np.uint8)
+
+                kind, width, arrays = _encodeColumn(values, mask)
+
+                _writeString(writer, k)
+                writer.write(struct.pack("<BIB", kind, width, len(arrays)))
+                _writeArray(writer, mask)
+                for arr in arrays:
+                    _writeArray(writer, arr)
+
+class _Reader:
+    def __init__(self, filename):
+        ### the file is memory mapped, columns are views into the mapping
+        self.raw = np.memmap(filename, dtype=np.uint8, mode="r")
+        self.offset = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.raw, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def string(self):
+        n, = self.unpack("<H")
+        text = bytes(self.raw[self.offset:self.offset+n]).decode("utf-8")
+        self.offset += n
+        return text
+
+    def array(self):
+        n, = self.unpack("<B")
+        dtype = np.dtype(bytes(self.raw[self.offset:self.offset+n]).decode("ascii"))
+        self.offset += n
+        ndim, nbytes = self.unpack("<BQ")
+        shape = self.unpack(f"<{ndim}Q")
+
+        if self.offset % 8:
+            self.offset += 8 - self.offset % 8
+
+        arr = self.raw[self.offset:self.offset+nbytes].view(dtype).reshape(shape)
+        self.offset += nbytes
+        return arr
+
+class _Column:
+    def __init__(self, reader):
+        self.name = reader.string()
+        self.kind, self.width, count = reader.unpack("<BIB")
+        self.mask = reader.array()
+        self.arrays = [reader.array() for x in range(count)]
+
+        if self.kind in (STRING, JSON):
+            codes, offsets, blob = self.arrays
+            self.strings = [bytes(blob[offsets[i]:offsets[i+1]]).decode("utf-8") for i in range(len(offsets)-1)]
+
+    def values(self, start, stop):
+        ### python values of the rows start..stop, decoded in one go
+        if self.kind == SCALAR or self.kind == VECTOR:
+            return self.arrays[0][start:stop].tolist()
+        elif self.kind == RAGGED:
+            offsets, data = self.arrays
+            if self.width == 1:
+                data = data[:, 0]
+            flat = data[offsets[start]:offsets[stop]].tolist()
+            base = offsets[start]
+            bounds = (offsets[start:stop+1] - base).tolist()
+            return [flat[bounds[i]:bounds[i+1]] for i in range(stop-start)]
+        else:
+            codes = self.arrays[0][start:stop].tolist()
+            if self.kind == STRING:
+                return [self.strings[x] for x in codes]
+            return [json.loads(self.strings[x]) if x >= 0 else None for x in codes]
+
+def _iterTable(typeName, rowCount, columns, chunkSize):
+    ### states of one table in row order, only chunkSize rows are decoded at a time
+    for start in range(0, rowCount, chunkSize):
+        stop = min(start + chunkSize, rowCount)
+        chunk = [(col.name, col.mask[start:stop].tolist(), col.values(start, stop)) for col in columns]
+
+        for row in range(stop-start):
+            state = {"type": typeName}
+            for name, mask, values in chunk:
+                m = mask[row]
+                if m == PRESENT:
+                    state[name] = values[row]
+                elif m == NONE:
+                    state[name] = None
+            yield state
+
+def iterBinaryScene(filename, chunkSize = 4096):
+    ### yields the element states one by one in the order they were saved, only chunkSize rows of every table are
+    ### decoded at a time
+    reader = _Reader(filename)
+
+    if bytes(reader.raw[:len(MAGIC)]) != MAGIC:
+        raise ValueError(f"{filename} is not a binary scene file")
+    reader.offset = len(MAGIC)
+
+    version, _, tableCount = reader.unpack("<HHI")
+    if version > VERSION:
+        raise ValueError(f"binary scene version {version} is not supported")
+
+    tables = []
+    positions = []
+    for t in range(tableCount):
+        typeName = reader.string()
+        rowCount, columnCount = reader.unpack("<QI")
+
+        ### version 1 files have no positions, their elements come table by table
+        if version >= 2:
+            positions.append(reader.array())
+        else:
+            positions.append(np.arange(rowCount) + sum(len(x) for x in positions))
+
+        columns = [_Column(reader) for c in range(columnCount)]
+        tables.append(_iterTable(typeName, rowCount, columns, chunkSize))
+
+    ### the rows of a table are stored in scene order, so every table is read front to back
+    if tableCount == 0:
+        return
+    tableOf = np.concatenate([np.full(len(x), t, dtype=np.int64) for t, x in enumerate(positions)])
+    order = np.argsort(np.concatenate(positions), kind="stable")
+    for t in tableOf[order].tolist():
+        yield next(tables[t])
@@ -0,0 +1,136 @@
+# Stream.py
+# Out of core tracing: source rays are traced in chunks and folded into detectors or appended to memory mapped files
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import os
+import json
+
+import numpy as np
+
+from TraceEngine import TraceGeometry, TraceResult, iterTrace, INTENSITY_THRESHOLD, MAX_DEPTH, RAY_LENGTH
+from Detector import Detector
+
+class SegmentStore:
+    ### columns of traced segments appended to raw files <column>.bin in a directory, read back as memory maps,
+    ### parents are row numbers of the whole store
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+        self.columns = {}
+        self.count = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def getPath(self, key):
+        return os.path.join(self.directory, key + ".bin")
+
+    def append(self, segments):
+        ### segments of one generation (of iterSegments)
+        for key, value in segments.items():
+            value = np.ascontiguousarray(value)
+            if key not in self.files:
+                self.files[key] = open(self.getPath(key), "wb")
+                self.columns[key] = (value.dtype.str, value.shape[1:])
+            self.files[key].write(value.tobytes())
+
+        self.count += len(segments["variant"])
+
+    def close(self):
+        for x in self.files.values():
+            x.close()
+        self.files = {}
+
+        with open(os.path.join(self.directory, "store.json"), "w") as writer:
+            json.dump({"count": self.count, "columns": {k: [d, list(s)] for k, (d, s) in self.columns.items()}}, writer)
+
+    def getColumns(self):
+        ### read only memory maps of all columns
+        columns = {}
+        for key, (dtype, shape) in self.columns.items():
+            shape = (self.count,) + tuple(shape)
+            if self.count == 0:
+                columns[key] = np.zeros(shape, dtype=dtype)
+            else:
+                columns[key] = np.memmap(self.getPath(key), dtype=dtype, mode="r", shape=shape)
+        return columns
+
+    def getResult(self, variants = 1):
+        return TraceResult(self.getColumns(), variants)
+
+    @staticmethod
+    def load(directory):
+        ### a closed store written before
+        with open(os.path.join(directory, "store.json"), "r") as reader:
+            meta = json.load(reader)
+
+        store = SegmentStore(directory)
+        store.count = meta["count"]
+        store.columns = {k: (d, tuple(s)) for k, (d, s) in meta["columns"].items()}
+        return store
+
+class StreamResult:
+    ### detectors by state index, the segment store (None if not written) and the number of source rays and segments
+    def __init__(self, detectors, store, rays, segments):
+        self.detectors = detectors
+        self.store = store
+        self.rays = rays
+        self.segments = segments
+
+    def __getitem__(self, element):
+        return self.detectors[element]
+
+def iterSegments(geometry, chunkSize = None, threshold = INTENSITY_THRESHOLD, maxDepth = MAX_DEPTH, rayLength = RAY_LENGTH):
+    ### lazy trace of a TraceGeometry (or a list of states): yields the segments generation by generation as dicts of columns
+    ### (see COLUMNS), in chunks of chunkSize source rays if given, parents are row numbers of the whole stream
+    ### nothing is kept after a generation is consumed, closing the generator (or breaking a loop) stops the trace
+    if not isinstance(geometry, TraceGeometry):
+        geometry = TraceGeometry(geometry)
+
+    total = geometry.getSourceCount()
+    chunkSize = chunkSize or max(total, 1)
+    rows = 0
+
+    for start in range(0, total, chunkSize):
+        base = rows
+        for segments in iterTrace(geometry, threshold, maxDepth, rayLength, geometry.getSourceRays(start, start + chunkSize)):
+            rows += len(segments["variant"])
+            yield dict(segments, parent=np.where(segments["parent"] >= 0, segments["parent"] + base, -1))
+
+def iterRecords(generations):
+    ### one dict per segment, for scripts that rather filter rows than arrays
+    for segments in generations:
+        keys = list(segments.keys())
+        for values in zip(*[segments[k] for k in keys]):
+            yield dict(zip(keys, values))
+
+def stream(states, detectors = (), store = None, chunkSize = 65536, overrides = None, threshold = INTENSITY_THRESHOLD,
+    maxDepth = MAX_DEPTH, rayLength = RAY_LENGTH, progress = None, **kwargs):
+    ### trace the source rays of states in chunks of chunkSize, every generation is folded into a Detector of each element
+    ### in detectors (state indices, kwargs as for Detector) and appended to a SegmentStore in the directory store if given
+    ### only one generation of one chunk is held in memory, independent of the number of rays
+    ### progress(done, total) is called when the source rays of a chunk start
+    geometry = TraceGeometry(states, overrides)
+    accumulators = {x: Detector(geometry, x, **kwargs) for x in detectors}
+    segmentStore = SegmentStore(store) if store is not None else None
+
+    total = geometry.getSourceCount()
+    segments = 0
+    done = 0
+
+    for generation in iterSegments(geometry, chunkSize, threshold, maxDepth, rayLength):
+        for detector in accumulators.values():
+            detector.add(generation)
+        if segmentStore is not None:
+            segmentStore.append(generation)
+        segments += len(generation["variant"])
+
+        if generation["depth"][0] == 0:
+            done += len(generation["depth"])
+            if progress is not None:
+                progress(done, total)
+
+    if segmentStore is not None:
+        segmentStore.close()
+
+    return StreamResult(accumulators, segmentStore, total, segments)
@@ -0,0 +1,156 @@
+# Sweep.py
+# Parameter sweeps: variants of a scene are traced in vectorized batches and the hits are returned as stacked arrays
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from TraceEngine import TraceGeometry, TraceResult, trace, COLUMNS, INTENSITY_THRESHOLD, MAX_DEPTH
+
+def makeVariants(params, mode = "grid"):
+    ### params: list of (state index, key, values), pos values are (n, 2)
+    ### grid -> every combination (shape n1 x n2 x ...), zip -> the i-th values of all parameters together
+    values = [np.asarray(x[2], dtype=float) for x in params]
+    sizes = [len(x) for x in values]
+
+    if mode == "grid":
+        shape = tuple(sizes)
+        index = np.indices(shape).reshape(len(shape), -1)
+        values = [x[i] for x, i in zip(values, index)]
+    elif mode == "zip":
+        if len(set(sizes)) > 1:
+            raise ValueError(f"zip sweep needs the same number of values for every parameter, got {sizes}")
+        shape = (sizes[0] if len(sizes) > 0 else 1,)
+    else:
+        raise ValueError(f"Unknown sweep mode {mode}")
+
+    overrides = {}
+    for (index, key, _), x in zip(params, values):
+        overrides.setdefault(index, {})[key] = x
+
+    return overrides, values, shape
+
+def _sliceOverrides(overrides, start, stop):
+    return {i: {k: v[start:stop] for k, v in x.items()} for i, x in overrides.items()}
+
+def traceVariants(states, overrides, threshold = INTENSITY_THRESHOLD, maxDepth = MAX_DEPTH, order = None):
+    ### pool entry point, one chunk of variants, sequential along order if given
+    geometry = TraceGeometry(states, overrides)
+    if order is not None:
+        geometry.setOrder(order)
+    return trace(geometry, threshold, maxDepth), geometry.valid
+
+class SweepResult:
+    ### segments of all variants (TraceResult) plus the swept values, hits are stacked per variant
+    def __init__(self, params, values, shape, result, valid):
+        self.params = params
+        self.values = values
+        self.shape = shape
+        self.result = result
+        self.valid = valid
+
+        ### elements in state order when the sweep was started from a scene, hits can then be asked for by element
+        self.items = None
+
+    def __len__(self):
+        return len(self.valid)
+
+    def reshape(self, arr):
+        ### (V, ...) -> (n1, n2, ..., ...) for grid sweeps
+        return arr.reshape(self.shape + arr.shape[1:])
+
+    def getHits(self, index, iface = None):
+        ### segments ending on an element (state index) as (V, K) arrays, K is the largest number of hits of a variant
+        ### the k-th hit of every variant is the same branch of the ray tree as long as the variants hit the same surfaces,
+        ### missing hits are nan
+        if self.items is not None and not isinstance(index, (int, np.integer)):
+            index = self.items.index(index)
+
+        res = self.result
+        rows = res.getElementRows(index, iface)
+        variant = res["variant"][rows]
+
+        ### rows are ordered by generation, a stable sort keeps that order within each variant
+        order = np.argsort(variant, kind="stable")
+        rows = rows[order]
+        variant = variant[order]
+
+        count = np.bincount(variant, minlength=len(self))
+        rank = np.arange(len(rows)) - (np.cumsum(count) - count)[variant]
+        K = int(count.max()) if len(rows) > 0 else 0
+
+        def stacked(values, fill = np.nan):
+            out = np.full((len(self), K) + values.shape[1:], fill, dtype=float)
+            out[variant, rank] = values
+            return out
+
+        direction = res["direction"][rows]
+        normal = res["normal"][rows]
+
+        ### incidence between ray and surface normal, signed as in TraceScene
+        sinIn = np.clip(direction[:, 0]*normal[:, 1] - direction[:, 1]*normal[:, 0], -1, 1)
+
+        return {
+            "count": count,
+            "pos": stacked(res["end"][rows]),
+            "angle": stacked(np.degrees(np.arctan2(direction[:, 1], direction[:, 0]))),
+            "incidence": stacked(np.degrees(np.arcsin(sinIn))),
+            "path": stacked(res["path"][rows]),
+            "intensity": stacked(res["intensity"][rows]),
+            "wl": stacked(res["wl"][rows]),
+            "source": stacked(res["source"][rows], -1),
+            "segment": stacked(rows, -1),
+        }
+
+def _merge(parts, V):
+    ### chunks of variants -> one result, variants and parents are shifted by the chunk offsets
+    columns = {k: [] for k in COLUMNS}
+    rowOffset = 0
+    variantOffset = 0
+    valid = []
+
+    for result, chunkValid in parts:
+        for k in COLUMNS:
+            x = result[k]
+            if k == "variant":
+                x = x + variantOffset
+            elif k == "parent":
+                x = np.where(x >= 0, x + rowOffset, -1)
+            columns[k].append(x)
+
+        rowOffset += len(result)
+        variantOffset += len(chunkValid)
+        valid.append(chunkValid)
+
+    return TraceResult({k: np.concatenate(v) for k, v in columns.items()}, V), np.concatenate(valid)
+
+def sweep(states, params, mode = "grid", chunkSize = 2048, workers = 1, threshold = INTENSITY_THRESHOLD, maxDepth = MAX_DEPTH,
+    sequential = False, order = None):
+    ### trace all variants of a scene, states are the element states (e.g. a loaded .scn file)
+    ### params is a list of (state index, key, values), e.g. [(0, "rot", np.linspace(60, 66, 61))]
+    ### keys are state keys (rot, r1, r2, thickness, height, lines, apex, base, intensity, wl ...) or pos / x / y
+    ### variants are traced in chunks of chunkSize, by several processes if workers > 1
+    ### sequential traces along order (list of (state index, iface)), by default the interfaces the chief ray of the
+    ### first source meets in the unchanged scene
+    states = [dict(x) for x in states]
+    overrides, values, shape = makeVariants(params, mode)
+    V = int(np.prod(shape))
+
+    if sequential and order is None:
+        order = TraceGeometry(states).setOrder(threshold=threshold, maxDepth=maxDepth)
+
+    starts = range(0, V, chunkSize)
+    tasks = [(states, _sliceOverrides(overrides, x, min(x + chunkSize, V)), threshold, maxDepth, order if sequential else None) for x in starts]
+
+    workers = max(1, min(workers or os.cpu_count(), len(tasks)))
+    if workers == 1:
+        parts = [traceVariants(*x) for x in tasks]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            parts = list(pool.map(traceVariants, *zip(*tasks)))
+
+    result, valid = _merge(parts, V)
+    return SweepResult(params, values, shape, result, valid)
@@ -0,0 +1,154 @@
+# Tolerance.py
+# Monte Carlo tolerancing: seeded random errors of element positions, angles and radii, traced in vectorized batches
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from TraceEngine import TraceGeometry, trace, INTENSITY_THRESHOLD, MAX_DEPTH
+from Optimize import _weightedStats
+
+METRICS = ["count", "x", "y", "pointing", "focus", "walkoff"]
+
+### the nominal geometry of a worker process, compiled once and perturbed for every chunk of trials
+_nominal = None
+
+def _initWorker(states):
+    global _nominal
+    _nominal = TraceGeometry(states)
+
+def makeOffsets(tolerances, trials, seed = None):
+    ### tolerances: list of (state index, key, tolerance[, distribution])
+    ### normal -> tolerance is the standard deviation, uniform -> errors within +-tolerance
+    ### the same seed gives the same trials, independent of chunks and workers
+    rng = np.random.default_rng(seed)
+    offsets = {}
+
+    for spec in tolerances:
+        index, key, tol = spec[:3]
+        distribution = spec[3] if len(spec) > 3 else "normal"
+
+        if distribution == "normal":
+            values = rng.normal(0.0, tol, trials)
+        elif distribution == "uniform":
+            values = rng.uniform(-tol, tol, trials)
+        else:
+            raise ValueError(f"Unknown tolerance distribution {distribution}")
+
+        offsets.setdefault(index, {})[key] = values
+
+    return offsets
+
+def getMetrics(result, element, V, iface = None):
+    ### per variant metrics of the rays arriving at an element (state index), nan if no ray arrives:
+    ### x, y: intensity weighted centroid, pointing: mean direction in degrees,
+    ### focus: distance from the centroid along the mean direction where the rays are closest together,
+    ### walkoff: transverse distance of the centroids of the longest and the shortest wavelength
+    rows = result.getElementRows(element, iface)
+    variant = result["variant"][rows]
+    pos = result["end"][rows]
+    direction = result["direction"][rows]
+    weights = result["intensity"][rows]
+    wl = result["wl"][rows]
+
+    centroid = _weightedStats(variant, pos, weights, V)[0]
+    mean = _weightedStats(variant, direction, weights, V)[0]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = mean / np.sqrt((mean**2).sum(axis=1))[:, None]
+        normal = np.stack([-mean[:, 1], mean[:, 0]], axis=1)
+
+        ### transverse offset of every ray and its change per unit along the mean direction
+        offset = ((pos - centroid[variant])*normal[variant]).sum(axis=1)
+        slope = (direction*normal[variant]).sum(axis=1) / (direction*mean[variant]).sum(axis=1)
+
+        ### the transverse spread offset + z*slope is smallest at z = -cov(offset, slope) / var(slope)
+        w = np.bincount(variant, weights, minlength=V)
+        meanSlope = np.bincount(variant, weights*slope, minlength=V) / w
+        cov = np.bincount(variant, weights*offset*(slope - meanSlope[variant]), minlength=V) / w
+        var = np.bincount(variant, weights*(slope - meanSlope[variant])**2, minlength=V) / w
+        focus = np.where(var > 1e-12, -cov/var, np.nan)
+
+        wlMin = np.full(V, np.inf)
+        wlMax = np.full(V, -np.inf)
+        np.minimum.at(wlMin, variant, wl)
+        np.maximum.at(wlMax, variant, wl)
+
+        def transverse(mask):
+            return np.bincount(variant[mask], (weights*offset)[mask], minlength=V) / np.bincount(variant[mask], weights[mask], minlength=V)
+
+        walkoff = transverse(wl == wlMax[variant]) - transverse(wl == wlMin[variant])
+
+    return {
+        "count": np.bincount(variant, minlength=V).astype(float),
+        "x": centroid[:, 0],
+        "y": centroid[:, 1],
+        "pointing": np.degrees(np.arctan2(mean[:, 1], mean[:, 0])),
+        "focus": focus,
+        "walkoff": walkoff,
+    }
+
+def traceTrials(offsets, element, iface = None, threshold = INTENSITY_THRESHOLD, maxDepth = MAX_DEPTH):
+    ### pool entry point, one chunk of trials on the nominal geometry of the worker
+    geometry = _nominal.perturb(offsets)
+    metrics = getMetrics(trace(geometry, threshold, maxDepth), element, geometry.variants, iface)
+    return metrics, geometry.valid
+
+def _sliceOffsets(offsets, start, stop):
+    return {i: {k: v[start:stop] for k, v in x.items()} for i, x in offsets.items()}
+
+class ToleranceResult:
+    ### metrics of all trials and of the nominal design, changes are trial - nominal
+    def __init__(self, tolerances, offsets, nominal, metrics, valid):
+        self.tolerances = tolerances
+        self.offsets = offsets
+        self.nominal = nominal
+        self.metrics = metrics
+        self.valid = valid
+
+    def __len__(self):
+        return len(self.valid)
+
+    def getChanges(self, key):
+        ### (trials,) change of a metric, nan for trials that could not be built
+        return np.where(self.valid, self.metrics[key] - self.nominal[key][0], np.nan)
+
+    def getStats(self, percentiles = (5, 50, 95)):
+        ### {metric: {mean, std, percentiles...}} of the changes, trials without rays at the element are left out
+        stats = {}
+        for key in METRICS:
+            x = self.getChanges(key)
+            x = x[np.isfinite(x)]
+            stats[key] = {"mean": float(np.mean(x)) if len(x) > 0 else np.nan, "std": float(np.std(x)) if len(x) > 0 else np.nan, "trials": len(x)}
+            for p in percentiles:
+                stats[key][f"p{p}"] = float(np.percentile(x, p)) if len(x) > 0 else np.nan
+        return stats
+
+def tolerance(states, tolerances, element, trials = 1000, seed = None, iface = None, chunkSize = 1024, workers = 1,
+    threshold = INTENSITY_THRESHOLD, maxDepth = MAX_DEPTH):
+    ### random errors of the parameters in tolerances (list of (state index, key, tolerance[, "normal" | "uniform"]),
+    ### keys as for sweeps: x, y, rot, r1, r2, thickness ...), metrics at element (state index)
+    ### trials are traced in chunks of chunkSize, by several processes if workers > 1
+    states = [dict(x) for x in states]
+    offsets = makeOffsets(tolerances, trials, seed)
+
+    nominal = TraceGeometry(states)
+    reference = getMetrics(trace(nominal, threshold, maxDepth), element, 1, iface)
+
+    tasks = [(_sliceOffsets(offsets, x, min(x + chunkSize, trials)), element, iface, threshold, maxDepth) for x in range(0, trials, chunkSize)]
+
+    workers = max(1, min(workers or os.cpu_count(), len(tasks)))
+    if workers == 1:
+        _initWorker(states)
+        parts = [traceTrials(*x) for x in tasks]
+    else:
+        with ProcessPoolExecutor(workers, initializer=_initWorker, initargs=(states,)) as pool:
+            parts = list(pool.map(traceTrials, *zip(*tasks)))
+
+    metrics = {k: np.concatenate([x[0][k] for x in parts]) if len(parts) > 0 else np.zeros(0) for k in METRICS}
+    valid = np.concatenate([x[1] for x in parts]) if len(parts) > 0 else np.zeros(0, dtype=bool)
+
+    return ToleranceResult(tolerances, offsets, reference, metrics, valid)
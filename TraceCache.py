@@ -0,0 +1,81 @@
+# TraceCache.py
+# Content addressed cache of trace results, keyed by a hash of the traceable scene state
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+### bump when the stored arrays or the tracing itself change
+CACHE_VERSION = 2
+
+def sceneKey(states, settings):
+    ### states are the getState() dicts of all elements and source rays, their order does not matter
+    ### returns the key and the canonical order of the states the cached results refer to
+    texts = [json.dumps(x, sort_keys=True) for x in states]
+    order = sorted(range(len(texts)), key=lambda i: texts[i])
+
+    h = hashlib.sha1()
+    h.update(json.dumps([CACHE_VERSION, settings], sort_keys=True).encode("utf-8"))
+    for i in order:
+        h.update(texts[i].encode("utf-8"))
+        h.update(b"\n")
+
+    return h.hexdigest(), order
+
+class TraceCache:
+    def __init__(self, maxEntries = 64, directory = None):
+        self.maxEntries = maxEntries
+        self.directory = directory
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def setDirectory(self, directory):
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.directory is not None and os.path.exists(self._path(key)):
+            with np.load(self._path(key)) as data:
+                result = {k: data[k] for k in data.files}
+            self._store(key, result)
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        return None
+
+    def put(self, key, result):
+        self._store(key, result)
+
+        if self.directory is not None and not os.path.exists(self._path(key)):
+            ### write to a temporary name first, a crash must not leave a broken entry behind
+            tmp = self._path(key) + ".tmp"
+            with open(tmp, "wb") as writer:
+                np.savez(writer, **result)
+            os.replace(tmp, self._path(key))
+
+    def _store(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,1285 @@
+# TraceEngine.py
+# Vectorized trace of scene states with NumPy, any number of variants of a scene are traced in one batch
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import copy
+import math
+import numpy as np
+
+from Material import Materials
+
+### same settings as TraceScene: scene rect of 10000 x 10000, rays are as long as its diagonal
+RAY_LENGTH = math.sqrt(10000**2 + 10000**2)
+INTENSITY_THRESHOLD = 0.05
+
+### TraceScene stops after 100 loops, segments of depth 100 are created but not traced any more
+MAX_DEPTH = 99
+
+### Fresnel modes of a source and the part of its light in s polarization: off keeps the fixed t / r of all interfaces,
+### otherwise the interfaces of lenses and prisms reflect and transmit with the Fresnel coefficients
+FRESNEL = {"off": 0.5, "s": 1.0, "p": 0.0, "unpolarized": 0.5}
+DIELECTRIC_TYPES = ("LensElement", "PrismElement")
+
+def rotate(v, alpha):
+    ### rotate (..., 2) vectors by alpha (radians), same sense as vectors.rotate and QGraphicsItem.rotation
+    c = np.cos(alpha)
+    s = np.sin(alpha)
+    return np.stack([v[..., 0]*c - v[..., 1]*s, v[..., 0]*s + v[..., 1]*c], axis=-1)
+
+def cross(a, b):
+    return a[..., 0]*b[..., 1] - a[..., 1]*b[..., 0]
+
+def fresnel(n1, n2, sinIn):
+    ### (Rs, Rp) reflectances of a dielectric interface, arrays or scalars; beyond the critical angle the cosine of the
+    ### transmitted angle is imaginary and both become 1, total internal reflection needs no branch
+    cosIn = np.sqrt(1 - np.square(sinIn))
+    cosT = np.sqrt(np.asarray(1 - np.square(n1/n2*sinIn), dtype=complex))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rs = (n1*cosIn - n2*cosT) / (n1*cosIn + n2*cosT)
+        rp = (n2*cosIn - n1*cosT) / (n2*cosIn + n1*cosT)
+    return np.abs(rs)**2, np.abs(rp)**2
+
+def dot(a, b):
+    return a[..., 0]*b[..., 0] + a[..., 1]*b[..., 1]
+
+def normalize(v):
+    return v / np.sqrt(dot(v, v))[..., None]
+
+def _take(arr, rows):
+    ### geometry that is the same in all variants is stored once and broadcast over the rays
+    if arr.shape[0] == 1:
+        return arr[0]
+    return arr[rows]
+
+def _pick(arr, rows, index):
+    ### arr (V, S, ...) -> the entry of every ray's variant and surface
+    if arr.shape[0] == 1:
+        return arr[0, index]
+    return arr[rows, index]
+
+def _ranges(starts, counts):
+    ### concatenated ranges [start, start+count) as one index array
+    total = counts.sum()
+    offsets = np.cumsum(counts) - counts
+    return np.repeat(starts - offsets, counts) + np.arange(total)
+
+class Segment:
+    ### straight interface from a to b in element coordinates, arrays over the variants
+    def __init__(self, a, b, normal, iface, t, r, lines = 0.0, active = True, orders = (0,), efficiencies = (1.0,)):
+        self.a = a
+        self.b = b
+        self.normal = normal
+        self.iface = iface
+        self.t = t
+        self.r = r
+        self.lines = lines
+        self.active = active
+        self.orders = orders
+        self.efficiencies = efficiencies
+
+class Arc:
+    ### curved interface, hits are only valid within limit of the element origin (as in LensElement.getIntersections)
+    def __init__(self, center, radius, limit, iface, t, r, active = True):
+        self.center = center
+        self.radius = radius
+        self.limit = limit
+        self.iface = iface
+        self.t = t
+        self.r = r
+        self.lines = 0.0
+        self.active = active
+        self.orders = (0,)
+        self.efficiencies = (1.0,)
+
+class ElementGeometry:
+    ### element state compiled to interfaces, every parameter is an array over the variants (length 1 if not swept)
+    def __init__(self, index, state, overrides = None):
+        self.index = index
+        self.state = state
+        self.overrides = overrides or {}
+
+        self.type = state["type"]
+        self.pos = np.stack(np.broadcast_arrays(self.getParam("x"), self.getParam("y")), axis=-1)
+        self.rot = self.getParam("rot") / 180.0 * math.pi
+
+        material = state.get("mat", "BK7")
+        try:
+            self.n = Materials().getMaterial(material)
+        except NameError:
+            self.n = float(material)
+
+        self.valid = np.ones(1, dtype=bool)
+        self.segments : list[Segment] = []
+        self.arcs : list[Arc] = []
+
+        self.createInterfaces()
+
+    def getParam(self, key, default = None):
+        ### None (e.g. the flat side of a lens) becomes nan
+        if key in self.overrides:
+            return np.asarray(self.overrides[key], dtype=float).reshape(-1)
+
+        if key in ("x", "y"):
+            k = "xy".index(key)
+            if "pos" in self.overrides:
+                return np.asarray(self.overrides["pos"], dtype=float).reshape(-1, 2)[:, k]
+            value = self.state["pos"][k]
+        else:
+            value = self.state.get(key, default)
+
+        return np.array([np.nan if value is None else value], dtype=float)
+
+    def getValue(self, key):
+        return self.getParam(key)
+
+    def getRefractiveIndex(self, wl):
+        if callable(self.n):
+            return self.n(wl)
+        return np.full(np.shape(wl), self.n)
+
+    def createInterfaces(self):
+        pass
+
+    def toLocal(self, points, rows):
+        return rotate(points - _take(self.pos, rows), -_take(self.rot, rows))
+
+    def toScene(self, points):
+        ### (Ve, K, 2) element coordinates -> scene coordinates
+        return self.pos[:, None] + rotate(points, self.rot[:, None])
+
+    def contains(self, points, rows):
+        ### points in scene coordinates (N, 2), rows the variant of every point
+        return np.zeros(len(points), dtype=bool)
+
+    def getOutline(self, samples = 16):
+        ### points along the border of the element, (Ve, K, 2) in scene coordinates
+        return self.toScene(np.zeros((1, 0, 2)))
+
+class SlabGeometry(ElementGeometry):
+    ### two sides of a slab of thickness x height, each side flat (r is nan) or curved, plus absorbing top and bottom edges
+    def createSides(self, r1, r2, tran1, ref1, tran2, ref2, lines = 0.0, orders = (0,), efficiencies = (1.0,)):
+        t = self.getParam("thickness")
+        h = self.getParam("height")
+
+        self.t = t
+        self.h = h
+        self.r1 = r1
+        self.r2 = r2
+
+        ### LensElement.createInterfaces fails for a radius up to half the height
+        self.valid = ~(np.abs(r1) <= h/2) & ~(np.abs(r2) <= h/2)
+
+        with np.errstate(invalid="ignore"):
+            delta1 = r1*np.cos(np.arcsin(h/(2*r1)))
+            delta2 = r2*np.cos(np.arcsin(h/(2*r2)))
+
+        t, h, delta1, delta2 = np.broadcast_arrays(t, h, delta1, delta2)
+        zero = np.zeros_like(t)
+        one = np.ones_like(t)
+
+        self.center1 = np.stack([t/2 - delta1, zero], axis=-1)
+        self.center2 = np.stack([delta2 - t/2, zero], axis=-1)
+
+        curved1 = ~np.isnan(r1)
+        curved2 = ~np.isnan(r2)
+
+        right = np.stack([t/2, zero], axis=-1)
+        top = np.stack([zero, h/2], axis=-1)
+        ex = np.stack([one, zero], axis=-1)
+        ey = np.stack([zero, one], axis=-1)
+
+        self.arcs = [
+            Arc(self.center1, r1, h/2, 0, tran1, ref1, curved1),
+            Arc(self.center2, r2, h/2, 1, tran2, ref2, curved2),
+        ]
+
+        self.segments = [
+            Segment(right + top, right - top, ex, 0, tran1, ref1, 0.0, ~curved1),
+            Segment(-right + top, -right - top, -ex, 1, tran2, ref2, lines, ~curved2, orders, efficiencies),
+            Segment(-right + top, right + top, ey, 2, 0.0, 0.0),
+            Segment(-right - top, right - top, -ey, 3, 0.0, 0.0),
+        ]
+
+    def getSides(self, y, t, r1, r2, c1, c2):
+        ### x of both sides at height y
+        with np.errstate(invalid="ignore"):
+            x1 = c1 + np.sign(r1)*np.sqrt(np.maximum(r1**2 - y**2, 0))
+            x2 = c2 - np.sign(r2)*np.sqrt(np.maximum(r2**2 - y**2, 0))
+
+        return np.where(np.isnan(r1), t/2, x1), np.where(np.isnan(r2), -t/2, x2)
+
+    def contains(self, points, rows):
+        p = self.toLocal(points, rows)
+        x = p[:, 0]
+        y = p[:, 1]
+
+        x1, x2 = self.getSides(y, _take(self.t, rows), _take(self.r1, rows), _take(self.r2, rows),
+            _take(self.center1, rows)[..., 0], _take(self.center2, rows)[..., 0])
+
+        return (np.abs(y) < _take(self.h, rows)/2) & (x < x1) & (x > x2)
+
+    def getOutline(self, samples = 16):
+        s = np.linspace(0, 1, samples)
+        t, h, r1, r2, c1, c2 = [x[:, None] for x in np.broadcast_arrays(self.t, self.h, self.r1, self.r2, self.center1[:, 0], self.center2[:, 0])]
+
+        y = (s - 0.5)*h
+        x1, x2 = self.getSides(y, t, r1, r2, c1, c2)
+        top = np.broadcast_to(h/2, x1.shape)
+
+        points = np.concatenate([
+            np.stack([x1, y], axis=-1),
+            np.stack([x2, y], axis=-1),
+            np.stack([-t/2 + s*t, top], axis=-1),
+            np.stack([-t/2 + s*t, -top], axis=-1),
+        ], axis=1)
+        return self.toScene(points)
+
+class LensGeometry(SlabGeometry):
+    ### LensElement, MirrorElement, BeamBlockElement and DetectorElement
+    def createInterfaces(self):
+        if self.type == "LensElement":
+            ### reflectivity and transmission are not part of a lens state, the lens uses its defaults
+            self.createSides(self.getParam("r1", 1000), self.getParam("r2", 1000), 1.0, 0.0, 1.0, 0.0)
+        else:
+            default = 1.0 if self.type == "MirrorElement" else 0.0
+            self.createSides(self.getParam("r1"), self.getParam("r2"),
+                self.getParam("tran1", 0.0), self.getParam("ref1", default), self.getParam("tran2", 0.0), self.getParam("ref2", default))
+
+class GratingGeometry(SlabGeometry):
+    ### flat slab, the back side diffracts into the given orders of the grating equation, each with its efficiency
+    def createInterfaces(self):
+        self.lines = self.getParam("lines", 600)
+        self.orders = np.asarray(self.state.get("orders", [-1]), dtype=float)
+        self.efficiencies = np.broadcast_to(np.asarray(self.state.get("efficiencies", [1.0]), dtype=float), self.orders.shape)
+        nan = np.full(1, np.nan)
+        self.createSides(nan, nan, 1.0, 0.0, 1.0, 0.0, self.lines, self.orders, self.efficiencies)
+
+class PrismGeometry(ElementGeometry):
+    def createInterfaces(self):
+        base = self.getParam("base", 100)
+        apex = self.getParam("apex", 60.0) / 180.0 * math.pi
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r = base / (2*np.sin(apex))
+            h = np.sqrt(r**2 - (base/2)**2)
+
+        self.valid = np.isfinite(r) & np.isfinite(h)
+
+        base, r, h = np.broadcast_arrays(base, r, h)
+
+        ### (Ve, 3, 2) corners as in PrismElement.createInterfaces
+        self.polygon = np.stack([
+            np.stack([-base/2, h], axis=-1),
+            np.stack([base/2, h], axis=-1),
+            np.stack([np.zeros_like(r), -r], axis=-1),
+        ], axis=1)
+
+        ### PolygonElement.getIntersections walks the corners backwards, all faces use t = 0.95, r = 0.05
+        cnt = self.polygon.shape[1]
+        rng = list(range(cnt)) + [0]
+        rng.reverse()
+
+        for k in range(cnt):
+            a = self.polygon[:, rng[k]]
+            b = self.polygon[:, rng[k+1]]
+            d = b - a
+            normal = normalize(np.stack([d[..., 1], -d[..., 0]], axis=-1))
+            self.segments.append(Segment(a, b, normal, k, 0.95, 0.05))
+
+    def contains(self, points, rows):
+        ### even odd rule, the fill rule of the element path
+        p = self.toLocal(points, rows)
+        poly = np.broadcast_to(_take(self.polygon, rows), (len(p),) + self.polygon.shape[1:])
+
+        inside = np.zeros(len(p), dtype=bool)
+        cnt = poly.shape[1]
+        for i in range(cnt):
+            a = poly[:, i]
+            b = poly[:, (i+1) % cnt]
+            crosses = (a[:, 1] > p[:, 1]) != (b[:, 1] > p[:, 1])
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x = a[:, 0] + (p[:, 1] - a[:, 1]) * (b[:, 0] - a[:, 0]) / (b[:, 1] - a[:, 1])
+            inside ^= crosses & (p[:, 0] < x)
+
+        return inside
+
+    def getOutline(self, samples = 16):
+        s = np.linspace(0, 1, samples)[None, :, None]
+        cnt = self.polygon.shape[1]
+        points = [self.polygon[:, i, None] + s*(self.polygon[:, (i+1) % cnt, None] - self.polygon[:, i, None]) for i in range(cnt)]
+        return self.toScene(np.concatenate(points, axis=1))
+
+class SourceGeometry:
+    ### RayElement state: position, direction, intensity and the wavelengths that are split at the first hit
+    def __init__(self, index, state, overrides = None):
+        self.index = index
+        self.state = state
+        self.overrides = overrides or {}
+
+        pos = state["pos"]
+        if "pos" in self.overrides:
+            pos = np.asarray(self.overrides["pos"], dtype=float).reshape(-1, 2).T
+
+        self.pos = np.stack(np.broadcast_arrays(self.getParam("x", pos[0]), self.getParam("y", pos[1])), axis=-1)
+        self.rot = self.getParam("rot", state.get("rot", 0.0)) / 180.0 * math.pi
+        self.intensity = self.getParam("intensity", state.get("intensity", 1.0))
+
+        self.fresnel = state.get("fresnel", "off")
+        if self.fresnel not in FRESNEL:
+            raise ValueError(f"Unknown Fresnel mode {self.fresnel}")
+
+        ### (Vs, W), a swept wavelength replaces the list by a single one
+        if "wl" in self.overrides:
+            self.wl = np.asarray(self.overrides["wl"], dtype=float).reshape(-1, 1)
+        else:
+            self.wl = np.array([state.get("wl", [1.03])], dtype=float)
+
+    def getParam(self, key, value):
+        if key in self.overrides:
+            return np.asarray(self.overrides[key], dtype=float).reshape(-1)
+        return np.asarray(value, dtype=float).reshape(-1)
+
+    def getValue(self, key):
+        if key in ("x", "y"):
+            return self.pos[:, "xy".index(key)]
+        if key == "rot":
+            return np.degrees(self.rot)
+        return self.getParam(key, self.state.get(key))
+
+    def getDirection(self):
+        return rotate(np.array([1.0, 0.0]), self.rot)
+
+    ### number of rays the source emits, all of them share its intensity and wavelengths
+    count = 1
+
+    def getStarts(self, rays = None, variants = None):
+        ### (Vs, count, 2) start points of all rays or (m, 2) of the given ray numbers in the given variants
+        if rays is None:
+            return self.pos[:, None, :]
+        return np.broadcast_to(_take(self.pos, variants), (len(rays), 2))
+
+    def getDirections(self, rays = None, variants = None):
+        ### (Vs, count, 2) directions of all rays or (m, 2) of the given ray numbers in the given variants
+        if rays is None:
+            return self.getDirection()[:, None, :]
+        return np.broadcast_to(_take(self.getDirection(), variants), (len(rays), 2))
+
+class BeamGeometry(SourceGeometry):
+    ### BeamElement state: a bundle of count rays, collimated over width, a point source fanning out over divergence (degrees)
+    ### or gaussian (width and divergence are 4 sigma), the first ray is always the beam axis (chief ray)
+    MODES = ["collimated", "point", "gaussian"]
+
+    ### gaussian samples are drawn in blocks of rays with their own seed, any range of rays is generated the same way
+    BLOCK = 4096
+
+    def __init__(self, index, state, overrides = None):
+        super().__init__(index, state, overrides)
+
+        self.count = max(1, int(state.get("count", 101)))
+        self.width = self.getParam("width", state.get("width", 100.0))
+        self.divergence = self.getParam("divergence", state.get("divergence", 10.0)) / 180.0 * math.pi
+        self.seed = int(state.get("seed", 0))
+
+        self.mode = state.get("mode", "collimated")
+        if self.mode not in self.MODES:
+            raise ValueError(f"Unknown beam mode {self.mode}")
+
+    def getValue(self, key):
+        if key == "divergence":
+            return np.degrees(self.divergence)
+        return super().getValue(key)
+
+    def getSamples(self, rays):
+        ### unit offsets (across the beam) and angles of ray numbers, fixed for a state so that moves keep the rays
+        k = np.asarray(rays) - 1
+        n = self.count - 1
+        offset = np.zeros(len(k))
+        angle = np.zeros(len(k))
+        sample = k >= 0
+
+        if self.mode == "gaussian":
+            block = k // self.BLOCK
+            for b in np.unique(block[sample]):
+                z = np.random.default_rng([self.seed, b]).normal(0.0, 0.25, (self.BLOCK, 2))
+                mask = block == b
+                offset[mask], angle[mask] = z[k[mask] % self.BLOCK].T
+        else:
+            u = np.where(sample, -0.5 + k / max(n - 1, 1), 0.0)
+            if self.mode == "collimated":
+                offset = u
+            else:
+                angle = u
+
+        return offset, angle
+
+    def getStarts(self, rays = None, variants = None):
+        offset, _ = self.getSamples(np.arange(self.count) if rays is None else rays)
+        if variants is None:
+            pos, rot, width = self.pos[:, None, :], self.rot[:, None], self.width[:, None]
+        else:
+            pos, rot, width = _take(self.pos, variants), _take(self.rot, variants), _take(self.width, variants)
+        return pos + rotate(np.stack(np.broadcast_arrays(0.0, width*offset), axis=-1), rot)
+
+    def getDirections(self, rays = None, variants = None):
+        _, angle = self.getSamples(np.arange(self.count) if rays is None else rays)
+        if variants is None:
+            rot, divergence = self.rot[:, None], self.divergence[:, None]
+        else:
+            rot, divergence = _take(self.rot, variants), _take(self.divergence, variants)
+        return rotate(np.array([1.0, 0.0]), rot + divergence*angle)
+
+ELEMENT_TYPES = {
+    "LensElement": LensGeometry,
+    "MirrorElement": LensGeometry,
+    "BeamBlockElement": LensGeometry,
+    "DetectorElement": LensGeometry,
+    "GratingElement": GratingGeometry,
+    "PrismElement": PrismGeometry,
+}
+
+SOURCE_TYPES = {
+    "RayElement": SourceGeometry,
+    "BeamElement": BeamGeometry,
+}
+
+class TraceGeometry:
+    ### elements and sources of a scene (getState() dicts), overrides maps a state index to {key: values over the variants}
+    ### only elements with overrides are compiled per variant, everything else once
+    def __init__(self, states, overrides = None):
+        overrides = overrides or {}
+
+        self.states = list(states)
+        self.overrides = overrides
+        self.elements : list[ElementGeometry] = []
+        self.sources : list[SourceGeometry] = []
+
+        for i, state in enumerate(self.states):
+            typeName = state["type"]
+            if typeName in SOURCE_TYPES:
+                self.sources.append(SOURCE_TYPES[typeName](i, state, overrides.get(i)))
+            elif typeName in ELEMENT_TYPES:
+                self.elements.append(ELEMENT_TYPES[typeName](i, state, overrides.get(i)))
+            else:
+                raise NameError(f"Element type {typeName} not found")
+
+        ### sources with Fresnel coefficients and the part of their light in s polarization, by state index
+        self.fresnel = np.zeros(len(self.states), dtype=bool)
+        self.sFraction = np.full(len(self.states), 0.5)
+        for x in self.sources:
+            self.fresnel[x.index] = x.fresnel != "off"
+            self.sFraction[x.index] = FRESNEL[x.fresnel]
+
+        self.variants = max([len(np.asarray(x)) for values in overrides.values() for x in values.values()], default=1)
+
+        ### a variant is invalid if the scene could not be built, e.g. a lens radius below half its height
+        self.valid = np.ones(self.variants, dtype=bool)
+        for element in self.elements:
+            self.valid &= np.broadcast_to(element.valid, (self.variants,))
+
+        self.elementsByIndex = {x.index: x for x in self.elements}
+        self.sourcesByIndex = {x.index: x for x in self.sources}
+
+        ### parameters (state index, key) the trace carries derivatives for, see setDerivatives
+        self.params = None
+
+        ### surface numbers in the order of a sequential trace, see setOrder
+        self.order = None
+
+        self.compile()
+
+    def __len__(self):
+        return self.variants
+
+    def compile(self):
+        ### interfaces of all elements in scene coordinates, stacked to (V or 1, S, ...) arrays
+        V = self.variants
+
+        def stack(values, shape = ()):
+            if len(values) == 0:
+                return np.zeros((1, 0) + shape)
+            return np.stack([np.broadcast_to(x, (V,) + shape) for x in values], axis=1)
+
+        def toScene(element, p):
+            return element.pos + rotate(p, element.rot)
+
+        segments = [(e, x) for e in self.elements for x in e.segments]
+        arcs = [(e, x) for e in self.elements for x in e.arcs]
+
+        self.segA = stack([toScene(e, x.a) for e, x in segments], (2,))
+        self.segB = stack([toScene(e, x.b) for e, x in segments], (2,))
+        self.segNormal = stack([rotate(x.normal, e.rot) for e, x in segments], (2,))
+        self.segActive = stack([np.asarray(x.active) for e, x in segments]).astype(bool)
+
+        self.arcCenter = stack([toScene(e, x.center) for e, x in arcs], (2,))
+        self.arcRadius = stack([np.abs(x.radius) for e, x in arcs])
+        self.arcFlip = stack([np.where(x.radius < 0, -1.0, 1.0) for e, x in arcs])
+        self.arcOrigin = stack([e.pos for e, x in arcs], (2,))
+        self.arcLimit = stack([x.limit for e, x in arcs])
+        self.arcActive = stack([np.asarray(x.active) for e, x in arcs]).astype(bool)
+
+        ### per interface: element (state index), interface number within the element and its t / r / grating lines
+        surfaces = segments + arcs
+        self.surfaceElement = np.array([e.index for e, x in surfaces], dtype=np.int64)
+        self.surfaceIface = np.array([x.iface for e, x in surfaces], dtype=np.int64)
+        self.surfaceT = stack([np.asarray(x.t, dtype=float) for e, x in surfaces])
+        self.surfaceR = stack([np.asarray(x.r, dtype=float) for e, x in surfaces])
+        self.surfaceLines = stack([np.asarray(x.lines, dtype=float) for e, x in surfaces])
+        self.surfaceDielectric = np.array([e.type in DIELECTRIC_TYPES for e, x in surfaces], dtype=bool)
+
+        ### (S, M) diffraction orders of every interface and their efficiencies, padded with orders of no efficiency,
+        ### plain interfaces have order 0 only
+        M = max([len(x.orders) for e, x in surfaces], default=1)
+        self.surfaceOrders = np.zeros((len(surfaces), M))
+        self.surfaceEfficiency = np.zeros((len(surfaces), M))
+        for k, (e, x) in enumerate(surfaces):
+            self.surfaceOrders[k, :len(x.orders)] = x.orders
+            self.surfaceEfficiency[k, :len(x.efficiencies)] = x.efficiencies
+
+    def perturb(self, offsets):
+        ### variants of this (compiled) geometry with offsets {state index: {key: (V,) deltas}} added to its parameters
+        ### moved and rotated elements keep their interfaces, only elements with other changed keys (radii ...) are rebuilt
+        geometry = copy.copy(self)
+        geometry.overrides = {}
+        geometry.params = None
+
+        def changed(x, deltas):
+            overrides = dict(x.overrides)
+            for key, delta in deltas.items():
+                overrides[key] = self.getValue(x.index, key) + np.asarray(delta, dtype=float).reshape(-1)
+            geometry.overrides[x.index] = overrides
+
+            if any(key not in ("x", "y", "rot") for key in deltas):
+                return type(x)(x.index, x.state, overrides)
+
+            x = copy.copy(x)
+            x.overrides = overrides
+            x.pos = np.stack(np.broadcast_arrays(overrides.get("x", x.pos[:, 0]), overrides.get("y", x.pos[:, 1])), axis=-1)
+            if "rot" in overrides:
+                x.rot = overrides["rot"] / 180.0 * math.pi
+            return x
+
+        geometry.elements = [changed(x, offsets[x.index]) if x.index in offsets else x for x in self.elements]
+        geometry.sources = [changed(x, offsets[x.index]) if x.index in offsets else x for x in self.sources]
+        geometry.elementsByIndex = {x.index: x for x in geometry.elements}
+        geometry.sourcesByIndex = {x.index: x for x in geometry.sources}
+
+        geometry.variants = max([len(x) for values in geometry.overrides.values() for x in values.values()], default=1)
+        geometry.valid = np.ones(geometry.variants, dtype=bool)
+        for element in geometry.elements:
+            geometry.valid &= np.broadcast_to(element.valid, (geometry.variants,))
+
+        geometry.compile()
+        return geometry
+
+    def getValue(self, index, key):
+        ### (V,) values of a state parameter over the variants
+        x = self.elementsByIndex[index] if index in self.elementsByIndex else self.sourcesByIndex[index]
+        return np.broadcast_to(x.getValue(key), (self.variants,)).astype(float)
+
+    def setDerivatives(self, params, step = 1e-6):
+        ### params: list of (state index, key), the trace then carries the derivatives of every segment with respect to them
+        ### the derivatives of the interfaces come from the compiled geometry of slightly changed parameters (no trace),
+        ### everything after that is propagated analytically through intersections, refraction, reflection and gratings
+        self.params = list(params)
+        V = self.variants
+
+        names = ["segA", "segB", "segNormal", "arcCenter", "arcRadius", "surfaceLines"]
+        derivatives = {x: [] for x in names}
+        sourcePos = {x.index: [] for x in self.sources}
+        sourceDirection = {x.index: [] for x in self.sources}
+
+        for index, key in self.params:
+            value = self.getValue(index, key)
+            h = step*np.maximum(1.0, np.abs(value))
+
+            geometries = []
+            for sign in (1, -1):
+                overrides = {i: dict(x) for i, x in self.overrides.items()}
+                overrides.setdefault(index, {})[key] = value + sign*h
+                geometries.append(TraceGeometry(self.states, overrides))
+
+            plus, minus = geometries
+
+            def derivative(a, b):
+                a = np.broadcast_to(a, (V,) + a.shape[1:])
+                b = np.broadcast_to(b, (V,) + b.shape[1:])
+                return (a - b) / (2*h.reshape((V,) + (1,)*(a.ndim - 1)))
+
+            for x in names:
+                derivatives[x].append(derivative(getattr(plus, x), getattr(minus, x)))
+
+            for a, b in zip(plus.sources, minus.sources):
+                sourcePos[a.index].append(derivative(a.getStarts(), b.getStarts()))
+                sourceDirection[a.index].append(derivative(a.getDirections(), b.getDirections()))
+
+        ### (V, S, P, ...) and (V, count, P, 2) per source
+        for x in names:
+            shape = getattr(self, x).shape
+            value = np.stack(derivatives[x], axis=2) if len(self.params) > 0 else np.zeros((V, shape[1], 0) + shape[2:])
+            setattr(self, "d" + x[0].upper() + x[1:], value)
+
+        counts = {x.index: x.count for x in self.sources}
+        self.dSourcePos = {k: np.stack(v, axis=2) if len(v) > 0 else np.zeros((V, counts[k], 0, 2)) for k, v in sourcePos.items()}
+        self.dSourceDirection = {k: np.stack(v, axis=2) if len(v) > 0 else np.zeros((V, counts[k], 0, 2)) for k, v in sourceDirection.items()}
+
+    def getSurfaces(self, index, iface):
+        ### surface numbers of an interface of an element (flat and curved version, only one is active)
+        return np.flatnonzero((self.surfaceElement == index) & (self.surfaceIface == iface))
+
+    def setOrder(self, order = None, source = None, threshold = INTENSITY_THRESHOLD, maxDepth = MAX_DEPTH):
+        ### sequential trace along (state index, iface) pairs, without an order the interfaces the chief ray of source
+        ### (the first source if not given) meets in a non sequential trace of the first variant are used
+        if order is None:
+            self.order = None
+            result = trace(self, threshold, maxDepth)
+            order = result.getSurfaceOrder(source if source is not None else self.sources[0].index)
+
+        self.order = [self.getSurfaces(index, iface) for index, iface in order]
+        return list(order)
+
+    def contains(self, points, variant):
+        ### TraceScene takes the refractive index of the hit element if the ray starts inside any element
+        inside = np.zeros(len(points), dtype=bool)
+        for element in self.elements:
+            inside |= element.contains(points, variant)
+        return inside
+
+    def getPairs(self, indices = None):
+        ### pairs of elements (positions in self.elements), only pairs with one of the given state indices if given
+        pairs = []
+        for i in range(len(self.elements)):
+            for j in range(i+1, len(self.elements)):
+                if indices is None or self.elements[i].index in indices or self.elements[j].index in indices:
+                    pairs.append((i, j))
+        return pairs
+
+    def getOverlaps(self, pairs, samples = 16):
+        ### (V, len(pairs)) whether the two elements reach into each other, the rule a move in the scene is rejected by
+        V = self.variants
+        outlines = {}
+        overlaps = np.zeros((V, len(pairs)), dtype=bool)
+        rows = np.arange(V)
+
+        for k, (i, j) in enumerate(pairs):
+            for a, b in ((i, j), (j, i)):
+                if a not in outlines:
+                    outline = self.elements[a].getOutline(samples)
+                    outlines[a] = np.broadcast_to(outline, (V,) + outline.shape[1:])
+                points = outlines[a]
+                K = points.shape[1]
+                inside = self.elements[b].contains(points.reshape(-1, 2), np.repeat(rows, K))
+                overlaps[:, k] |= inside.reshape(V, K).any(axis=1)
+
+        return overlaps
+
+    def getRefractiveIndex(self, index, wl):
+        n = np.ones(len(wl))
+        for i in np.unique(index):
+            mask = index == i
+            n[mask] = self.elementsByIndex[i].getRefractiveIndex(wl[mask])
+        return n
+
+    def getSourceCount(self):
+        ### number of source rays of all valid variants
+        return int(self.valid.sum()) * sum(x.count for x in self.sources)
+
+    def getSourceRays(self, start = 0, stop = None):
+        ### source rays [start, stop) of all valid variants, ordered by variant, then by source and ray number,
+        ### only the rays of the range are generated
+        variants = np.flatnonzero(self.valid)
+        N = np.array([x.count for x in self.sources], dtype=np.int64)
+        R = int(N.sum())
+
+        stop = len(variants)*R if stop is None else min(stop, len(variants)*R)
+        if start >= stop:
+            return RayBatch.empty()
+
+        g = np.arange(start, stop)
+        m = len(g)
+        variant = variants[g // R]
+        first = np.cumsum(N) - N
+        which = np.searchsorted(first, g % R, side="right") - 1
+        ray = g % R - first[which]
+
+        ### wavelength lists of all rays, concatenated
+        widths = np.array([x.wl.shape[1] for x in self.sources], dtype=np.int64)
+        counts = widths[which]
+        offsets = np.cumsum(counts) - counts
+
+        origin = np.zeros((m, 2))
+        direction = np.zeros((m, 2))
+        intensity = np.zeros(m)
+        values = np.zeros(counts.sum())
+
+        P = len(self.params) if self.params is not None else 0
+        dstart = np.zeros((m, P, 2))
+        ddirection = np.zeros((m, P, 2))
+
+        for k, x in enumerate(self.sources):
+            rows = np.flatnonzero(which == k)
+            if len(rows) == 0:
+                continue
+
+            v = variant[rows]
+            origin[rows] = x.getStarts(ray[rows], v)
+            direction[rows] = x.getDirections(ray[rows], v)
+            intensity[rows] = _take(x.intensity, v)
+            values[_ranges(offsets[rows], counts[rows])] = np.broadcast_to(_take(x.wl, v), (len(rows), widths[k])).reshape(-1)
+
+            if self.params is not None:
+                dstart[rows] = self.dSourcePos[x.index][v, ray[rows]]
+                ddirection[rows] = self.dSourceDirection[x.index][v, ray[rows]]
+
+        source = np.array([x.index for x in self.sources], dtype=np.int64)[which]
+        rays = RayBatch(origin, direction, variant, source, np.full(m, -1, dtype=np.int64), intensity, values[offsets],
+            np.zeros(m), (counts, values))
+        rays.sFraction = self.sFraction[source]
+
+        if self.order is not None:
+            rays.step = np.zeros(m, dtype=np.int64)
+
+        if self.params is not None:
+            rays.dstart = dstart
+            rays.ddirection = ddirection
+            rays.dpath = np.zeros((m, P))
+            rays.dopl = np.zeros((m, P))
+
+        return rays
+
+class RayBatch:
+    ### rays of one generation; wl holds one wavelength per ray, spectrum (counts, values) the wavelengths of source rays
+    ### path is the geometric path length from the source to the start of the ray, opl the optical one
+    def __init__(self, start, direction, variant, source, parent, intensity, wl, path, spectrum = None):
+        self.start = start
+        self.direction = direction
+        self.variant = variant
+        self.source = source
+        self.parent = parent
+        self.intensity = intensity
+        self.wl = wl
+        self.path = path
+        self.spectrum = spectrum
+
+        ### optical path length (refractive index times length) from the source to the start of the ray
+        self.opl = np.zeros(len(start))
+
+        ### diffraction order of the interaction that created the ray, 0 for source rays and plain interfaces
+        self.order = np.zeros(len(start), dtype=np.int64)
+
+        ### part of the intensity in s polarization, the rest is p
+        self.sFraction = np.full(len(start), 0.5)
+
+        ### derivatives (N, P, ...) with respect to the parameters of the geometry, None if not traced
+        self.dstart = None
+        self.ddirection = None
+        self.dpath = None
+        self.dopl = None
+
+        ### position in the order of a sequential trace of the interface every ray is expected to hit next,
+        ### -1 for rays traced non sequentially, None if the whole trace is non sequential
+        self.step = None
+
+    def __len__(self):
+        return len(self.start)
+
+    def take(self, rows):
+        ### subset of the rays
+        spectrum = None
+        if self.spectrum is not None:
+            counts, values = self.spectrum
+            spectrum = (counts[rows], values[_ranges((np.cumsum(counts) - counts)[rows], counts[rows])])
+
+        rays = RayBatch(self.start[rows], self.direction[rows], self.variant[rows], self.source[rows], self.parent[rows],
+            self.intensity[rows], self.wl[rows], self.path[rows], spectrum)
+
+        rays.opl = self.opl[rows]
+        rays.order = self.order[rows]
+        rays.sFraction = self.sFraction[rows]
+        for key in ("dstart", "ddirection", "dpath", "dopl", "step"):
+            if getattr(self, key) is not None:
+                setattr(rays, key, getattr(self, key)[rows])
+        return rays
+
+    @staticmethod
+    def empty():
+        i = np.zeros(0, dtype=np.int64)
+        return RayBatch(np.zeros((0, 2)), np.zeros((0, 2)), i, i, i, np.zeros(0), np.zeros(0), np.zeros(0))
+
+def intersect(geometry, rays, rayLength = RAY_LENGTH, surfaces = None):
+    ### closest interface along every ray -> distance (inf if nothing is hit), surface, hit point and surface normal
+    ### surfaces limits the test to some interfaces (surface numbers), e.g. the next ones of a sequential trace
+    p = rays.start[:, None]
+    d = rays.direction[:, None]
+    v = rays.variant
+    n = len(rays)
+
+    nseg = geometry.segA.shape[1]
+    narc = geometry.arcCenter.shape[1]
+    if surfaces is None:
+        segIndex = np.arange(nseg)
+        arcIndex = np.arange(narc)
+    else:
+        surfaces = np.asarray(surfaces, dtype=np.int64)
+        segIndex = surfaces[surfaces < nseg]
+        arcIndex = surfaces[surfaces >= nseg] - nseg
+
+    ### straight interfaces, same test as vectors.LineLine on the ray of length rayLength
+    a = _take(geometry.segA[:, segIndex], v)
+    s = _take(geometry.segB[:, segIndex], v) - a
+    r = d*rayLength
+    qp = a - p
+    denom = cross(r, s)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = cross(qp, s) / denom
+        u = cross(qp, r) / denom
+
+    ok = _take(geometry.segActive[:, segIndex], v) & (denom != 0) & (t > 0) & (t <= 1) & (u >= 0) & (u <= 1)
+    segDist = np.where(ok, t*rayLength, np.inf)
+
+    ### curved interfaces, both points of vectors.LineCircle
+    c = _take(geometry.arcCenter[:, arcIndex], v)
+    radius = _take(geometry.arcRadius[:, arcIndex], v)
+    tc = dot(d, c - p)
+    lec = np.sqrt(dot(p + tc[..., None]*d - c, p + tc[..., None]*d - c))
+
+    with np.errstate(invalid="ignore"):
+        dt = np.sqrt(radius**2 - lec**2)
+
+    active = _take(geometry.arcActive[:, arcIndex], v) & (lec <= radius)
+    origin = _take(geometry.arcOrigin[:, arcIndex], v)
+    limit = _take(geometry.arcLimit[:, arcIndex], v)
+
+    arcDist = []
+    for k in (tc - dt, tc + dt):
+        pt = p + k[..., None]*d
+        ok = active & (k > 0) & (k <= rayLength) & (np.sqrt(dot(pt - origin, pt - origin)) < limit)
+        arcDist.append(np.where(ok, k, np.inf))
+
+    dist = np.concatenate([np.broadcast_to(segDist, (n, segDist.shape[-1]))] + [np.broadcast_to(x, (n, x.shape[-1])) for x in arcDist], axis=1)
+
+    rows = np.arange(n)
+    if dist.shape[1] == 0:
+        return np.full(n, np.inf), np.full(n, -1, dtype=np.int64), np.full((n, 2), np.nan), np.full((n, 2), np.nan)
+
+    best = np.argmin(dist, axis=1)
+    distance = dist[rows, best]
+
+    ### column -> surface number (segments first, then both points of the arcs)
+    surface = np.concatenate([segIndex, nseg + arcIndex, nseg + arcIndex])[best]
+    isArc = surface >= nseg
+
+    point = rays.start + np.where(np.isfinite(distance), distance, 0)[:, None]*rays.direction
+
+    normal = np.full((n, 2), np.nan)
+    seg = ~isArc & np.isfinite(distance)
+    if seg.any():
+        normal[seg] = _pick(geometry.segNormal, v[seg], surface[seg])
+
+    arc = isArc & np.isfinite(distance)
+    if arc.any():
+        j = surface[arc] - nseg
+        normal[arc] = normalize(point[arc] - _pick(geometry.arcCenter, v[arc], j)) * _pick(geometry.arcFlip, v[arc], j)[:, None]
+
+    surface = np.where(np.isfinite(distance), surface, -1)
+    return distance, surface, point, normal
+
+def intersectSequential(geometry, rays, rayLength = RAY_LENGTH):
+    ### every ray is only tested against the interface it is expected to hit next, rays that miss it and rays that
+    ### already left the sequence get the closest hit of all interfaces -> as intersect plus whether the hit was sequential
+    n = len(rays)
+    distance = np.full(n, np.inf)
+    surface = np.full(n, -1, dtype=np.int64)
+    point = np.full((n, 2), np.nan)
+    normal = np.full((n, 2), np.nan)
+
+    for step in np.unique(rays.step[rays.step >= 0]):
+        rows = np.flatnonzero(rays.step == step)
+        distance[rows], surface[rows], point[rows], normal[rows] = intersect(geometry, rays.take(rows), rayLength, geometry.order[step])
+
+    sequential = surface >= 0
+
+    rows = np.flatnonzero(~sequential)
+    if len(rows) > 0:
+        distance[rows], surface[rows], point[rows], normal[rows] = intersect(geometry, rays.take(rows), rayLength)
+
+    return distance, surface, point, normal, sequential
+
+def perp(v):
+    ### derivative of rotate(v, alpha) with respect to alpha
+    return np.stack([-v[..., 1], v[..., 0]], axis=-1)
+
+def intersectDerivatives(geometry, rays, distance, surface, point, normal):
+    ### derivatives of the hit distance, point and normal from those of the ray and of the hit interface
+    n, P = rays.dstart.shape[:2]
+    ddistance = np.zeros((n, P))
+    dpoint = np.zeros((n, P, 2))
+    dnormal = np.zeros((n, P, 2))
+
+    nseg = geometry.segA.shape[1]
+    hit = surface >= 0
+
+    for isArc in (False, True):
+        rows = np.flatnonzero(hit & ((surface >= nseg) == isArc))
+        if len(rows) == 0:
+            continue
+
+        v = rays.variant[rows]
+        d = rays.direction[rows]
+        s = distance[rows]
+        x = point[rows]
+        dp = rays.dstart[rows]
+        dd = rays.ddirection[rows]
+        moved = dp + s[:, None, None]*dd
+
+        if not isArc:
+            ### p + s d = a + u e: the part of the change across the interface moves the hit along the ray
+            j = surface[rows]
+            a = _pick(geometry.segA, v, j)
+            e = _pick(geometry.segB, v, j) - a
+            da = _pick(geometry.dSegA, v, j)
+            de = _pick(geometry.dSegB, v, j) - da
+            u = dot(x - a, e) / dot(e, e)
+
+            ds = -cross(moved - da - u[:, None, None]*de, e[:, None]) / cross(d, e)[:, None]
+            dn = _pick(geometry.dSegNormal, v, j)
+        else:
+            ### |p + s d - c| = R
+            j = surface[rows] - nseg
+            w = x - _pick(geometry.arcCenter, v, j)
+            radius = _pick(geometry.arcRadius, v, j)
+            dc = _pick(geometry.dArcCenter, v, j)
+
+            ds = (radius[:, None]*_pick(geometry.dArcRadius, v, j) - dot(w[:, None], moved - dc)) / dot(w, d)[:, None]
+
+            ### derivative of flip * w / |w|
+            length = np.sqrt(dot(w, w))
+            nw = w / length[:, None]
+            dw = moved + ds[..., None]*d[:, None] - dc
+            dn = (dw - nw[:, None]*dot(nw[:, None], dw)[..., None]) / length[:, None, None] * _pick(geometry.arcFlip, v, j)[:, None, None]
+
+        ddistance[rows] = ds
+        dpoint[rows] = moved + ds[..., None]*d[:, None]
+        dnormal[rows] = dn
+
+    return ddistance, dpoint, dnormal
+
+def interact(geometry, rays, index, point, normal, surface, threshold = INTENSITY_THRESHOLD, tangents = None, inside = None):
+    ### transmitted and reflected rays at the hits of rays[index], same rules as TraceScene.traceRays
+    ### returns the children and for each child the number of its parent in rays
+    ### inside: whether rays[index] start inside an element, computed if not given
+    if rays.spectrum is not None:
+        ### source rays are split into their wavelengths at the first hit
+        counts, values = rays.spectrum
+        starts = np.cumsum(counts) - counts
+        wl = values[_ranges(starts[index], counts[index])]
+        k = np.repeat(np.arange(len(index)), counts[index])
+    else:
+        wl = rays.wl[index]
+        k = np.arange(len(index))
+
+    if inside is None:
+        inside = geometry.contains(rays.start[index], rays.variant[index])
+    inside = inside[k]
+
+    parent = index[k]
+    point = point[k]
+    nrm = normal[k]
+    surface = surface[k]
+    variant = rays.variant[parent]
+    d = rays.direction[parent]
+    intensity = rays.intensity[parent]
+
+    nElement = geometry.getRefractiveIndex(geometry.surfaceElement[surface], wl)
+    n1 = np.where(inside, nElement, 1.0)
+    n2 = np.where(inside, 1.0, nElement)
+
+    t = _pick(geometry.surfaceT, variant, surface)
+    r = _pick(geometry.surfaceR, variant, surface)
+    lines = _pick(geometry.surfaceLines, variant, surface)
+    orders = geometry.surfaceOrders[surface]
+    efficiency = geometry.surfaceEfficiency[surface]
+    M = orders.shape[1]
+
+    ### all diffraction orders of a hit at once (N, M), order m of the grating equation adds -m wl / d to the sines,
+    ### zero lines is plain refraction
+    grating = lines != 0
+    g = -orders*(wl*1e-3*lines)[:, None]
+
+    sinIn = np.clip(cross(d, nrm), -1, 1)
+    angle = np.arcsin(sinIn)
+    facing = dot(nrm, d)
+
+    ### rays of Fresnel sources meeting a transmitting interface of a lens or prism get its Fresnel coefficients instead of
+    ### t and r, the s and p parts are followed separately
+    s = rays.sFraction[parent]
+    sT, sR = s, s
+    coated = geometry.fresnel[rays.source[parent]] & geometry.surfaceDielectric[surface] & (t > 0) & ~grating
+    if coated.any():
+        Rs, Rp = fresnel(n1, n2, sinIn)
+        R = s*Rs + (1 - s)*Rp
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sT = np.where(coated & (R < 1), s*(1 - Rs) / (1 - R), s)
+            sR = np.where(coated & (R > 0), s*Rs / R, s)
+        t = np.where(coated, 1 - R, t)
+        r = np.where(coated, R, r)
+
+    ### transmission, orders below the threshold and evanescent ones (total internal reflection) are dropped before any ray
+    ### is created, a hit that cannot transmit any of its wanted orders is fully reflected
+    sinT = (n1[:, None]*sinIn[:, None] + g)/n2[:, None]
+    wanted = (intensity*t)[:, None]*efficiency > threshold
+    transmit = wanted & (np.abs(sinT) <= 1)
+    angleT = np.arcsin(np.clip(sinT, -1, 1))
+    angleT = np.where((n2 < n1)[:, None], -angleT, angleT)
+    dirT = rotate(np.where((facing < 0)[:, None], -nrm, nrm)[:, None], angleT)
+
+    r = np.where(wanted.any(axis=1) & ~transmit.any(axis=1), 1.0, r)
+
+    ### reflection
+    sinR = sinIn[:, None] + g
+    angleR = np.where(grating[:, None], np.arcsin(np.clip(sinR, -1, 1)), np.where(n2 < n1, -angle, angle)[:, None])
+    reflect = ((intensity*r)[:, None]*efficiency > threshold) & (np.abs(sinR) <= 1)
+    dirR = rotate(np.where((facing > 0)[:, None], -nrm, nrm)[:, None], -angleR)
+
+    ### children ordered per hit: transmitted orders, then reflected ones
+    keep = np.concatenate([transmit, reflect], axis=1).reshape(-1)
+    direction = np.concatenate([dirT, dirR], axis=1).reshape(-1, 2)[keep]
+    parent = np.repeat(parent, 2*M)[keep]
+
+    children = RayBatch(
+        np.repeat(point, 2*M, axis=0)[keep] + direction,
+        direction,
+        np.repeat(variant, 2*M)[keep],
+        rays.source[parent],
+        parent,
+        np.concatenate([(intensity*t)[:, None]*efficiency, (intensity*r)[:, None]*efficiency], axis=1).reshape(-1)[keep],
+        np.repeat(wl, 2*M)[keep],
+        np.zeros(len(direction)),
+    )
+    children.order = np.concatenate([orders, orders], axis=1).reshape(-1)[keep].astype(np.int64)
+    children.sFraction = np.repeat(np.stack([sT, sR], axis=1), M, axis=1).reshape(-1)[keep]
+
+    ### the phase a grating adds (in optical path length) grows with the hit position along the interface, it is the same
+    ### 2 pi per line for every wavelength
+    phase = np.where(grating[:, None], g*cross(point, nrm)[:, None], 0.0)
+    children.opl = np.concatenate([phase, phase], axis=1).reshape(-1)[keep]
+
+    if tangents is not None:
+        ### derivatives of the new directions: the normal turns and the angles change with incidence and grating lines
+        dpoint = tangents[0][k]
+        dn = tangents[1][k]
+        dd = rays.ddirection[index[k]]
+        P = dn.shape[1]
+
+        dg = -orders[..., None]*((wl*1e-3)[:, None]*_pick(geometry.dSurfaceLines, variant, surface))[:, None]
+        dSin = cross(dd, nrm[:, None]) + cross(d[:, None], dn)
+        sign = np.where(n2 < n1, -1.0, 1.0)[:, None]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dAngleT = sign[:, None]*(n1[:, None, None]*dSin[:, None] + dg) / n2[:, None, None] / np.sqrt(1 - sinT**2)[..., None]
+            dAngleR = np.where(grating[:, None, None], (dSin[:, None] + dg) / np.sqrt(1 - sinR**2)[..., None],
+                (sign*dSin / np.sqrt(1 - sinIn**2)[:, None])[:, None])
+
+        ddirT = rotate(np.where((facing < 0)[:, None, None], -dn, dn)[:, None], angleT[..., None]) + perp(dirT)[:, :, None]*dAngleT[..., None]
+        ddirR = rotate(np.where((facing > 0)[:, None, None], -dn, dn)[:, None], -angleR[..., None]) - perp(dirR)[:, :, None]*dAngleR[..., None]
+
+        children.ddirection = np.concatenate([ddirT, ddirR], axis=1).reshape(2*M*len(k), P, 2)[keep]
+        children.dstart = np.repeat(dpoint, 2*M, axis=0)[keep] + children.ddirection
+
+        dphase = dg*cross(point, nrm)[:, None, None] + g[..., None]*(cross(dpoint, nrm[:, None]) + cross(point[:, None], dn))[:, None]
+        dphase = np.where(grating[:, None, None], dphase, 0.0)
+        children.dopl = np.concatenate([dphase, dphase], axis=1).reshape(2*M*len(k), P)[keep]
+
+    return children
+
+### columns of a trace result, one row per segment
+### n is the refractive index of the medium a segment runs in, opl the optical path length from the source to its end,
+### order the diffraction order the segment was created with
+COLUMNS = ["variant", "source", "parent", "depth", "start", "end", "direction", "wl", "intensity", "element", "iface", "normal", "length", "path",
+    "n", "opl", "order"]
+
+def iterTrace(geometry, threshold = INTENSITY_THRESHOLD, maxDepth = MAX_DEPTH, rayLength = RAY_LENGTH, rays = None):
+    ### trace generation by generation, yields the segments of every generation as a dict of columns
+    ### all source rays of the geometry are traced, or the given ones (e.g. a range of getSourceRays)
+    if rays is None:
+        rays = geometry.getSourceRays()
+    offset = 0
+    depth = 0
+
+    while len(rays) > 0:
+        n = len(rays)
+
+        if depth > maxDepth:
+            ### not traced any more, the segment keeps the length it was created with
+            surface = np.full(n, -1, dtype=np.int64)
+            normal = np.full((n, 2), np.nan)
+            length = np.full(n, rayLength - 1)
+        else:
+            if rays.step is not None:
+                distance, surface, point, normal, sequential = intersectSequential(geometry, rays, rayLength)
+            else:
+                distance, surface, point, normal = intersect(geometry, rays, rayLength)
+            length = np.where(surface >= 0, distance, rayLength)
+
+        hit = surface >= 0
+        end = rays.start + length[:, None]*rays.direction
+        element = np.where(hit, geometry.surfaceElement[surface], -1)
+        derivatives = rays.dstart is not None
+
+        ### a ray starting inside an element runs in the element it hits, as in interact, the 1 unit gap behind the
+        ### previous hit belongs to the segment
+        inside = geometry.contains(rays.start, rays.variant) if depth <= maxDepth else np.zeros(n, dtype=bool)
+        medium = np.ones(n)
+        glass = inside & hit
+        if glass.any():
+            medium[glass] = geometry.getRefractiveIndex(element[glass], rays.wl[glass])
+        gap = 1.0 if depth > 0 else 0.0
+
+        if derivatives:
+            ### misses keep their fixed length, only start and direction move the end
+            dlength = np.zeros(rays.dpath.shape)
+            if depth <= maxDepth:
+                ddistance, dpoint, dnormal = intersectDerivatives(geometry, rays, distance, surface, end, normal)
+                dlength = np.where(hit[:, None], ddistance, 0.0)
+            dend = rays.dstart + length[:, None, None]*rays.ddirection + dlength[..., None]*rays.direction[:, None]
+
+        segments = {
+            "variant": rays.variant,
+            "source": rays.source,
+            "parent": rays.parent,
+            "depth": np.full(n, depth, dtype=np.int64),
+            "start": rays.start,
+            "end": end,
+            "direction": rays.direction,
+            "wl": rays.wl,
+            "intensity": rays.intensity,
+            "element": element,
+            "iface": np.where(hit, geometry.surfaceIface[surface], -1),
+            "normal": normal,
+            "length": length,
+            "path": rays.path + length,
+            "n": medium,
+            "opl": rays.opl + medium*(length + gap),
+            "order": rays.order,
+        }
+        if derivatives:
+            segments.update({"dstart": rays.dstart, "ddirection": rays.ddirection, "dend": dend, "dpath": rays.dpath + dlength,
+                "dopl": rays.dopl + medium[:, None]*dlength})
+        yield segments
+
+        if depth > maxDepth:
+            break
+
+        index = np.flatnonzero(hit)
+        tangents = (dend[index], dnormal[index]) if derivatives else None
+        children = interact(geometry, rays, index, end[index], normal[index], surface[index], threshold, tangents, inside[index])
+
+        ### parents as global segment numbers, the 1 unit gap to the surface counts to the path, the optical path adds to
+        ### the phase of a grating
+        children.path = segments["path"][children.parent] + 1
+        phase = children.opl
+        children.opl = segments["opl"][children.parent] + phase
+        if derivatives:
+            dphase = children.dopl
+            children.dpath = segments["dpath"][children.parent]
+            children.dopl = segments["dopl"][children.parent] + dphase
+
+        if rays.spectrum is not None and glass.any():
+            ### a source ray inside an element has the optical length of each of its wavelengths
+            parent = children.parent
+            split = np.ones(len(parent))
+            mask = glass[parent]
+            split[mask] = geometry.getRefractiveIndex(element[parent[mask]], children.wl[mask])
+            children.opl = rays.opl[parent] + split*length[parent] + phase
+            if derivatives:
+                children.dopl = rays.dopl[parent] + split[:, None]*dlength[parent] + dphase
+
+        if rays.step is not None:
+            ### children of sequential hits expect the next interface, the rest stays non sequential
+            step = np.where(sequential & (rays.step + 1 < len(geometry.order)), rays.step + 1, -1)
+            children.step = step[children.parent]
+        children.parent = children.parent + offset
+
+        offset += n
+        depth += 1
+        rays = children
+
+def trace(geometry, threshold = INTENSITY_THRESHOLD, maxDepth = MAX_DEPTH, rayLength = RAY_LENGTH):
+    return TraceResult.fromGenerations(iterTrace(geometry, threshold, maxDepth, rayLength), geometry.variants)
+
+def traceDerivatives(states, params, overrides = None, threshold = INTENSITY_THRESHOLD, maxDepth = MAX_DEPTH, step = 1e-6):
+    ### trace with the derivatives of every segment with respect to params (list of (state index, key), keys as for sweeps)
+    ### adds the columns dstart, ddirection, dend (n, P, 2), dpath and dopl (n, P), e.g. result["dend"][rows, p] is the
+    ### movement of the hit points per unit of the p-th parameter
+    geometry = TraceGeometry(states, overrides)
+    geometry.setDerivatives(params, step)
+    return trace(geometry, threshold, maxDepth)
+
+class TraceResult:
+    ### all segments of a trace as flat columns (see COLUMNS), parents are row numbers
+    def __init__(self, columns, variants = 1):
+        self.columns = columns
+        self.variants = variants
+
+    @staticmethod
+    def fromGenerations(generations, variants = 1):
+        generations = list(generations)
+        if len(generations) == 0:
+            return TraceResult(TraceResult.emptyColumns(), variants)
+
+        return TraceResult({k: np.concatenate([x[k] for x in generations]) for k in generations[0]}, variants)
+
+    @staticmethod
+    def emptyColumns():
+        columns = {k: np.zeros(0, dtype=np.int64) for k in ("variant", "source", "parent", "depth", "element", "iface", "order")}
+        columns.update({k: np.zeros(0) for k in ("wl", "intensity", "length", "path", "n", "opl")})
+        columns.update({k: np.zeros((0, 2)) for k in ("start", "end", "direction", "normal")})
+        return columns
+
+    def __len__(self):
+        return len(self.columns["variant"])
+
+    def __getitem__(self, key):
+        return self.columns[key]
+
+    def getElementRows(self, index, iface = None):
+        ### segments ending on the element with the given state index, optionally on one of its interfaces
+        mask = self.columns["element"] == index
+        if iface is not None:
+            mask &= self.columns["iface"] == iface
+        return np.flatnonzero(mask)
+
+    def getChiefRows(self, source, wl = None, element = None):
+        ### rows of the chief ray of a source in the first variant: the source ray, then always the strongest child (of wl at
+        ### the first hit, the first wavelength of the source if not given), up to element or the last segment
+        rows = np.flatnonzero((self.columns["source"] == source) & (self.columns["depth"] == 0) & (self.columns["variant"] == 0))
+        if len(rows) == 0:
+            raise ValueError(f"Element {source} is not a source")
+
+        element = -1 if element is None else element
+        path = [rows[0]]
+        while self.columns["element"][path[-1]] >= 0 and self.columns["element"][path[-1]] != element:
+            children = np.flatnonzero(self.columns["parent"] == path[-1])
+            if len(path) == 1 and wl is not None:
+                children = children[np.isclose(self.columns["wl"][children], wl)]
+            elif len(path) == 1 and len(children) > 0:
+                children = children[self.columns["wl"][children] == self.columns["wl"][children[0]]]
+            if len(children) == 0:
+                break
+            path.append(children[np.argmax(self.columns["intensity"][children])])
+
+        if element >= 0 and self.columns["element"][path[-1]] != element:
+            raise ValueError(f"The chief ray of source {source} does not reach element {element}")
+
+        return np.array(path, dtype=np.int64)
+
+    def getSurfaceOrder(self, source, wl = None):
+        ### (state index, iface) of the interfaces along the chief ray of a source
+        rows = self.getChiefRows(source, wl)
+        rows = rows[self.columns["element"][rows] >= 0]
+        return [(int(self.columns["element"][x]), int(self.columns["iface"][x])) for x in rows]
+
+    def getVariant(self, variant):
+        rows = np.flatnonzero(self.columns["variant"] == variant)
+        return {k: v[rows] for k, v in self.columns.items()}
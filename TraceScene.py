@@ -5,12 +5,28 @@
 
 
 from PyQt5.QtWidgets import QGraphicsScene, QGraphicsSceneMouseEvent
-from PyQt5 import QtCore, QtGui
+from PyQt5 import QtCore, QtGui, QtSvg
 
 from OpticalElement import *
+from RayTree import RayTree
+from SceneFile import saveBinaryScene, iterBinaryScene, isBinaryScene
+from TraceCache import TraceCache, sceneKey
+from AutoSave import AutoSave, loadAutoSave
+from Sweep import sweep
+from Optimize import optimize, MeritSum
+from Tolerance import tolerance
+from Paraxial import paraxial
+from Detector import detect
+from Stream import stream, iterSegments
+from Export import exportSegments
+from Wavefront import wavefront
+from Dispersion import dispersion
+from TraceEngine import TraceGeometry, trace, fresnel, FRESNEL
 import json
+import numpy as np
+from contextlib import contextmanager
 
-from UndoRedo import UndoRedoItem, UndoRedoType
+from UndoRedo import UndoRedoItem, UndoRedoType, UndoRedoJournal
 
 class TraceScene(QGraphicsScene):
     def __init__(self, parent = None, gridSize = 50, drawLines = False):
@@ -24,10 +40,31 @@ class TraceScene(QGraphicsScene):
         
         self.checkCount = 0
         self.intensityThreshold : float = 0.05
+
+        self.rayTree = RayTree()
+
+        ### hidden segment items kept in the scene for reuse by the next trace
+        self.rayPool : list[RayElement] = []
+
+        ### finished traces by scene state, set to None to always trace
+        self.traceCache = TraceCache()
         
-        self.history : list[UndoRedoItem] = []
-        self.movingItem = None
-        self.oldPos = None
+        ### undo / redo entries reference elements by id, ids are handed out by addElement
+        self.journal = UndoRedoJournal()
+        self.elementsById = {}
+        self.nextElementId = 1
+
+        ### background change log, enabled by setAutoSave
+        self.autoSave = None
+
+        ### interactive moves onto another element are refused, scenes set from stored states switch this off
+        self.rejectOverlaps = True
+
+        ### state of a running bulk update (see beginUpdate / endUpdate)
+        self.batchDepth = 0
+        self.batchElements = []
+        self.batchHistory : list[UndoRedoItem] = []
+        self.batchFullTrace = False
         
         self.selectionChanged.connect(self.selChange)
 
@@ -35,33 +72,177 @@ class TraceScene(QGraphicsScene):
         e.acceptProposedAction()
         
     def undo(self):
-        if len(self.history) < 1:
+        item = self.journal.popUndo()
+        if item is None:
             return
-        
-        # print("undo: ", len(self.history))
-        
-        item = self.history.pop()
-        
-        if item.getType() == UndoRedoType.elementAdded:
-            self.removeElement(item.getElement(), addHistory=False)
-        elif item.getType() == UndoRedoType.elementDeleted:
-            self.addElement(item.getElement(), snap=False,addHistory=False)
-        elif item.getType() == UndoRedoType.elementParamChanged:
-            param = item.getParam()
-            value = item.getValue()
-            element = item.getElement()
-            print("param changed: ", element, param, value)
-            if  param ==  "pos":
-                element.setPos(value)
-                self.history.pop()
-            elif param == "rot":
-                element.setRotation(value)
-                self.history.pop()
-            pass
+
+        self.applyItem(item, undo=True)
+
+    def redo(self):
+        item = self.journal.popRedo()
+        if item is None:
+            return
+
+        self.applyItem(item, undo=False)
+
+    def applyItem(self, item, undo = True):
+        ### replay an entry without recording it, the changed elements are retraced once at the end
+        self.journal.paused += 1
+        try:
+            with self.batchUpdate():
+                self._applyItem(item, undo)
+        finally:
+            self.journal.paused -= 1
+
+    def _applyItem(self, item, undo):
+        itemType = item.getType()
+
+        if itemType == UndoRedoType.batch:
+            items = item.getBefore()
+            for subItem in (reversed(items) if undo else items):
+                self._applyItem(subItem, undo)
+            return
+
+        ### undoing an addition is a deletion and vice versa
+        if itemType == UndoRedoType.elementAdded:
+            itemType = UndoRedoType.elementDeleted if undo else UndoRedoType.elementAdded
+            state = item.getAfter()
+        elif itemType == UndoRedoType.elementDeleted:
+            itemType = UndoRedoType.elementAdded if undo else UndoRedoType.elementDeleted
+            state = item.getBefore()
+
+        if itemType == UndoRedoType.elementAdded:
+            element = self.createElementFromState(state)
+            element.elementId = item.getElementId()
+            self.addElement(element, snap=False)
+            return
+
+        element = self.elementsById.get(item.getElementId())
+        if element is None:
+            return
+
+        if itemType == UndoRedoType.elementDeleted:
+            element.setSelected(False)
+            self.removeElement(element)
+        elif itemType == UndoRedoType.elementParamChanged:
+            self.applyState(element, item.getBefore() if undo else item.getAfter())
+
+    def applyState(self, element, values):
+        ### set some state values of an element, the rays are retraced incrementally
+        state = element.getState()
+        state.update(values)
+
+        ### stored positions are exact, they must not be snapped to the grid again
+        ### and the caller records the change, not the single moves
+        snap = element.getSnap()
+        element.setSnap(False)
+        self.journal.paused += 1
+        try:
+            element.setState(state)
+        finally:
+            self.journal.paused -= 1
+            element.setSnap(snap)
+
+        self.logChange("set", element, values=values)
+
+        ### the hits are only updated by the next trace, so the old rays of the element are still known
+        with self.batchUpdate():
+            self.batchElements.append(element)
+
+    def beginUpdate(self):
+        ### suspend tracing, invalidation and history until the matching endUpdate
+        self.batchDepth += 1
+
+    def endUpdate(self):
+        self.batchDepth -= 1
+        if self.batchDepth > 0:
+            return
+
+        elements, self.batchElements = self.batchElements, []
+        history, self.batchHistory = self.batchHistory, []
+        fullTrace, self.batchFullTrace = self.batchFullTrace, False
+
+        ### the whole batch is undone in one step
+        if len(history) == 1:
+            self.journal.record(history[0])
+        elif len(history) > 1:
+            self.journal.record(UndoRedoItem(UndoRedoType.batch, before=history))
+
+        if fullTrace:
+            self.calculateScene()
+            return
+
+        for element in elements:
+            if isinstance(element, RayElement):
+                self.invalidateRays([element])
+                continue
+            if isinstance(element, BeamElement):
+                continue
+
+            self.invalidateRays(self.getElementRays(element))
+            if element.scene() is self:
+                self.invalidateRays(self.getCrossingRays(element))
+
+        self.updateScene()
+
+    @contextmanager
+    def batchUpdate(self):
+        self.beginUpdate()
+        try:
+            yield self
+        finally:
+            self.endUpdate()
+
+    def addHistory(self, item : UndoRedoItem):
+        if self.journal.isPaused():
+            return
+
+        if self.batchDepth > 0:
+            self.batchHistory.append(item)
+        else:
+            self.journal.record(item)
+
+    def recordChange(self, element, key, before, after):
+        ### called by the elements for every single move or rotation, the journal merges them
+        if element.elementId is None or before == after or self.journal.isPaused():
+            return
+
+        self.logChange("set", element, values={key: after})
+        self.addHistory(UndoRedoItem(UndoRedoType.elementParamChanged, element.elementId, {key: before}, {key: after}))
+
+    def logChange(self, op, element, **data):
+        if self.autoSave is not None:
+            self.autoSave.append(op, element.elementId, **data)
+
+    def setAutoSave(self, directory, **kwargs):
+        ### every change is appended to a log in directory, None switches the log off
+        if self.autoSave is not None:
+            self.autoSave.close()
+            self.autoSave = None
+
+        if directory is not None:
+            self.autoSave = AutoSave(directory, self.getAutoSaveStates, **kwargs)
+            self.autoSave.snapshot()
+
+    def getAutoSaveStates(self):
+        return [dict(x.getState(), id=x.elementId) for x in self.elementsById.values()]
+
+    def recoverAutoSave(self, directory):
+        ### restore the scene from the snapshot and change log left behind in directory
+        self.loadStates(loadAutoSave(directory))
+
+    def registerElement(self, element):
+        if element.elementId is None:
+            element.elementId = self.nextElementId
+        self.nextElementId = max(self.nextElementId, element.elementId+1)
+        self.elementsById[element.elementId] = element
         
     def list(self):
         
         for i, itm in enumerate(self.items()):
+            if not itm.isVisible():
+                continue
+            
             if isinstance(itm, OpticalElement):
                 print(i, itm)
             elif isinstance(itm, RayElement):
@@ -138,15 +319,17 @@ class TraceScene(QGraphicsScene):
         if isinstance(element, RayElement):
             if element.parent is not None:
                 ### find the parent ray
-                pr = list(element.getParents())
-                element = pr[0]
+                element = element.getRoot()
 
         dlg = element.getDialog()
         ret = dlg.exec_()
 
-        if ret == QDialog.DialogCode.Accepted:
-            element.setState(dlg.state)
-            self.calculateScene()
+        if ret == QDialog.DialogCode.Accepted and len(dlg.changes) > 0:
+            before = {k: dlg.istate[k] for k in dlg.changes}
+            self.addHistory(UndoRedoItem(UndoRedoType.elementParamChanged, element.elementId, before, dict(dlg.changes)))
+            self.journal.seal()
+
+            self.applyState(element, dlg.changes)
             # print("accpted: ", dlg.state)
 
     def selChange(self) -> None:
@@ -154,33 +337,13 @@ class TraceScene(QGraphicsScene):
         
         if len(itms) == 1:
             if isinstance(itms[0], RayElement):
-                pr = list(itms[0].getParents(True))
-                for ray in pr:
+                for ray in itms[0].getParents(True):
                     ray.setSelected(True)
                 
 
-    def mousePressEvent(self, event: 'QGraphicsSceneMouseEvent') -> None:
-        pos = event.buttonDownScenePos(QtCore.Qt.MouseButton.LeftButton)
-        itms = self.items(pos)
-
-        if len(itms) > 0:
-            self.movingItem = itms[0]
-        else:
-            self.movingItem = None
-            
-        if self.movingItem is not None and event.button() == QtCore.Qt.MouseButton.LeftButton:
-            self.oldPos = self.movingItem.pos()
-
-        # print(self.movingItem, self.oldPos)
-        return super().mousePressEvent(event)
-
     def mouseReleaseEvent(self, event: 'QGraphicsSceneMouseEvent') -> None:
-        if self.movingItem is not None and event.button() == QtCore.Qt.MouseButton.LeftButton:
-            if self.oldPos != self.movingItem.pos():
-                hi = UndoRedoItem(self.movingItem, UndoRedoType.elementParamChanged,"pos", self.oldPos)
-                self.history.append(hi)
-
-            self.movingItem = None
+        ### a drag ends here, the next one gets its own journal entry
+        self.journal.seal()
         return super().mouseReleaseEvent(event)
                         
     def addElement(self, element, snap = True, addHistory = True):
@@ -193,14 +356,29 @@ class TraceScene(QGraphicsScene):
             if snap:
                 pos = element.getSnapPos(element.pos(), self.gridSize)
                 element.setPos(pos)
-                element.handled = False
 
-            self.addItem(element)
+            element.handled = False
+            self.addRay(element)
+            self.registerElement(element)
+            self.logChange("add", element, state=element.getState())
             
             if addHistory:
-                self.history.append(UndoRedoItem(element, UndoRedoType.elementAdded))
+                self.addHistory(UndoRedoItem(UndoRedoType.elementAdded, element.elementId, after=element.getState()))
                             
-            element.itemMovedOrRotated.connect(self.calculateScene)
+            element.itemMovedOrRotated.connect(self.updateScene)
+
+        elif isinstance(element, BeamElement):
+
+            if snap:
+                pos = element.getSnapPos(element.pos(), self.gridSize)
+                element.setPos(pos)
+
+            self.addItem(element)
+            self.registerElement(element)
+            self.logChange("add", element, state=element.getState())
+            if addHistory:
+                self.addHistory(UndoRedoItem(UndoRedoType.elementAdded, element.elementId, after=element.getState()))
+            element.itemMovedOrRotated.connect(self.updateScene)
             
         elif isinstance(element, OpticalElement):
 
@@ -210,60 +388,150 @@ class TraceScene(QGraphicsScene):
 
             
             self.addItem(element)
+            self.registerElement(element)
+            self.logChange("add", element, state=element.getState())
             if addHistory:
-                self.history.append(UndoRedoItem(element, UndoRedoType.elementAdded))
-            element.itemMovedOrRotated.connect(self.calculateScene)
+                self.addHistory(UndoRedoItem(UndoRedoType.elementAdded, element.elementId, after=element.getState()))
+            element.itemMovedOrRotated.connect(self.updateScene)
 
             ### remove all children rays and update primary rays....
-            
-            itms = element.collidingItems(QtCore.Qt.ItemSelectionMode.IntersectsItemBoundingRect)
-
-            rays = [x for x in itms if isinstance(x, RayElement)]
-
-            for ray in rays:
-                ray.removeChildren()
-
-                if ray.parent is not None:
-                    ray.parent.handled = False
-                    ray.parent.setLength(2000)
-                    ray.parent.removeChildren()
-                else:
-                    ray.handled = False
+            if self.batchDepth > 0:
+                self.batchElements.append(element)
+            else:
+                self.invalidateRays(self.getCrossingRays(element))
 
-        self.calculateScene()
+        self.updateScene()
 
     def removeElement(self, element, addHistory=True):
         if isinstance(element, OpticalElement):
-            rays = element.rays
-            for ray in rays:
-                ray.removeChildren()
-
-                if ray.parent is not None:
-                    ray.parent.handled = False
-                    ray.parent.setLength(2000)
-                    ray.parent.removeChildren()
+            if self.batchDepth > 0:
+                self.batchElements.append(element)
+            else:
+                self.invalidateRays(self.getElementRays(element))
                     
             self.removeItem(element)
+            self.elementsById.pop(element.elementId, None)
+            self.logChange("del", element)
             if addHistory:
-                self.history.append(UndoRedoItem(element, UndoRedoType.elementDeleted))
+                self.addHistory(UndoRedoItem(UndoRedoType.elementDeleted, element.elementId, before=element.getState()))
 
         elif isinstance(element, RayElement):
-            pr = list(element.getParents(True))            
-            element = pr[-1]
+            ### traced segments are part of the result, only their source can be deleted
+            if element.parent is not None:
+                return
+
+            self.removeRaySubtree(element)
+            self.elementsById.pop(element.elementId, None)
+            self.logChange("del", element)
+            if addHistory:
+                element.setSelected(False)
+                self.addHistory(UndoRedoItem(UndoRedoType.elementDeleted, element.elementId, before=element.getState()))
 
-            element.removeChildren()
-            # print("x")
+        elif isinstance(element, BeamElement):
             self.removeItem(element)
-            if addHistory and element.parent is None:
+            self.elementsById.pop(element.elementId, None)
+            self.logChange("del", element)
+            if addHistory:
                 element.setSelected(False)
-                self.history.append(UndoRedoItem(element, UndoRedoType.elementDeleted))
+                self.addHistory(UndoRedoItem(UndoRedoType.elementDeleted, element.elementId, before=element.getState()))
 
         # del(element)
-        self.calculateScene()
+        self.updateScene()
+
+    def addRay(self, ray):
+        parent = -1
+        if ray.parent is not None:
+            parent = ray.parent.treeIndex
+
+        ray.tree = self.rayTree
+        ray.treeIndex = self.rayTree.addNode(ray, parent, ray.intensity*len(ray.wl))
+
+        if ray.scene() is self:
+            ray.setVisible(True)
+        else:
+            self.addItem(ray)
+
+    def createRay(self, x1, y1, x2, y2, intensity, wl, color, showArrow, parent):
+        ### traced segments come from the pool if possible
+        if len(self.rayPool) > 0:
+            ray = self.rayPool.pop()
+            ray.setSegment(x1, y1, x2, y2, intensity, wl, color, showArrow, parent)
+            return ray
+
+        return RayElement(x1, y1, x2, y2, intensity = intensity, wl = wl, color = color, showArrow = showArrow, parent = parent)
+
+    def removeRays(self, rays):
+        for ray in rays:
+            ray.tree = None
+            ray.treeIndex = -1
+
+            if ray.scene() is not self:
+                continue
+
+            if ray.parent is None:
+                self.removeItem(ray)
+            else:
+                ### traced segments stay in the scene, hidden, until they are reused
+                ray.setVisible(False)
+                self.rayPool.append(ray)
+
+    def removeRaySubtree(self, ray, includeSelf = True):
+        if ray.tree is not self.rayTree:
+            return
+
+        self.removeRays(self.rayTree.removeSubtree(ray.treeIndex, includeSelf))
+
+    def invalidateRays(self, rays):
+        ### drop the subtrees behind the given segments and mark the rays to be traced again, all subtrees are removed
+        ### together in one step
+        tree = self.rayTree
+        rays = [x for x in rays if x.tree is tree]
+        if len(rays) == 0:
+            return
+
+        ### the children of a source ray go, a traced segment goes together with its siblings
+        tops = [x if x.parent is None else x.parent for x in rays]
+        mask = tree.subtreesMask([x.treeIndex for x in tops], includeSelf=False)
+
+        for ray, top in zip(rays, tops):
+            if mask[top.treeIndex]:
+                # removed together with another subtree
+                continue
+
+            top.handled = False
+            if ray.parent is not None:
+                top.setLength(2000)
+            else:
+                ### the intensity or wavelengths of a source ray may have changed as well
+                tree.setPower(ray.treeIndex, ray.intensity*len(ray.wl))
+
+        self.removeRays(tree.removeMask(mask))
+
+    def getCrossingRays(self, element):
+        ### rays whose drawn segment crosses the shape of the element at its current position
+        itms = element.collidingItems(QtCore.Qt.ItemSelectionMode.IntersectsItemShape)
+        return [x for x in itms if isinstance(x, RayElement)]
+
+    def getElementRays(self, element):
+        ### segments ending on or emitted by the element in the current trace
+        tree = self.rayTree
+        return [tree.getItem(x) for x in tree.getElementSegments(element)]
+
+    def getElementPower(self, element):
+        ### power arriving at the element, summed over all incoming segments and wavelengths
+        return self.rayTree.getElementPower(element)
+
+    def getElementSources(self, element):
+        ### source rays with at least one segment ending on or leaving the element
+        tree = self.rayTree
+        return [tree.getItem(x) for x in tree.getElementRoots(element)]
 
     def calculateScene(self):
+        if self.batchDepth > 0:
+            self.batchFullTrace = True
+            return
+
         # print("calc")
-        processedRays = 0
         # print("Check: ", self.checkCount)
         # self.checkCount += 1
 
@@ -273,15 +541,142 @@ class TraceScene(QGraphicsScene):
         # if not singleStep:
         #     self.reset()
 
-        ### remove all but parent rays
-        for itm in self.items():
-            if isinstance(itm, RayElement):
-                if itm.parent is None:
-                    itm.handled = False
-                    itm.removeChildren()
+        ### remove all but parent rays, everything below depth 0 goes in one step
+        tree = self.rayTree
+        self.removeRays(tree.removeMask(tree.depth[:len(tree)] > 0))
 
-            if isinstance(itm, OpticalElement):
-                itm.rays = []
+        for ray in tree.items:
+            ray.handled = False
+            tree.setHit(ray.treeIndex, None)
+            tree.setPower(ray.treeIndex, ray.intensity*len(ray.wl))
+
+        self.updateScene()
+
+    def updateScene(self):
+        ### trace all rays that are not handled yet, the rest of the tree is kept
+        if self.batchDepth > 0:
+            return
+
+        self.traceBeams()
+
+        key = None
+        if self.traceCache is not None and any(not x.handled for x in self.rayTree.items):
+            key, items = self.getTraceKey()
+            result = self.traceCache.get(key)
+
+            if result is not None:
+                self.restoreTrace(result, items)
+                self.update(self.sceneRect())
+                return
+
+        self.traceRays()
+
+        if key is not None:
+            self.traceCache.put(key, self.storeTrace(items))
+
+    def traceBeams(self):
+        ### all beams are traced together by the vectorized engine, again only if an element or a beam changed
+        beams = [x for x in self.items() if isinstance(x, BeamElement)]
+        if len(beams) == 0:
+            return
+
+        states = [x.getState() for x in self.items() if isinstance(x, OpticalElement)] + [x.getState() for x in beams]
+        key = json.dumps([states, self.intensityThreshold], default=str)
+        if all(x.traceKey == key for x in beams):
+            return
+
+        rect = self.sceneRect()
+        result = trace(TraceGeometry(states), self.intensityThreshold, rayLength=math.sqrt(rect.width()**2 + rect.height()**2))
+
+        ### the first segment of every ray carries all wavelengths of the beam
+        wl = np.where(result["depth"] == 0, np.nan, result["wl"])
+        for k, beam in enumerate(beams):
+            rows = np.flatnonzero(result["source"] == len(states) - len(beams) + k)
+            beam.setTrace(result["start"][rows], result["end"][rows], wl[rows], result["intensity"][rows])
+            beam.traceKey = key
+            beam.update()
+
+    def getTraceItems(self):
+        ### everything the trace depends on: optical elements, source rays and beams
+        items = [x for x in self.items() if isinstance(x, OpticalElement)]
+        items.extend([x for x in self.rayTree.items if x.parent is None])
+        items.extend([x for x in self.items() if isinstance(x, BeamElement)])
+        return items
+
+    def getTraceKey(self):
+        ### hash of everything the trace depends on, items are returned in the order used by the cache
+        items = self.getTraceItems()
+
+        settings = {
+            "intensityThreshold": self.intensityThreshold,
+            "sceneRect": [self.sceneRect().x(), self.sceneRect().y(), self.sceneRect().width(), self.sceneRect().height()]
+        }
+
+        key, order = sceneKey([x.getState() for x in items], settings)
+        return key, [items[i] for i in order]
+
+    def storeTrace(self, items):
+        ### flat copy of the current ray tree, elements and source rays referenced by their canonical number
+        tree = self.rayTree
+        n = len(tree)
+        ids = {x: k for k, x in enumerate(items)}
+
+        elementMap = np.array([ids.get(x, -1) for x in tree.elements] + [-1], dtype=np.int64)
+        ref = np.full(n, -1, dtype=np.int64)
+        geometry = np.zeros((n, 6))
+        values = np.zeros((n, 6))
+
+        for i, ray in enumerate(tree.items):
+            if ray.parent is None:
+                ref[i] = ids[ray]
+
+            line = ray.line()
+            geometry[i] = (ray.pos().x(), ray.pos().y(), line.x1(), line.y1(), line.x2(), line.y2())
+            values[i, :2] = (ray.intensity, ray.wl[0])
+            values[i, 2:] = ray.color[0].getRgbF()
+
+        return {
+            "parent": tree.parent[:n].copy(),
+            "ref": ref,
+            "hit": elementMap[tree.hitElement[:n]],
+            "geometry": geometry,
+            "values": values,
+            "arrows": np.array([x.showArrow for x in tree.items], dtype=bool),
+            "sFraction": np.array([x.sFraction for x in tree.items], dtype=float),
+        }
+
+    def restoreTrace(self, result, items):
+        ### rebuild the ray tree from a cached trace without tracing
+        tree = self.rayTree
+        self.removeRays(tree.removeMask(tree.depth[:len(tree)] > 0))
+
+        parent = result["parent"]
+        live = [None] * len(parent)
+
+        for i in range(len(parent)):
+            x, y, x1, y1, x2, y2 = result["geometry"][i].tolist()
+
+            if parent[i] < 0:
+                ray = items[result["ref"][i]]
+                ray.setLine(QtCore.QLineF(x1, y1, x2, y2))
+            else:
+                intensity, wl, r, g, b, a = result["values"][i].tolist()
+                ray = self.createRay(x1, y1, x2, y2, intensity = intensity, wl = [wl], color = QtGui.QColor.fromRgbF(r, g, b, a), showArrow = bool(result["arrows"][i]), parent = live[parent[i]])
+                ray.setPos(QtCore.QPointF(x, y))
+
+                ### traced segments keep the Fresnel mode of their source
+                ray.fresnel = live[parent[i]].fresnel
+                ray.sFraction = float(result["sFraction"][i])
+                self.addRay(ray)
+
+            ray.handled = True
+            hit = result["hit"][i]
+            tree.setHit(ray.treeIndex, items[hit] if hit >= 0 else None)
+            live[i] = ray
+
+    def traceRays(self):
+        processedRays = 0
+        tree = self.rayTree
 
         loops = 0
         abort = False
@@ -298,7 +693,7 @@ class TraceScene(QGraphicsScene):
 
             newRays = []
 
-            rays = [x for x in self.items() if isinstance(x, RayElement)]
+            rays = list(tree.items)
             
             # print("Handling: ", len(rays), " rays")
 
@@ -337,6 +732,7 @@ class TraceScene(QGraphicsScene):
 
                     hit_pos = itm.mapToScene(pt)
                     ray.setEndPoint(hit_pos)
+                    tree.setHit(ray.treeIndex, itm)
 
                     ### get surface normal in scene coordinates
                     n_rot = vectors.rotate(n, itm.rotation() / 180.0 * math.pi)
@@ -371,92 +767,107 @@ class TraceScene(QGraphicsScene):
                         # print("Angle: ", angle*180/math.pi)
                         # print(iface.t, iface.r, n1, n2)
 
+                        t = iface.t
                         r = iface.r
 
-                        if ray.intensity * iface.t > self.intensityThreshold:
-                            ### we have transmission on the surface    
+                        ### Fresnel coefficients instead of t and r for the transmitting interfaces of lenses and prisms,
+                        ### the s and p parts of the ray are followed separately
+                        s = FRESNEL[ray.fresnel] if ray.parent is None else ray.sFraction
+                        sT, sR = s, s
+                        if ray.fresnel != "off" and isinstance(itm, (LensElement, PrismElement)) \
+                                and not isinstance(itm, MirrorElement) and t > 0 and iface.lines is None:
+                            Rs, Rp = fresnel(n1, n2, math.sin(angle))
+                            R = float(s*Rs + (1 - s)*Rp)
+                            sT = float(s*(1 - Rs)/(1 - R)) if R < 1 else s
+                            sR = float(s*Rs/R) if R > 0 else s
+                            t, r = 1 - R, R
+
+                        ### diffraction orders of a grating, a plain interface only has order 0
+                        if iface.lines is None:
+                            orders = [(0, 1.0)]
+                        else:
+                            orders = list(zip(iface.orders, iface.efficiencies))
 
-                            try:
-                                if iface.lines is None:
-                                    # print(angle*180/math.pi, n1, n2)
+                        if ray.intensity * t > self.intensityThreshold:
+                            ### we have transmission on the surface
+                            ### orders below the threshold or that cannot be transmitted (evanescent) are skipped,
+                            ### if none of the wanted ones can be transmitted, reflect it ;)
+                            wanted = False
+                            transmitted = False
 
-                                    angle_out = math.asin(n1/n2*math.sin(angle))
+                            for m, eff in orders:
+                                if ray.intensity * t * eff <= self.intensityThreshold:
+                                    continue
+                                wanted = True
 
-                                    # print(angle_out*180/math.pi)
+                                if iface.lines is None:
+                                    sin_out = n1/n2*math.sin(angle)
                                 else:
-                                    # print("Grating: ", angle*180/math.pi, iface.lines, n1,n2)
-                                    m = -1
-                                    
-                                    # angle_out = math.asin(math.sin(angle/180.0*math.pi) - m * ray.wl*1e6 / d)
-                                    angle_out = math.asin((n1*math.sin(angle) - m * wl*1e-6 * iface.lines*1e3)/n2)
+                                    sin_out = (n1*math.sin(angle) - m * wl*1e-6 * iface.lines*1e3)/n2
 
-                                    # print(angle*180/math.pi, angle_out*180/math.pi)
+                                if abs(sin_out) > 1:
+                                    continue
+                                transmitted = True
+
+                                angle_out = math.asin(sin_out)
 
                                 if n2 < n1:
                                     angle_out *= -1
 
                                 ### let the surface normal point into the same direction as incoming ray
-                                if vectors.dotP(n_rotR, ray_p2-ray_p1) < 0:
-                                    n_rotR = vectors.invert(n_rotR)
-                                
+                                n_rotT = n_rotR
+                                if vectors.dotP(n_rotT, ray_p2-ray_p1) < 0:
+                                    n_rotT = vectors.invert(n_rotT)
 
-                                t_dir = vectors.rotate(n_rotR, angle_out)
+                                t_dir = vectors.rotate(n_rotT, angle_out)
 
                                 t_pos=hit_pos
 
-                                # t_ray = RayElement(t_pos.x() + t_dir.x(), t_pos.y() + t_dir.y(), t_pos.x() + t_dir.x() * ray_len, t_pos.y() + t_dir.y() * ray_len, intensity = ray.intensity*iface.t, wl = ray.wl, color=ray.color, parent=ray)                            
-                                t_ray = RayElement(t_dir.x(), t_dir.y(), t_dir.x() * ray_len, t_dir.y() * ray_len, intensity = ray.intensity*iface.t, wl = [wl], color=ray.color[idx], showArrow=ray.showArrow,parent=ray)
+                                t_ray = self.createRay(t_dir.x(), t_dir.y(), t_dir.x() * ray_len, t_dir.y() * ray_len, intensity = ray.intensity*t*eff, wl = [wl], color=ray.color[idx], showArrow=ray.showArrow,parent=ray)
                                 t_ray.setPos(t_pos)
+                                t_ray.fresnel = ray.fresnel
+                                t_ray.sFraction = sT
                                 newRays.append(t_ray)
-                                itm.rays.append(t_ray)
-                            
-                            except ValueError:
-                                # print("error in calculating angle")
-                                ### if it cannot be tranmitted, reflect it ;)
-                                r = 1.0
-                                # pass
 
-                        if ray.intensity * r > self.intensityThreshold:
-                            try:
+                            if wanted and not transmitted:
+                                r = 1.0
 
-                                ### let the surface normal point into different direction as incoming ray
-                                if vectors.dotP(n_rotR, ray_p2-ray_p1) > 0:
-                                    n_rotR = vectors.invert(n_rotR)
+                        ### let the surface normal point into different direction as incoming ray
+                        if vectors.dotP(n_rotR, ray_p2-ray_p1) > 0:
+                            n_rotR = vectors.invert(n_rotR)
 
-                                angle_out = angle
+                        for m, eff in orders:
+                            if ray.intensity * r * eff <= self.intensityThreshold:
+                                continue
 
-                                if iface.lines is None:
-                                    if n2 < n1:
-                                        angle_out *= -1
-                                else:
-                                    m = -1
-                                    # angle_out = math.asin(math.sin(angle/180.0*math.pi) - m * ray.wl*1e6 / d)
-                                    angle_out = math.asin(math.sin(angle) - m * wl*1e-6 * iface.lines*1e3)
+                            angle_out = angle
 
-                                # print(angle)
+                            if iface.lines is None:
+                                if n2 < n1:
+                                    angle_out *= -1
+                            else:
+                                sin_out = math.sin(angle) - m * wl*1e-6 * iface.lines*1e3
+                                if abs(sin_out) > 1:
+                                    continue
+                                angle_out = math.asin(sin_out)
 
-                                t_dir = vectors.rotate(n_rotR, -angle_out)
+                            t_dir = vectors.rotate(n_rotR, -angle_out)
 
-                                t_pos=hit_pos
+                            t_pos=hit_pos
 
-                                # t_ray = RayElement(t_pos.x() + t_dir.x(), t_pos.y() + t_dir.y(), t_pos.x() + t_dir.x() * ray_len, t_pos.y() + t_dir.y() * ray_len, intensity = ray.intensity * r, wl = ray.wl, color=ray.color, parent=ray)
-                                t_ray = RayElement(t_dir.x(), t_dir.y(), t_dir.x() * ray_len, t_dir.y() * ray_len, intensity = ray.intensity * r, wl = [wl], color=ray.color[idx], showArrow=ray.showArrow, parent=ray)
-                                t_ray.setPos(t_pos)
+                            t_ray = self.createRay(t_dir.x(), t_dir.y(), t_dir.x() * ray_len, t_dir.y() * ray_len, intensity = ray.intensity * r * eff, wl = [wl], color=ray.color[idx], showArrow=ray.showArrow, parent=ray)
+                            t_ray.setPos(t_pos)
+                            t_ray.fresnel = ray.fresnel
+                            t_ray.sFraction = sR
 
-                                newRays.append(t_ray)
-                                itm.rays.append(t_ray)                      
-                            except ValueError:
-                                # if ray not in itm.rays:
-                                #     itm.rays.append(ray)
-                                pass
+                            newRays.append(t_ray)
                             # print("Refl: ",t_dir, n_rot)  
                         # else:
                         #     print("Ray <- ", ray.intensity, iface.t)
                         # itm.markers.append(pt)
                         # itm.normals.append((pt-n*15,pt+n*15))
-                                                    ### keep ray in item for updates
-                        if ray not in itm.rays:
-                            itm.rays.append(ray)
+                else:
+                    tree.setHit(ray.treeIndex, None)
 
                 ray.handled = True
 
@@ -464,7 +875,7 @@ class TraceScene(QGraphicsScene):
             # self.rays.extend(newRays)
             
             for ray in newRays:
-                self.addItem(ray)
+                self.addRay(ray)
 
             # if singleStep or abort:
             if abort:
@@ -480,48 +891,299 @@ class TraceScene(QGraphicsScene):
         # self.view.scene().update()
         # print("loops: ", loops, " processed rays ", processedRays)                
 
-    def saveToFile(self, filename):
-        with open(filename, 'w') as writer:
-            
-            data = []
-            for itm in self.items():
-                if isinstance(itm, RayElement):
-                    # only save parent rays
-                    if itm.parent is None:
-                        data.append(itm.getState())
-                elif isinstance(itm, OpticalElement):
+    def sweep(self, params, **kwargs):
+        ### trace variants of the scene without touching it, params as in Sweep.sweep with elements instead of state indices:
+        ### scene.sweep([(grating, "rot", np.linspace(60, 66, 61))]).getHits(beamBlock)
+        items = self.getTraceItems()
+        index = {x: i for i, x in enumerate(items)}
+
+        result = sweep([x.getState() for x in items], [(index[x], key, values) for x, key, values in params], **kwargs)
+        result.items = items
+        return result
+
+    def optimize(self, params, merit, apply = True, **kwargs):
+        ### optimize element parameters, params and merits as in Optimize.optimize with elements instead of state indices,
+        ### the best design is applied to the scene as one undo step
+        items = self.getTraceItems()
+        index = {x: i for i, x in enumerate(items)}
+
+        if isinstance(merit, (list, tuple)):
+            merit = MeritSum(list(merit))
+        merit.bind(items)
+
+        result = optimize([x.getState() for x in items], [(index[x], key, lower, upper) for x, key, lower, upper in params], merit, **kwargs)
+
+        if apply:
+            changes = {}
+            for i, key, _, _ in result.params:
+                key = "pos" if key in ("x", "y") else key
+                changes.setdefault(i, {})[key] = result.states[i][key]
+
+            self.applyChanges([(items[i], x) for i, x in changes.items()])
+
+        return result
+
+    def tolerance(self, tolerances, element, **kwargs):
+        ### Monte Carlo tolerancing without touching the scene, tolerances as in Tolerance.tolerance with elements instead of
+        ### state indices: scene.tolerance([(grating, "rot", 0.05), (mirror, "x", 0.5)], beamBlock, trials=10000).getStats()
+        items = self.getTraceItems()
+        index = {x: i for i, x in enumerate(items)}
+
+        return tolerance([x.getState() for x in items], [(index[x[0]],) + tuple(x[1:]) for x in tolerances], index[element], **kwargs)
+
+    def paraxial(self, source, element = None, **kwargs):
+        ### ABCD matrices along the chief ray of a source ray, up to element or the last interface:
+        ### scene.paraxial(ray, beamBlock).getFocus() is the focus of a collimated beam in scene coordinates
+        items = self.getTraceItems()
+        index = {x: i for i, x in enumerate(items)}
+
+        return paraxial([x.getState() for x in items], index[source], index[element] if element is not None else None, **kwargs)
+
+    def detect(self, detector, **kwargs):
+        ### histograms, centroid and rms size of the rays (source rays and beams) arriving at an element, without touching
+        ### the scene, kwargs as in Detector.detect: scene.detect(detector).getIrradiance()
+        items = self.getTraceItems()
+        index = {x: i for i, x in enumerate(items)}
+
+        kwargs.setdefault("threshold", self.intensityThreshold)
+        if "bins" not in kwargs and isinstance(detector, DetectorElement):
+            kwargs["bins"] = detector.bins
+
+        return detect([x.getState() for x in items], index[detector], **kwargs)
+
+    def stream(self, detectors = (), store = None, **kwargs):
+        ### trace the scene in chunks of source rays with bounded memory, kwargs as in Stream.stream:
+        ### scene.stream([detector], chunkSize=100000)[detector].getRms(), results are keyed by the elements
+        items = self.getTraceItems()
+        index = {x: i for i, x in enumerate(items)}
+
+        kwargs.setdefault("threshold", self.intensityThreshold)
+        result = stream([x.getState() for x in items], [index[x] for x in detectors], store, **kwargs)
+        result.detectors = {items[i]: x for i, x in result.detectors.items()}
+        return result
+
+    def iterSegments(self, chunkSize = None, **kwargs):
+        ### lazy trace of the scene as in Stream.iterSegments, element columns are positions in getTraceItems():
+        ### for segments in scene.iterSegments(): ... can stop at any generation
+        items = self.getTraceItems()
+        kwargs.setdefault("threshold", self.intensityThreshold)
+        return iterSegments(TraceGeometry([x.getState() for x in items]), chunkSize, **kwargs)
+
+    def exportTrace(self, fileName, chunkSize = None, format = None, **kwargs):
+        ### all traced segments (source rays and beams) as a table (.npz, .arrow / .feather or .parquet) with the scene ids
+        ### of the elements and sources, Arrow and Parquet are written generation by generation
+        items = self.getTraceItems()
+        ids = np.array([-1 if x.elementId is None else x.elementId for x in items], dtype=np.int64)
+        return exportSegments(fileName, self.iterSegments(chunkSize, **kwargs), ids, format)
+
+    def getPlane(self, plane, states, index):
+        ### (point, normal) of a plane given as (point, normal) or an element: its face the traced light arrives at, the
+        ### normal along the light
+        if not isinstance(plane, QGraphicsObject):
+            return plane
+
+        alpha = plane.rotation() / 180.0 * math.pi
+        normal = np.array([math.cos(alpha), math.sin(alpha)])
+        result = trace(TraceGeometry(states), self.intensityThreshold)
+        rows = result.getElementRows(index[plane])
+        if np.sum((result["direction"][rows] @ normal)*result["intensity"][rows]) < 0:
+            normal = -normal
+
+        offset = getattr(plane, "thickness", 0) / 2
+        return (np.array([plane.pos().x(), plane.pos().y()]) - offset*normal, normal)
+
+    def wavefront(self, source, plane, **kwargs):
+        ### optical path differences of a source ray or beam at a plane (see getPlane):
+        ### scene.wavefront(beam, detector).getRms(removeTilt=True)
+        items = self.getTraceItems()
+        index = {x: i for i, x in enumerate(items)}
+        states = [x.getState() for x in items]
+
+        kwargs.setdefault("threshold", self.intensityThreshold)
+        return wavefront(states, index[source], *self.getPlane(plane, states, index), **kwargs)
+
+    def dispersion(self, source, plane, center = None, **kwargs):
+        ### group delay, GDD and TOD of a source at a plane (see getPlane) on a dense grid around center, the middle
+        ### wavelength of the source if not given: scene.dispersion(ray, block, span=0.06, samples=2048).getCoefficients()
+        items = self.getTraceItems()
+        index = {x: i for i, x in enumerate(items)}
+        states = [x.getState() for x in items]
+
+        if center is None:
+            center = float(np.median(states[index[source]]["wl"]))
+        kwargs.setdefault("threshold", self.intensityThreshold)
+        return dispersion(states, index[source], *self.getPlane(plane, states, index), center, **kwargs)
+
+    def applyChanges(self, changes):
+        ### (element, values) pairs set together, undone in one step
+        with self.batchUpdate():
+            for element, values in changes:
+                old = element.getState()
+                if element.elementId is not None:
+                    self.addHistory(UndoRedoItem(UndoRedoType.elementParamChanged, element.elementId, {k: old[k] for k in values}, values))
+                self.applyState(element, values)
+
+        self.journal.seal()
+
+    def getExportRect(self):
+        ### all optical elements plus a margin of 20 %
+        br = QtCore.QRectF()
+
+        for itm in self.items():
+            if isinstance(itm, OpticalElement):
+                br = br.united(itm.sceneBoundingRect())
+
+        m = br.width()*0.2
+
+        return br.marginsAdded(QtCore.QMarginsF(m,m,m,m))
+
+    def renderTo(self, device):
+        painter = QtGui.QPainter(device)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+
+        self.render(painter, source=self.getExportRect())
+        painter.end()
+
+    def printTo(self, printer):
+        printer.setPageSize(QtGui.QPagedPaintDevice.A4)
+        printer.setResolution(100)
+        printer.setPageOrientation(QtGui.QPageLayout.Orientation.Landscape)
+
+        self.renderTo(printer)
+
+    def exportPDF(self, fileName):
+        self.printTo(QtGui.QPdfWriter(fileName))
+
+    def exportSVG(self, fileName):
+        br = self.getExportRect()
+
+        gen = QtSvg.QSvgGenerator()
+        gen.setFileName(fileName)
+        gen.setSize(QtCore.QSizeF(br.width(), br.height()).toSize())
+        gen.setViewBox(QtCore.QRectF(0, 0, br.width(), br.height()).toRect())
+
+        self.renderTo(gen)
+
+    def exportPNG(self, fileName, scale = 1.0):
+        br = self.getExportRect()
+
+        img = QtGui.QImage((QtCore.QSizeF(br.width(), br.height())*scale).toSize(), QtGui.QImage.Format.Format_ARGB32)
+        img.fill(QtCore.Qt.GlobalColor.white)
+
+        self.renderTo(img)
+        img.save(fileName)
+
+    def getRayData(self):
+        ### all traced segments as flat arrays, start / end in scene coordinates
+        tree = self.rayTree
+        n = len(tree)
+
+        start = np.zeros((n, 2))
+        end = np.zeros((n, 2))
+        for i, ray in enumerate(tree.items):
+            p1 = ray.mapToScene(ray.line().p1())
+            p2 = ray.mapToScene(ray.line().p2())
+            start[i] = (p1.x(), p1.y())
+            end[i] = (p2.x(), p2.y())
+
+        ### hit elements by their scene id, -1 if the segment leaves the scene
+        ids = np.array([-1 if x.elementId is None else x.elementId for x in tree.elements] + [-1], dtype=np.int64)
+
+        return {
+            "parent": tree.parent[:n].copy(),
+            "root": tree.root[:n].copy(),
+            "depth": tree.depth[:n].copy(),
+            "hit": ids[tree.hitElement[:n]],
+            "start": start,
+            "end": end,
+            "intensity": np.array([x.intensity for x in tree.items]),
+            "wl": np.array([x.wl[0] for x in tree.items]),
+            "power": tree.power[:n].copy(),
+        }
+
+    def saveRayData(self, fileName):
+        np.savez(fileName, **self.getRayData())
+
+    def getStates(self):
+        data = []
+        for itm in self.items():
+            if isinstance(itm, RayElement):
+                # only save parent rays
+                if itm.parent is None:
                     data.append(itm.getState())
+            elif isinstance(itm, (OpticalElement, BeamElement)):
+                data.append(itm.getState())
+
+        return data
 
+    def saveToFile(self, filename):
+        data = self.getStates()
+
+        if filename.endswith(".scb"):
+            saveBinaryScene(filename, data)
+            return
+
+        with open(filename, 'w') as writer:
             json.dump(data, writer, indent=2)
 
     def clearScene(self):
         # self.clear()
-        self.history.clear()
+        self.journal.clear()
+        self.elementsById.clear()
+
+        self.removeRays(self.rayTree.clear())
+        self.rayPool = []
 
         for itm in self.items():
             self.removeItem(itm)
 
+        if self.autoSave is not None:
+            self.autoSave.snapshot()
+
+    def getElementClass(self, typeName):
+        ### only element classes may be created from a file
+        x = globals().get(typeName)
+        if not (isinstance(x, type) and issubclass(x, (RayElement, OpticalElement, BeamElement))):
+            raise NameError(f"Element type {typeName} not found")
+        return x
+
     def createElementFromState(self, state) -> QGraphicsObject:
-        x=globals()[state["type"]]
+        x=self.getElementClass(state["type"])
         z=x()
         z.setState(state)
         return z
                 
     def loadFromFile(self, filename):
 
-        self.clearScene()
+        if isBinaryScene(filename):
+            ### elements are decoded one by one from the mapped file
+            data = iterBinaryScene(filename)
+        else:
+            with open(filename, 'r') as reader:
+                data = json.load(reader)
+                # print(data)
 
-        with open(filename, 'r') as reader:
-            data = json.load(reader)
-            # print(data)
+        self.loadStates(data)
 
+    def loadStates(self, data):
+        self.clearScene()
+
+        ### one trace for the whole file instead of one per element
+        with self.batchUpdate():
             for itm in data:
                 # try:
+                itm = dict(itm)
+                elementId = itm.pop("id", None)
                 el = self.createElementFromState(itm)
-                self.addElement(el, snap = False)
+                el.elementId = elementId
+                self.addElement(el, snap = False, addHistory = False)
                 # except Exception as ex:
                 #     print("Error parsing: ", itm, ex)
                 #     pass
             
             # self.drawScene(elements)
             self.calculateScene()
+
+        ### the log starts again from the loaded scene
+        if self.autoSave is not None:
+            self.autoSave.snapshot()
@@ -0,0 +1,296 @@
+# TraceServer.py
+# Local trace service: scene documents are queued and traced by warm worker processes, results are streamed back
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from batch import initWorker
+
+### state of a worker process, kept between jobs so similar scenes are only retraced where they changed
+workerScene = None
+workerElements = []
+workerStates = []
+
+def isApplied(scene, element, state):
+    ### compared with an element created from the state, which has its defaults filled in the same way
+    state = {k: v for k, v in state.items() if k != "id"}
+    return element.getState() == scene.createElementFromState(state).getState()
+
+def traceStates(states, rayData = True):
+    global workerScene, workerElements, workerStates
+
+    from PyQt5.QtWidgets import QGraphicsScene
+    from TraceScene import TraceScene
+
+    initWorker()
+    t = time.time()
+
+    if workerScene is None:
+        workerScene = TraceScene()
+        workerScene.setItemIndexMethod(QGraphicsScene.NoIndex)
+        workerScene.rejectOverlaps = False
+
+    scene = workerScene
+
+    ### same elements as the last job: only the changed ones are set, the rest of the trace is kept
+    reused = len(states) == len(workerStates) and all(a["type"] == b["type"] for a, b in zip(states, workerStates))
+
+    try:
+        if reused:
+            with scene.batchUpdate():
+                for element, old, new in zip(workerElements, workerStates, states):
+                    if old != new:
+                        scene.applyState(element, new)
+
+            ### an element that did not take its state (e.g. a refused value) would trace a different scene
+            reused = all(isApplied(scene, x, new) for x, old, new in zip(workerElements, workerStates, states) if old != new)
+
+        if not reused:
+            scene.loadStates(states)
+            workerElements = list(scene.elementsById.values())
+
+        workerStates = states
+    except Exception:
+        ### the scene is in an unknown state, the next job loads it again
+        workerStates = []
+        workerElements = []
+        raise
+
+    result = {
+        "segments": len(scene.rayTree),
+        "power": [scene.getElementPower(x) for x in workerElements],
+        "reused": reused,
+        "time": time.time() - t,
+    }
+
+    if rayData:
+        result["rays"] = {k: v.tolist() for k, v in scene.getRayData().items()}
+
+    return result
+
+class Job:
+    def __init__(self, jobId, states, rayData, session):
+        self.id = jobId
+        self.states = states
+        self.rayData = rayData
+        self.session = session
+
+        self.status = "queued"
+        self.result = None
+        self.error = None
+
+        self.listeners : list[asyncio.Queue] = []
+
+    def getEvent(self, **extra):
+        event = {"job": self.id, "status": self.status}
+        if self.result is not None:
+            event["result"] = self.result
+        if self.error is not None:
+            event["error"] = self.error
+        event.update(extra)
+        return event
+
+    def setStatus(self, status, **extra):
+        self.status = status
+        event = self.getEvent(**extra)
+        for listener in self.listeners:
+            listener.put_nowait(event)
+
+    def isFinished(self):
+        return self.status in ("done", "failed")
+
+class TraceServer:
+    def __init__(self, workers = None, keepJobs = 1000):
+        self.workerCount = workers or os.cpu_count()
+        self.keepJobs = keepJobs
+
+        self.jobs = OrderedDict()
+        self.jobIds = itertools.count(1)
+
+        ### one single process executor per worker, jobs of one session always go to the same worker
+        self.queues = []
+        self.executors = []
+
+    def createExecutor(self):
+        return ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"), initializer=initWorker)
+
+    async def start(self, host = "127.0.0.1", port = 8765, socketPath = None):
+        for i in range(self.workerCount):
+            self.executors.append(self.createExecutor())
+            self.queues.append(asyncio.Queue())
+            asyncio.create_task(self.dispatch(i))
+
+        if socketPath is not None:
+            return await asyncio.start_unix_server(self.handle, path=socketPath)
+        return await asyncio.start_server(self.handle, host, port)
+
+    def createJob(self, states, rayData = True, session = None):
+        job = Job(next(self.jobIds), states, rayData, session)
+
+        ### finished jobs are kept for a while to be fetched by id
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.keepJobs:
+            oldest = next(iter(self.jobs.values()))
+            if not oldest.isFinished():
+                break
+            self.jobs.popitem(last=False)
+
+        return job
+
+    def submit(self, states, rayData = True, session = None):
+        job = self.createJob(states, rayData, session)
+        self.enqueue(job)
+        return job
+
+    def enqueue(self, job):
+        if job.session is not None:
+            ### a digest instead of hash(), which changes from process to process for strings
+            digest = hashlib.sha1(json.dumps(job.session).encode("utf-8")).digest()
+            queue = self.queues[int.from_bytes(digest[:8], "little") % len(self.queues)]
+        else:
+            queue = min(self.queues, key=lambda x: x.qsize())
+
+        queue.put_nowait(job)
+        job.setStatus("queued", position=queue.qsize())
+
+    async def dispatch(self, worker):
+        loop = asyncio.get_running_loop()
+        queue = self.queues[worker]
+
+        while True:
+            job = await queue.get()
+            job.setStatus("running")
+
+            try:
+                job.result = await loop.run_in_executor(self.executors[worker], traceStates, job.states, job.rayData)
+                job.states = None
+                job.setStatus("done")
+            except BrokenProcessPool as ex:
+                ### the worker process died (crash, out of memory), only the running job fails, the queued ones go to a
+                ### fresh worker which starts with an empty scene
+                self.executors[worker].shutdown(wait=False)
+                self.executors[worker] = self.createExecutor()
+                job.error = f"{type(ex).__name__}: {ex}"
+                job.setStatus("failed")
+            except Exception as ex:
+                job.error = f"{type(ex).__name__}: {ex}"
+                job.setStatus("failed")
+
+    def getStatus(self):
+        return {
+            "workers": self.workerCount,
+            "queued": sum(x.qsize() for x in self.queues),
+            "jobs": len(self.jobs),
+        }
+
+    def parseRequest(self, body):
+        ### a single scene (the .scn list of states) or {"scenes": [...], "rays": bool, "session": str}
+        data = json.loads(body)
+        if isinstance(data, list):
+            return [data], True, None
+
+        return data["scenes"], data.get("rays", True), data.get("session")
+
+    async def handle(self, reader, writer):
+        try:
+            requestLine = (await reader.readline()).decode("latin-1").split()
+            if len(requestLine) < 2:
+                return
+            method, path = requestLine[0], requestLine[1]
+
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                k, _, v = line.partition(":")
+                headers[k.strip().lower()] = v.strip()
+
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            if method == "POST" and path == "/trace":
+                await self.streamJobs(writer, *self.parseRequest(body))
+            elif method == "POST" and path == "/jobs":
+                scenes, rayData, session = self.parseRequest(body)
+                jobs = [self.submit(x, rayData, session) for x in scenes]
+                await self.respond(writer, 200, {"jobs": [x.id for x in jobs]})
+            elif method == "GET" and path.startswith("/jobs/"):
+                job = self.jobs.get(int(path[len("/jobs/"):]))
+                if job is None:
+                    await self.respond(writer, 404, {"error": "unknown job"})
+                else:
+                    await self.respond(writer, 200, job.getEvent())
+            elif method == "GET" and path == "/status":
+                await self.respond(writer, 200, self.getStatus())
+            else:
+                await self.respond(writer, 404, {"error": f"{method} {path} not found"})
+
+        except (ValueError, KeyError) as ex:
+            await self.respond(writer, 400, {"error": f"{type(ex).__name__}: {ex}"})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, code, data):
+        body = json.dumps(data).encode("utf-8")
+        writer.write(f"HTTP/1.1 {code} {'OK' if code == 200 else 'Error'}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1"))
+        writer.write(body)
+        await writer.drain()
+
+    async def streamJobs(self, writer, scenes, rayData, session):
+        ### one json line per event (queued, running, done / failed) until every job finished
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n")
+
+        events = asyncio.Queue()
+        jobs = []
+
+        ### the listener is attached before a job is queued so no event is missed
+        for states in scenes:
+            job = self.createJob(states, rayData, session)
+            job.listeners.append(events)
+            jobs.append(job)
+            self.enqueue(job)
+
+        pending = len(jobs)
+        try:
+            while pending > 0:
+                event = await events.get()
+                writer.write(json.dumps(event).encode("utf-8") + b"\n")
+                await writer.drain()
+
+                if event["status"] in ("done", "failed"):
+                    pending -= 1
+        finally:
+            for job in jobs:
+                job.listeners.remove(events)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Local trace service for scene documents")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", default=None, help="listen on a unix socket instead of tcp")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    async def run():
+        server = TraceServer(args.workers)
+        srv = await server.start(args.host, args.port, args.socket)
+        async with srv:
+            await srv.serve_forever()
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,122 @@
+import json
+import time
 
 class UndoRedoType:
     elementAdded = 1
     elementDeleted = 2
     elementParamChanged = 3
-    
+    batch = 4   # before holds the list of items recorded in one bulk update
+
 class UndoRedoItem:
-    def __init__(self, element, type : UndoRedoType, param = None, value = None):
-        self.element = element
+    ### elements are referenced by their scene id, the item only keeps parameter values:
+    ### added -> after is the full state, deleted -> before is the full state,
+    ### param changed -> before / after map the changed keys to their values
+    def __init__(self, type : UndoRedoType, elementId = None, before = None, after = None):
         self.type = type
-        self.param = param
-        self.value = value
-        
-    def getParam(self):
-        return self.param
-    
-    def getValue(self):
-        return self.value
-    
+        self.elementId = elementId
+        self.before = before
+        self.after = after
+
+        self.sealed = False
+        self.time = time.monotonic()
+        self.size = self.estimateSize()
+
+    def estimateSize(self):
+        if self.type == UndoRedoType.batch:
+            return sum(x.size for x in self.before)
+
+        return len(json.dumps([self.before, self.after], default=str)) + 64
+
     def getType(self) -> UndoRedoType:
         return self.type
-    
-    def getElement(self):
-        return self.element
-    
\ No newline at end of file
+
+    def getElementId(self):
+        return self.elementId
+
+    def getBefore(self):
+        return self.before
+
+    def getAfter(self):
+        return self.after
+
+    def canMerge(self, item):
+        ### continuous changes of the same parameters of one element end up in one entry
+        return not self.sealed and self.type == UndoRedoType.elementParamChanged and item.type == self.type \
+            and item.elementId == self.elementId and item.before.keys() == self.before.keys()
+
+    def merge(self, item):
+        self.after = item.after
+        self.time = item.time
+        self.size = self.estimateSize()
+
+class UndoRedoJournal:
+    def __init__(self, maxEntries = 1000, maxBytes = 4*1024*1024, mergeInterval = 1.0):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.mergeInterval = mergeInterval
+
+        self.undoItems : list[UndoRedoItem] = []
+        self.redoItems : list[UndoRedoItem] = []
+        self.bytes = 0
+
+        ### recording is paused while undo / redo apply their changes
+        self.paused = 0
+
+    def __len__(self):
+        return len(self.undoItems)
+
+    def isPaused(self):
+        return self.paused > 0
+
+    def record(self, item : UndoRedoItem):
+        if self.paused:
+            return
+
+        self.redoItems.clear()
+
+        if len(self.undoItems) > 0:
+            last = self.undoItems[-1]
+            if item.time - last.time <= self.mergeInterval and last.canMerge(item):
+                self.bytes -= last.size
+                last.merge(item)
+                self.bytes += last.size
+                return
+            last.sealed = True
+
+        self.undoItems.append(item)
+        self.bytes += item.size
+        self.trim()
+
+    def seal(self):
+        if len(self.undoItems) > 0:
+            self.undoItems[-1].sealed = True
+
+    def trim(self):
+        ### drop the oldest entries until both limits hold, the newest entry is always kept
+        while len(self.undoItems) > 1 and (len(self.undoItems) > self.maxEntries or self.bytes > self.maxBytes):
+            self.bytes -= self.undoItems.pop(0).size
+
+    def popUndo(self):
+        if len(self.undoItems) < 1:
+            return None
+
+        item = self.undoItems.pop()
+        item.sealed = True
+        self.bytes -= item.size
+        self.redoItems.append(item)
+        return item
+
+    def popRedo(self):
+        if len(self.redoItems) < 1:
+            return None
+
+        item = self.redoItems.pop()
+        self.undoItems.append(item)
+        self.bytes += item.size
+        self.trim()
+        return item
+
+    def clear(self):
+        self.undoItems.clear()
+        self.redoItems.clear()
+        self.bytes = 0
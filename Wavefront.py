@@ -0,0 +1,113 @@
+# Wavefront.py
+# Optical path differences of the rays of a source where they cross a plane, from the optical path length of the trace
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import numpy as np
+
+from TraceEngine import TraceGeometry, iterTrace, dot, INTENSITY_THRESHOLD, MAX_DEPTH, RAY_LENGTH
+
+class Wavefront:
+    ### crossings of the rays of a source with a plane (point, normal), rays travelling along the normal only:
+    ### position across the plane, optical path length from the source, wavelength, intensity and the trace row
+    def __init__(self, point, normal, position, opl, wl, intensity, rows):
+        self.point = point
+        self.normal = normal
+        self.position = position
+        self.opl = opl
+        self.wl = wl
+        self.intensity = intensity
+        self.rows = rows
+
+        self.wavelengths, self.index = np.unique(wl, return_inverse=True)
+
+    def __len__(self):
+        return len(self.opl)
+
+    def getOpd(self, removeTilt = False):
+        ### optical path difference of every crossing to the intensity weighted mean of its wavelength (piston),
+        ### with removeTilt also to the weighted linear fit over the position (a tilted plane)
+        W = len(self.wavelengths)
+        k = self.index
+        w = self.intensity
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            total = np.bincount(k, w, minlength=W)
+            meanOpl = np.bincount(k, w*self.opl, minlength=W) / total
+            opd = self.opl - meanOpl[k]
+
+            if removeTilt:
+                meanPos = np.bincount(k, w*self.position, minlength=W) / total
+                x = self.position - meanPos[k]
+                slope = np.bincount(k, w*x*opd, minlength=W) / np.bincount(k, w*x**2, minlength=W)
+                opd = opd - np.nan_to_num(slope)[k]*x
+
+        return opd
+
+    def getRms(self, removeTilt = False):
+        ### (W,) intensity weighted rms wavefront error per wavelength, in scene units
+        opd = self.getOpd(removeTilt)
+        W = len(self.wavelengths)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.sqrt(np.bincount(self.index, self.intensity*opd**2, minlength=W) / np.bincount(self.index, self.intensity, minlength=W))
+
+    def getPeakToValley(self, removeTilt = False):
+        opd = self.getOpd(removeTilt)
+        W = len(self.wavelengths)
+        lo = np.full(W, np.inf)
+        hi = np.full(W, -np.inf)
+        np.minimum.at(lo, self.index, opd)
+        np.maximum.at(hi, self.index, opd)
+        return hi - lo
+
+    def getProfile(self, wl, removeTilt = False):
+        ### (position, opd) of one wavelength sorted by position
+        rows = np.flatnonzero(np.isclose(self.wl, wl))
+        rows = rows[np.argsort(self.position[rows])]
+        return self.position[rows], self.getOpd(removeTilt)[rows]
+
+def getCrossings(segments, source, point, normal, variant = 0):
+    ### rows of a generation crossing the plane and the distance from their start to it
+    d = segments["direction"]
+    along = dot(d, normal)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = dot(point - segments["start"], normal) / along
+
+    ### the 1 unit gap behind a hit belongs to the segment
+    gap = np.where(segments["depth"] > 0, 1.0, 0.0)
+    mask = (segments["source"] == source) & (segments["variant"] == variant) & (along > 0) & (t >= -gap) & (t <= segments["length"])
+    rows = np.flatnonzero(mask)
+    return rows, t[rows]
+
+def wavefront(states, source, point, normal, overrides = None, variant = 0, threshold = INTENSITY_THRESHOLD, maxDepth = MAX_DEPTH,
+    rayLength = RAY_LENGTH):
+    ### Wavefront of source (state index) at the plane through point with normal, the crossings are collected generation by
+    ### generation, source rays crossing before their first hit count for each of their wavelengths
+    geometry = TraceGeometry(states, overrides)
+    point = np.asarray(point, dtype=float)
+    normal = np.asarray(normal, dtype=float)
+    normal = normal / np.sqrt(dot(normal, normal))
+    tangent = np.array([-normal[1], normal[0]])
+
+    spectrum = np.broadcast_to(geometry.sourcesByIndex[source].wl, (geometry.variants, geometry.sourcesByIndex[source].wl.shape[1]))[variant]
+
+    parts = []
+    offset = 0
+    for segments in iterTrace(geometry, threshold, maxDepth, rayLength):
+        rows, t = getCrossings(segments, source, point, normal, variant)
+
+        hit = segments["start"][rows] + t[:, None]*segments["direction"][rows]
+        opl = segments["opl"][rows] - segments["n"][rows]*(segments["length"][rows] - t)
+        wl = segments["wl"][rows]
+        intensity = segments["intensity"][rows]
+
+        if len(rows) > 0 and segments["depth"][0] == 0:
+            W = len(spectrum)
+            rows, hit, opl, intensity = np.repeat(rows, W), np.repeat(hit, W, axis=0), np.repeat(opl, W), np.repeat(intensity, W)
+            wl = np.tile(spectrum, len(rows) // W)
+
+        parts.append((dot(hit - point, tangent), opl, wl, intensity, rows + offset))
+        offset += len(segments["variant"])
+
+    columns = [np.concatenate([x[k] for x in parts]) if len(parts) > 0 else np.zeros(0) for k in range(5)]
+    return Wavefront(point, normal, *columns)
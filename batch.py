@@ -0,0 +1,118 @@
+# batch.py
+# Headless tracing and export of scene files from the command line
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import argparse
+import os
+import sys
+import time
+import multiprocessing
+
+### no window system needed, must be set before the QApplication is created
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtWidgets import QApplication, QGraphicsScene
+
+FORMATS = ["svg", "pdf", "png"]
+TRACE_FORMATS = ["npz", "arrow", "parquet"]
+
+app = None
+
+def initWorker():
+    ### one QApplication per process, workers keep it for all files they get
+    global app
+    app = QApplication.instance()
+    if app is None:
+        app = QApplication([])
+
+def processFile(fileName, outputDir = None, formats = ("svg",), rayData = False, scale = 1.0, traceFormat = None):
+    from TraceScene import TraceScene
+
+    initWorker()
+
+    t = time.time()
+
+    ### a fresh scene per file, the plain item list gives the same results as the GUI without its index
+    scene = TraceScene()
+    scene.setItemIndexMethod(QGraphicsScene.NoIndex)
+    scene.loadFromFile(fileName)
+
+    if outputDir is None:
+        outputDir = os.path.dirname(fileName)
+    base = os.path.join(outputDir, os.path.splitext(os.path.basename(fileName))[0])
+
+    outputs = []
+    for fmt in formats:
+        outName = f"{base}.{fmt}"
+        if fmt == "svg":
+            scene.exportSVG(outName)
+        elif fmt == "pdf":
+            scene.exportPDF(outName)
+        elif fmt == "png":
+            scene.exportPNG(outName, scale)
+        outputs.append(outName)
+
+    if rayData:
+        outName = base + ".rays.npz"
+        scene.saveRayData(outName)
+        outputs.append(outName)
+
+    if traceFormat is not None:
+        outName = f"{base}.trace.{traceFormat}"
+        scene.exportTrace(outName)
+        outputs.append(outName)
+
+    return fileName, outputs, len(scene.rayTree), time.time() - t
+
+def _processFile(args):
+    ### pool entry point, errors are reported per file instead of stopping the whole run
+    try:
+        return processFile(*args), None
+    except Exception as ex:
+        return (args[0], [], 0, 0.0), f"{type(ex).__name__}: {ex}"
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Trace scene files without the GUI and export drawings and ray data")
+    parser.add_argument("files", nargs="+", help="scene files (.scn / .scb)")
+    parser.add_argument("-o", "--output-dir", default=None, help="directory for the outputs, default is next to each scene file")
+    parser.add_argument("-f", "--format", action="append", choices=FORMATS, help="drawing format, can be given more than once (default svg)")
+    parser.add_argument("-r", "--rays", action="store_true", help="also write the traced segments as <name>.rays.npz")
+    parser.add_argument("-t", "--trace", choices=TRACE_FORMATS, default=None, help="also write all segments of the vectorized trace as <name>.trace.<format>")
+    parser.add_argument("-s", "--scale", type=float, default=1.0, help="pixels per scene unit for png output")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    formats = args.format or ["svg"]
+
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    tasks = [(x, args.output_dir, formats, args.rays, args.scale, args.trace) for x in args.files]
+    jobs = max(1, min(args.jobs or 1, len(tasks)))
+
+    if jobs == 1:
+        initWorker()
+        results = map(_processFile, tasks)
+        pool = None
+    else:
+        ### spawn, Qt does not survive being forked
+        pool = multiprocessing.get_context("spawn").Pool(jobs, initializer=initWorker)
+        results = pool.imap_unordered(_processFile, tasks)
+
+    failed = 0
+    for (fileName, outputs, segments, dt), error in results:
+        if error is not None:
+            failed += 1
+            print(f"{fileName}: failed, {error}", file=sys.stderr)
+        else:
+            print(f"{fileName}: {segments} segments, {dt:.2f} s -> {', '.join(outputs)}")
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    return 1 if failed > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
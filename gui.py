@@ -5,9 +5,9 @@
 
 from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QHBoxLayout, \
         QSpinBox, QPushButton, QVBoxLayout, QLabel, QFileDialog, \
-        QDoubleSpinBox, QListWidget, QListWidgetItem
+        QDoubleSpinBox, QListWidget, QListWidgetItem, QMessageBox
 
-from PyQt5 import QtGui, QtCore, QtPrintSupport, QtSvg
+from PyQt5 import QtGui, QtCore, QtPrintSupport
 
 QApplication.setAttribute(QtCore.Qt.AA_EnableHighDpiScaling, True) #enable highdpi scaling
 QApplication.setAttribute(QtCore.Qt.AA_UseHighDpiPixmaps, True) #use highdpi icons
@@ -15,6 +15,12 @@ QApplication.setAttribute(QtCore.Qt.AA_UseHighDpiPixmaps, True) #use highdpi ico
 from TraceScene import *
 from MyGraphicsView import *
 from OpticalElement import *
+from AutoSave import hasAutoSave, claimAutoSave
+
+import os
+
+### unsaved changes are logged here, every window in a directory of its own, and recovered after a crash
+AUTOSAVE_DIR = os.path.join(os.path.expanduser("~"), ".OpticalTracer", "autosave")
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -37,6 +43,7 @@ class MainWindow(QMainWindow):
         editMenu = menuBar.addMenu("&Edit")
         
         editMenu.addAction("Undo",lambda: self.view.scene().undo(), QtGui.QKeySequence("CTRL+Z"))
+        editMenu.addAction("Redo",lambda: self.view.scene().redo(), QtGui.QKeySequence("CTRL+Y"))
         
         sceneMenu = menuBar.addMenu("&Scene")
         sceneMenu.addAction("&Fit", lambda: self.view.scaleToContent())
@@ -76,6 +83,10 @@ class MainWindow(QMainWindow):
         btn.clicked.connect(lambda x: self.view.scene().undo())
         vbox.addWidget(btn)
 
+        btn = QPushButton("redo")
+        btn.clicked.connect(lambda x: self.view.scene().redo())
+        vbox.addWidget(btn)
+
         iconSize = QtCore.QSize(48,48)
         lbox = QListWidget()
         lbox.setMinimumWidth(120)
@@ -86,6 +97,9 @@ class MainWindow(QMainWindow):
         itm = QListWidgetItem(QtGui.QIcon(RayElement(0,0,100,100).getPixmap()), "Ray")
         lbox.addItem(itm)
 
+        itm = QListWidgetItem(QtGui.QIcon(BeamElement().getPixmap()), "Beam")
+        lbox.addItem(itm)
+
         itm = QListWidgetItem(QtGui.QIcon(MirrorElement().getPixmap()), "Mirror")
         lbox.addItem(itm)
 
@@ -101,6 +115,9 @@ class MainWindow(QMainWindow):
         itm = QListWidgetItem(QtGui.QIcon(BeamBlockElement().getPixmap()), "Beamblock")
         lbox.addItem(itm)
 
+        itm = QListWidgetItem(QtGui.QIcon(DetectorElement().getPixmap()), "Detector")
+        lbox.addItem(itm)
+
         vbox.addWidget(lbox, 2)
 
         # vbox.addStretch(1)
@@ -108,6 +125,14 @@ class MainWindow(QMainWindow):
         hbox.addLayout(vbox, 0)
         hbox.addWidget(self.view, 2)
         self.setCentralWidget(w)
+
+        directory, lock = claimAutoSave(AUTOSAVE_DIR)
+        if hasAutoSave(directory):
+            ret = QMessageBox.question(self, "Recover", "The last session was not closed properly. Recover the unsaved scene?")
+            if ret == QMessageBox.StandardButton.Yes:
+                scene.recoverAutoSave(directory)
+
+        scene.setAutoSave(directory, lock=lock)
         # self.setMinimumSize(1000, 700)
 
         # aoi = 63.6
@@ -142,7 +167,7 @@ class MainWindow(QMainWindow):
     def writeFile(self, newFile = False):
 
         if self.openFileName is None or newFile:
-            fileName,_ = QFileDialog.getSaveFileName(self, "Save Scene", filter="Scene File (*.scn);;All Files (*.*)")
+            fileName,_ = QFileDialog.getSaveFileName(self, "Save Scene", filter="Scene File (*.scn);;Binary Scene File (*.scb);;All Files (*.*)")
         else:
             fileName = self.openFileName
 
@@ -157,7 +182,7 @@ class MainWindow(QMainWindow):
         self.setWindowTitle("")
 
     def loadFile(self):
-        fileName,_ = QFileDialog.getOpenFileName(self, "Open Scene", filter="Scene File (*.scn);;All Files (*.*)")
+        fileName,_ = QFileDialog.getOpenFileName(self, "Open Scene", filter="Scene File (*.scn);;Binary Scene File (*.scb);;All Files (*.*)")
         if fileName:
             self.view.scene().loadFromFile(fileName)
             self.view.scaleToContent()
@@ -168,76 +193,42 @@ class MainWindow(QMainWindow):
         # self.view.scene().reset()
         self.view.scene().calculateScene()
         
+    def closeEvent(self, a0: QtGui.QCloseEvent) -> None:
+        ### regular exit, nothing to recover next time
+        scene = self.view.scene()
+        if scene.autoSave is not None:
+            scene.autoSave.close(discard=True)
+
+        return super().closeEvent(a0)
+
     def showEvent(self, a0: QtGui.QShowEvent) -> None:
         self.view.scaleToContent()
 
         return super().showEvent(a0)
 
     def exportSVG(self, fileName):
-        gen = QtSvg.QSvgGenerator()
-        gen.setFileName(fileName)
-        # gen.setSize()
-
-        br = QtCore.QRectF()
-
-        for itm in self.view.scene().items():
-            if isinstance(itm, OpticalElement):
-                br = br.united(itm.sceneBoundingRect())
-
-        m = br.width()*0.2
-
-        br = br.marginsAdded(QtCore.QMarginsF(m,m,m,m))
-
-        gen.setSize(QtCore.QSizeF(br.width(), br.height()).toSize())
-        gen.setViewBox(QtCore.QRectF(0, 0, br.width(), br.height()).toRect())
-
-        painter = QtGui.QPainter(gen)
-
-        self.view.scene().render(painter, source = br)
-        painter.end()
+        self.view.scene().exportSVG(fileName)
 
     def printView(self, toFile = False):
         
         self.view.scene().clearSelection()
 
-        printer = None        
         if toFile:
 
-            fileName, _ = QFileDialog.getSaveFileName(self,"'Export","","PDF Files (*.pdf);;SVG Files (*.svg);;All Files (*.*)")
+            fileName, _ = QFileDialog.getSaveFileName(self,"'Export","","PDF Files (*.pdf);;SVG Files (*.svg);;PNG Files (*.png);;All Files (*.*)")
 
             if fileName:
                 if fileName.endswith(".pdf"):
-                    printer = QtGui.QPdfWriter(fileName)
+                    self.view.scene().exportPDF(fileName)
+                elif fileName.endswith(".png"):
+                    self.view.scene().exportPNG(fileName)
                 else:
                     self.exportSVG(fileName)
 
         else:
             dialog = QtPrintSupport.QPrintDialog()
             if dialog.exec_() == QtPrintSupport.QPrintDialog.Accepted:
-                printer = dialog.printer()
-                    
-        if printer is None:
-            return
-
-        printer.setPageSize(QtGui.QPagedPaintDevice.A4)
-        printer.setResolution(100)
-        printer.setPageOrientation(QtGui.QPageLayout.Orientation.Landscape)
-
-        painter = QtGui.QPainter(printer)
-        painter.setRenderHint(QtGui.QPainter.Antialiasing)
-
-        br = QtCore.QRectF()
-
-        for itm in self.view.scene().items():
-            if isinstance(itm, OpticalElement):
-                br = br.united(itm.sceneBoundingRect())
-
-        m = br.width()*0.2
-
-        br = br.marginsAdded(QtCore.QMarginsF(m,m,m,m))
-        
-        self.view.scene().render(painter, source=br)
-        painter.end()
+                self.view.scene().printTo(dialog.printer())
 
     def rotateItemsBy(self, d_angle):
         itms = self.view.scene().selectedItems()
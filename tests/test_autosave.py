@@ -0,0 +1,117 @@
+# test_autosave.py
+# Replay of the autosave snapshot and change log, and one autosave directory per instance
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import os
+import sys
+import json
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pytest
+
+from AutoSave import AutoSave, loadAutoSave, hasAutoSave, claimAutoSave, SNAPSHOT, LOG
+
+def lens(elementId, x):
+    return {"type": "LensElement", "id": elementId, "pos": [x, 0.0], "rot": 0.0, "mat": "BK7"}
+
+def test_replay(tmp_path):
+    directory = str(tmp_path)
+    states = [lens(1, 0.0), lens(2, 100.0)]
+
+    save = AutoSave(directory, lambda: states, interval=60)
+    save.snapshot()
+    save.append("set", 1, values={"pos": [10.0, 0.0]})
+    save.append("set", 1, values={"pos": [20.0, 0.0]})
+    save.append("add", 3, state=lens(3, 200.0))
+    save.append("del", 2)
+    save.append("set", 2, values={"pos": [0.0, 0.0]})    # deleted element, ignored
+    save.close()
+
+    assert hasAutoSave(directory)
+    assert loadAutoSave(directory) == [lens(1, 20.0), lens(3, 200.0)]
+
+    ### consecutive moves of one element are written as one entry
+    with open(os.path.join(directory, LOG)) as reader:
+        assert len(reader.readlines()) == 4
+
+    ### a regular exit leaves nothing behind
+    AutoSave(directory, lambda: states).close(discard=True)
+    assert not os.path.exists(directory)
+
+def test_cut_off_last_line(tmp_path):
+    directory = str(tmp_path)
+    save = AutoSave(directory, lambda: [lens(1, 0.0)], interval=60)
+    save.snapshot()
+    save.append("set", 1, values={"pos": [10.0, 0.0]})
+    save.append("set", 1, values={"rot": 45.0})
+    save.close()
+
+    ### a crash in the middle of the last write
+    path = os.path.join(directory, LOG)
+    with open(path) as reader:
+        text = reader.read()
+    with open(path, "w") as writer:
+        writer.write(text[:-10])
+
+    assert loadAutoSave(directory) == [lens(1, 10.0)]
+
+def test_snapshot_replaces_log(tmp_path):
+    directory = str(tmp_path)
+    states = [lens(1, 0.0)]
+    save = AutoSave(directory, lambda: states, interval=60, compactEntries=3)
+    save.snapshot()
+
+    for k in range(3):
+        states = [lens(1, float(k))]
+        save.append("set", 1, values={"pos": [float(k), 0.0]})
+        save.append("set", 1, values={"rot": float(k)})
+    save.close()
+
+    assert loadAutoSave(directory)[0]["pos"] == [2.0, 0.0]
+    assert os.path.exists(os.path.join(directory, SNAPSHOT))
+
+def test_one_directory_per_instance(tmp_path):
+    base = str(tmp_path)
+    first, firstLock = claimAutoSave(base)
+    second, secondLock = claimAutoSave(base)
+    assert first != second
+
+    save = AutoSave(first, lambda: [lens(1, 0.0)], lock=firstLock)
+    with pytest.raises(RuntimeError):
+        AutoSave(first, lambda: [])
+
+    ### a regular exit of one instance leaves the data of the other alone
+    other = AutoSave(second, lambda: [lens(2, 0.0)], lock=secondLock)
+    other.snapshot()
+    other.close()
+    save.close(discard=True)
+    assert not os.path.exists(first)
+    assert loadAutoSave(second) == [lens(2, 0.0)]
+
+def test_crashed_instance_is_recovered(tmp_path):
+    base = str(tmp_path)
+    script = "\n".join([
+        "import os, sys",
+        f"sys.path.insert(0, {os.path.join(os.path.dirname(__file__), '..')!r})",
+        "from AutoSave import AutoSave, claimAutoSave",
+        f"directory, lock = claimAutoSave({base!r})",
+        f"save = AutoSave(directory, lambda: [{lens(7, 5.0)!r}], lock=lock)",
+        "save.snapshot()",
+        "save.close()",
+        "os._exit(1)",
+    ])
+    subprocess.run([sys.executable, "-c", script], check=False)
+
+    ### the next instance takes over the directory left behind
+    directory, lock = claimAutoSave(base)
+    assert loadAutoSave(directory) == [lens(7, 5.0)]
+
+    ### and nobody else gets it while it is held
+    other, otherLock = claimAutoSave(base)
+    assert other != directory and not hasAutoSave(other)
+
+    lock.close()
+    otherLock.close()
@@ -0,0 +1,91 @@
+# test_element_index.py
+# The segment index by hit and emitting element stays exact while the scene is retraced incrementally
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import os
+import sys
+import random
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from PyQt5.QtWidgets import QApplication, QGraphicsScene
+from PyQt5 import QtCore, QtGui
+
+app = QApplication.instance() or QApplication([])
+
+from TraceScene import TraceScene
+import pytest
+
+from OpticalElement import RayElement, OpticalElement
+
+SAMPLES = ["lenses.scn", "prism.scn", "trans_grating_1739.scn"]
+
+def loadScene(name):
+    scene = TraceScene()
+    scene.setItemIndexMethod(QGraphicsScene.NoIndex)
+    scene.traceCache = None
+    scene.loadFromFile(os.path.join(os.path.dirname(__file__), "..", "samples", name))
+    return scene
+
+def getSegment(ray):
+    p1 = ray.mapToScene(ray.line().p1())
+    p2 = ray.mapToScene(ray.line().p2())
+    return (round(p1.x(), 2), round(p1.y(), 2), round(p2.x(), 1), round(p2.y(), 1), round(ray.intensity, 4))
+
+def getElements(scene):
+    return [x for x in scene.items() if isinstance(x, OpticalElement)]
+
+def getIndex(scene):
+    ### segments of every element by their geometry, tree positions differ from trace to trace
+    return [sorted(getSegment(x) for x in scene.getElementRays(e)) for e in getElements(scene)]
+
+def getOutline(element):
+    ### the border of the element with a little tolerance, in scene coordinates
+    stroker = QtGui.QPainterPathStroker()
+    stroker.setWidth(2)
+    return element.mapToScene(stroker.createStroke(element.shape()))
+
+@pytest.mark.parametrize("name", SAMPLES)
+def test_index_matches_geometry(name):
+    scene = loadScene(name)
+    tree = scene.rayTree
+    hitAny = set()
+
+    for element in getElements(scene):
+        outline = getOutline(element)
+        incoming = tree.getIncoming(element).tolist()
+        hitAny.update(incoming)
+
+        ### segments ending on the element, and the segments behind them are emitted by it
+        for i in incoming:
+            ray = tree.getItem(i)
+            assert outline.contains(ray.mapToScene(ray.line().p2()))
+            assert all(x in tree.getOutgoing(element) for x in tree.getChildren(i))
+
+        assert scene.getElementPower(element) == pytest.approx(tree.power[incoming].sum())
+        assert set(scene.getElementSources(element)) == {tree.getItem(tree.getRoot(x.treeIndex)) for x in scene.getElementRays(element)}
+
+    ### nothing else ends on an element
+    for i, ray in enumerate(tree.items):
+        if i not in hitAny:
+            assert not any(getOutline(x).contains(ray.mapToScene(ray.line().p2())) for x in getElements(scene))
+
+@pytest.mark.parametrize("name", SAMPLES)
+def test_incremental_equals_full(name):
+    scene = loadScene(name)
+    rng = random.Random(1)
+    elements = getElements(scene) + [x for x in scene.rayTree.items if x.parent is None]
+
+    for k in range(20):
+        element = rng.choice(elements)
+        if rng.random() < 0.5:
+            element.setPos(element.pos() + QtCore.QPointF(rng.randint(-3, 3)*25, rng.randint(-3, 3)*25))
+        else:
+            element.setRotation(element.rotation() + rng.choice([-5, -2, 2, 5]))
+
+        segments, index = sorted(getSegment(x) for x in scene.rayTree.items), getIndex(scene)
+        scene.calculateScene()
+        assert segments == sorted(getSegment(x) for x in scene.rayTree.items)
+        assert index == getIndex(scene)
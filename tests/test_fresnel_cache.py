@@ -0,0 +1,54 @@
+# test_fresnel_cache.py
+# Pooled and cache restored segments keep the Fresnel state of their source
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import os
+import sys
+import json
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from PyQt5.QtWidgets import QApplication
+
+app = QApplication.instance() or QApplication([])
+
+from TraceScene import TraceScene
+import pytest
+
+from OpticalElement import RayElement, PrismElement, BeamBlockElement
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "..", "samples", "prism.scn")
+
+def getSegments(scene):
+    return sorted((round(x.mapToScene(x.line().p1()).x(), 3), round(x.mapToScene(x.line().p1()).y(), 3),
+        round(x.intensity, 6)) for x in scene.rayTree.items)
+
+def getSource(scene):
+    return [x for x in scene.rayTree.items if isinstance(x, RayElement) and x.parent is None][0]
+
+@pytest.mark.parametrize("element", range(5))
+@pytest.mark.parametrize("delta", [1.0, -1.0])
+def test_toggle_then_move(element, delta):
+    scene = TraceScene()
+    scene.intensityThreshold = 0.01
+    scene.loadStates(json.load(open(SAMPLE)))
+
+    ### s, p and s again (restored from the trace cache), then move a prism or the beam block so only the part of the tree
+    ### behind it is traced again
+    source = getSource(scene)
+    for mode in ("s", "p", "s"):
+        scene.applyChanges([(source, {"fresnel": mode})])
+    assert scene.traceCache.hits == 1
+
+    elements = sorted([x for x in scene.items() if isinstance(x, (PrismElement, BeamBlockElement))], key=lambda x: x.pos().x())
+    moved = elements[element]
+    scene.applyChanges([(moved, {"rot": moved.rotation() + delta})])
+
+    fresh = TraceScene()
+    fresh.intensityThreshold = 0.01
+    fresh.traceCache = None
+    fresh.loadStates([x.getState() for x in scene.getTraceItems()])
+
+    assert getSegments(scene) == getSegments(fresh)
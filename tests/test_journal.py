@@ -0,0 +1,86 @@
+# test_journal.py
+# Merging, sealing and trimming of the undo / redo journal
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from UndoRedo import UndoRedoItem, UndoRedoType, UndoRedoJournal
+
+def move(elementId, before, after, t = 0.0, key = "pos"):
+    item = UndoRedoItem(UndoRedoType.elementParamChanged, elementId, {key: before}, {key: after})
+    item.time = t
+    return item
+
+def test_continuous_changes_are_merged():
+    journal = UndoRedoJournal(mergeInterval=1.0)
+    for k in range(10):
+        journal.record(move(1, k, k+1, t=0.1*k))
+
+    assert len(journal) == 1
+    item = journal.undoItems[0]
+    assert item.before == {"pos": 0} and item.after == {"pos": 10}
+    assert journal.bytes == item.size
+
+def test_merge_stops():
+    journal = UndoRedoJournal(mergeInterval=1.0)
+    journal.record(move(1, 0, 1, t=0.0))
+    journal.record(move(1, 1, 2, t=2.0))                # too late
+    journal.record(move(2, 0, 1, t=2.1))                # other element
+    journal.record(move(2, 0, 5, t=2.2, key="rot"))     # other key
+    journal.record(move(2, 5, 6, t=2.3, key="rot"))
+    assert len(journal) == 4
+
+    ### an undone and redone entry is sealed, the next change starts a new one
+    journal.popUndo()
+    journal.popRedo()
+    journal.record(move(2, 6, 7, t=2.4, key="rot"))
+    assert len(journal) == 5
+
+def test_record_clears_redo():
+    journal = UndoRedoJournal()
+    journal.record(move(1, 0, 1))
+    journal.record(move(2, 0, 1))
+
+    item = journal.popUndo()
+    assert item.elementId == 2 and len(journal.redoItems) == 1
+
+    journal.record(move(3, 0, 1, t=5.0))
+    assert len(journal.redoItems) == 0
+    assert journal.popRedo() is None
+
+def test_paused():
+    journal = UndoRedoJournal()
+    journal.paused += 1
+    journal.record(move(1, 0, 1))
+    assert len(journal) == 0 and journal.isPaused()
+
+def test_trim_by_entries():
+    journal = UndoRedoJournal(maxEntries=5, mergeInterval=0.0)
+    for k in range(20):
+        journal.record(move(k, 0, 1, t=float(k)))
+
+    assert [x.elementId for x in journal.undoItems] == list(range(15, 20))
+    assert journal.bytes == sum(x.size for x in journal.undoItems)
+
+def test_trim_by_bytes():
+    journal = UndoRedoJournal(maxBytes=1000, mergeInterval=0.0)
+    for k in range(50):
+        journal.record(move(k, [0]*10, [1]*10, t=float(k)))
+
+    assert journal.bytes <= 1000
+    assert journal.undoItems[-1].elementId == 49
+    assert journal.bytes == sum(x.size for x in journal.undoItems)
+
+    ### a single entry above the limit is still kept
+    journal.record(UndoRedoItem(UndoRedoType.elementAdded, 99, after={"data": "x"*5000}))
+    assert len(journal) == 1 and journal.undoItems[0].elementId == 99
+
+def test_batch_size():
+    items = [move(k, 0, 1) for k in range(3)]
+    batch = UndoRedoItem(UndoRedoType.batch, before=items)
+    assert batch.size == sum(x.size for x in items)
+    assert not batch.canMerge(move(0, 1, 2))
@@ -0,0 +1,52 @@
+# test_optimize.py
+# Both optimizers improve the merit within the bounds and give the same result for the same seed
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+import pytest
+
+from Optimize import optimize, Problem, SpotSize
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "..", "samples", "lenses.scn")
+
+### x of the second lens and r1 of the first one, merit is the spot at the beam block
+PARAMS = [(2, "x", -600, 300), (1, "r1", 300, 3000)]
+
+def loadSample():
+    with open(SAMPLE) as reader:
+        return json.load(reader)
+
+def getStartMerit(states):
+    problem = Problem(states, PARAMS, SpotSize(0))
+    return float(problem(problem.x0[None])[0])
+
+@pytest.mark.parametrize("method, kwargs", [("simplex", {}), ("evolution", {"seed": 1, "iterations": 20})])
+def test_improves_within_bounds(method, kwargs):
+    states = loadSample()
+    result = optimize(states, PARAMS, SpotSize(0), method=method, **kwargs)
+
+    assert result.merit < getStartMerit(states)
+    assert len(result.history) == result.iterations
+    for (index, key, lower, upper), value in zip(PARAMS, result.x):
+        assert lower <= value <= upper
+
+@pytest.mark.parametrize("method, kwargs", [("simplex", {}), ("evolution", {"seed": 3, "iterations": 10})])
+def test_repeatable(method, kwargs):
+    states = loadSample()
+    a = optimize(states, PARAMS, SpotSize(0), method=method, **kwargs)
+    b = optimize(states, PARAMS, SpotSize(0), method=method, **kwargs)
+
+    assert np.array_equal(a.x, b.x)
+    assert a.merit == b.merit and a.history == b.history and a.evaluations == b.evaluations
+
+@pytest.mark.parametrize("method", ["simplex", "evolution"])
+def test_no_iterations(method):
+    result = optimize(loadSample(), PARAMS, SpotSize(0), method=method, iterations=0)
+    assert result.iterations == 0 and result.history == []
@@ -0,0 +1,77 @@
+# test_paraxial.py
+# Paraxial focus positions agree with real traces of a neighbouring ray, invalid systems are refused
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+import pytest
+
+from Paraxial import paraxial
+
+SAMPLES = os.path.join(os.path.dirname(__file__), "..", "samples")
+
+LENS = {"type": "LensElement", "pos": [0.0, 0.0], "rot": 0.0, "mat": "BK7", "r1": 500.0, "r2": 500.0, "thickness": 20, "height": 254}
+MIRROR = {"type": "MirrorElement", "pos": [0.0, 0.0], "rot": 160.0, "mat": "BK7", "r1": -800.0, "r2": None, "thickness": 30,
+    "height": 254, "ref1": 1.0, "ref2": 1.0, "tran1": 0.0, "tran2": 0.0}
+
+def createScene(element, rot = 0.0, wl = 1.03):
+    return [element, {"type": "RayElement", "pos": [-600.0, 0.0], "rot": rot, "intensity": 1.0, "wl": [wl]}]
+
+def getRealFocus(states, source, offset = 0.05):
+    ### crossing of the chief ray with a parallel ray offset sideways, both traced through the real system
+    state = states[source]
+    d = np.array([np.cos(np.radians(state["rot"])), np.sin(np.radians(state["rot"]))])
+    shifted = [dict(x) for x in states]
+    shifted[source]["pos"] = list(np.array(state["pos"]) + offset*np.array([-d[1], d[0]]))
+
+    a = paraxial(shifted, source)
+    b = paraxial(states, source)
+    u, v = np.linalg.solve(np.array([a.direction, -b.direction]).T, b.end - a.end)
+    return b.end + v*b.direction
+
+@pytest.mark.parametrize("element", [LENS, dict(LENS, rot=10.0), MIRROR, dict(MIRROR, r1=800.0)],
+    ids=["lens", "tilted lens", "concave mirror", "convex mirror"])
+def test_focus(element):
+    states = createScene(element)
+    system = paraxial(states, 1)
+
+    assert np.allclose(system.getFocus(), getRealFocus(states, 1), atol=0.05)
+
+    ### same medium in front and behind, the matrix preserves the phase space area
+    assert np.linalg.det(system.getMatrix()) == pytest.approx(1.0)
+
+def test_focal_length_over_wavelengths():
+    ### the focal length of a single lens grows with the wavelength (normal dispersion)
+    system = paraxial(createScene(LENS), 1)
+    f = system.getFocalLength(np.array([0.5, 1.0, 1.5]))
+    assert f[0] < f[1] < f[2]
+    assert system.getFocalLength(1.03) == pytest.approx(system.getFocalLength())
+
+def test_sample():
+    with open(os.path.join(SAMPLES, "lenses.scn")) as reader:
+        states = json.load(reader)
+
+    ### the source on the axis of both lenses, the focus lies more than a meter behind them
+    source = [i for i, x in enumerate(states) if x["type"] == "RayElement" and x["pos"][1] == states[1]["pos"][1]][0]
+
+    assert np.allclose(paraxial(states, source).getFocus(), getRealFocus(states, source), rtol=1e-5, atol=0.05)
+
+    ### up to the beam block
+    system = paraxial(states, source, 0)
+    assert np.linalg.det(system.getMatrix()) == pytest.approx(1.0)
+
+def test_invalid_systems():
+    states = createScene(LENS, wl=1.0)
+
+    with pytest.raises(ValueError):
+        paraxial(states, 1, wl=1.03)
+    with pytest.raises(ValueError):
+        paraxial(states, 0)
+    with pytest.raises(ValueError):
+        paraxial(createScene(LENS, rot=180.0), 1)
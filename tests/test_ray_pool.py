@@ -0,0 +1,78 @@
+# test_ray_pool.py
+# Traced segment items are reused from the pool instead of being created for every retrace
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import os
+import sys
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from PyQt5.QtWidgets import QApplication, QGraphicsScene
+from PyQt5 import QtCore
+
+app = QApplication.instance() or QApplication([])
+
+from TraceScene import TraceScene
+
+from OpticalElement import RayElement, OpticalElement
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "..", "samples", "lenses.scn")
+
+def loadScene():
+    scene = TraceScene()
+    scene.setItemIndexMethod(QGraphicsScene.NoIndex)
+    scene.traceCache = None
+    scene.loadFromFile(SAMPLE)
+    return scene
+
+def getRayItems(scene):
+    return [x for x in scene.items() if isinstance(x, RayElement)]
+
+def checkPool(scene):
+    ### every segment item is either part of the trace and visible, or hidden in the pool
+    traced = set(scene.rayTree.items)
+    pooled = set(scene.rayPool)
+
+    assert len(pooled) == len(scene.rayPool) and not traced & pooled
+    assert traced | pooled == set(getRayItems(scene))
+    assert all(x.isVisible() and x.tree is scene.rayTree for x in traced)
+    assert all(not x.isVisible() and x.tree is None and x.parent is not None for x in pooled)
+
+def test_full_retrace_reuses_items():
+    scene = loadScene()
+    items = set(getRayItems(scene))
+
+    for k in range(5):
+        scene.calculateScene()
+        checkPool(scene)
+        assert set(getRayItems(scene)) == items
+
+def test_moves_reuse_items():
+    scene = loadScene()
+    lens = [x for x in scene.items() if isinstance(x, OpticalElement)][0]
+    start = lens.pos()
+
+    ### the item count only grows to the largest trace seen
+    counts = []
+    for k in range(6):
+        lens.setPos(start + QtCore.QPointF(0, 25*(k % 3)))
+        checkPool(scene)
+        counts.append(len(getRayItems(scene)))
+
+    assert counts[3:] == counts[2:3]*3
+
+def test_pooled_items_are_reset():
+    scene = loadScene()
+    lens = [x for x in scene.items() if isinstance(x, OpticalElement)][0]
+    lens.setPos(lens.pos() + QtCore.QPointF(0, 50))
+
+    fresh = loadScene()
+    fresh.loadStates([x.getState() for x in scene.getTraceItems()])
+
+    def getSegments(s):
+        return sorted((round(x.mapToScene(x.line().p1()).x(), 2), round(x.mapToScene(x.line().p2()).y(), 1),
+            round(x.intensity, 4), tuple(x.wl), x.showArrow) for x in s.rayTree.items)
+
+    assert getSegments(scene) == getSegments(fresh)
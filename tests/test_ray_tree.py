@@ -0,0 +1,156 @@
+# test_ray_tree.py
+# Links, subtree masks, removal and the element index of the flat ray tree
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+import pytest
+
+from RayTree import RayTree
+
+class Item:
+    def __init__(self, name):
+        self.name = name
+        self.treeIndex = -1
+
+def createTree(seed, size = 60, elements = "abcd"):
+    ### random forest, every node hits one of the elements or nothing
+    rng = random.Random(seed)
+    tree = RayTree(4)
+    for i in range(rng.randint(1, size)):
+        parent = -1 if i == 0 or rng.random() < 0.1 else rng.randrange(i)
+        item = Item(i)
+        item.treeIndex = tree.addNode(item, parent, rng.random())
+        tree.setHit(item.treeIndex, rng.choice(list(elements) + [None]))
+    return tree, rng
+
+def getDescendants(tree, idx):
+    ### brute force over the parent column
+    result = set()
+    for i in range(len(tree)):
+        j = i
+        while j >= 0:
+            if j == idx:
+                result.add(i)
+                break
+            j = tree.parent[j]
+    return result
+
+def getElement(tree, eid):
+    return None if eid < 0 else tree.elements[eid]
+
+def checkTree(tree):
+    ### links, roots, depths and the element columns agree with the parent column
+    n = len(tree)
+    for i in range(n):
+        assert tree.items[i].treeIndex == i
+
+        p = tree.parent[i]
+        children = [j for j in range(n) if tree.parent[j] == i]
+        assert tree.getChildren(i) == children
+        assert tree.lastChild[i] == (children[-1] if children else -1)
+
+        if p < 0:
+            assert tree.root[i] == i and tree.depth[i] == 0 and tree.startElement[i] == -1
+        else:
+            assert tree.root[i] == tree.root[p] and tree.depth[i] == tree.depth[p] + 1
+            assert tree.startElement[i] == tree.hitElement[p]
+
+    used = set(tree.hitElement[:n]) | set(tree.startElement[:n])
+    used.discard(-1)
+    assert used == set(range(len(tree.elements)))
+    assert all(tree.elementIds[x] == i for i, x in enumerate(tree.elements))
+
+def test_links_keep_creation_order():
+    tree = RayTree(2)
+    items = [Item(i) for i in range(6)]
+    tree.addNode(items[0])
+    tree.addNode(items[1], 0)
+    tree.addNode(items[2], 0)
+    tree.addNode(items[3], 1)
+    tree.addNode(items[4])
+    tree.addNode(items[5], 0)
+
+    assert tree.getChildren(0) == [1, 2, 5]
+    assert tree.getChildren(1) == [3]
+    assert tree.getPath(3) == [0, 1, 3]
+    assert tree.getRoot(3) == 0 and tree.getRoot(4) == 4
+    assert tree.isAncestor(0, 3) and not tree.isAncestor(2, 3) and not tree.isAncestor(4, 3)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_subtree_masks(seed):
+    tree, rng = createTree(seed)
+    n = len(tree)
+
+    for idx in range(n):
+        descendants = getDescendants(tree, idx)
+        assert set(np.flatnonzero(tree.subtreeMask(idx))) == descendants
+        assert set(np.flatnonzero(tree.subtreeMask(idx, includeSelf=False))) == descendants - {idx}
+
+    indices = rng.sample(range(n), min(5, n))
+    for includeSelf in (True, False):
+        expected = np.zeros(n, dtype=bool)
+        for idx in indices:
+            expected |= tree.subtreeMask(idx, includeSelf)
+        assert (tree.subtreesMask(indices, includeSelf) == expected).all()
+
+@pytest.mark.parametrize("seed", range(20))
+def test_remove_mask(seed):
+    tree, rng = createTree(seed)
+    checkTree(tree)
+
+    ### hit and start element of every item before the removal
+    before = {x.name: (getElement(tree, tree.hitElement[i]), getElement(tree, tree.startElement[i]))
+        for i, x in enumerate(tree.items)}
+
+    indices = rng.sample(range(len(tree)), min(3, len(tree)))
+    mask = tree.subtreesMask(indices, rng.random() < 0.5)
+    expected = {x.name for x, m in zip(tree.items, mask) if not m}
+
+    removed = tree.removeMask(mask)
+    assert {x.name for x in removed} | expected == set(before)
+    assert {x.name for x in tree.items} == expected
+
+    checkTree(tree)
+    for i, x in enumerate(tree.items):
+        assert (getElement(tree, tree.hitElement[i]), getElement(tree, tree.startElement[i])) == before[x.name]
+
+def test_element_lookups():
+    tree, rng = createTree(3, 200)
+    n = len(tree)
+
+    for element in tree.elements:
+        eid = tree.elementIds[element]
+        incoming = np.flatnonzero(tree.hitElement[:n] == eid)
+        outgoing = np.flatnonzero(tree.startElement[:n] == eid)
+
+        assert sorted(tree.getIncoming(element)) == list(incoming)
+        assert sorted(tree.getOutgoing(element)) == list(outgoing)
+        assert tree.getElementPower(element) == pytest.approx(tree.power[incoming].sum())
+        assert list(tree.getElementRoots(element)) == sorted(set(tree.root[np.union1d(incoming, outgoing)]))
+
+    assert len(tree.getIncoming("unknown")) == 0
+
+def test_removed_elements_are_forgotten():
+    tree = RayTree()
+    a = tree.addNode(Item("a"))
+    b = tree.addNode(Item("b"))
+    tree.setHit(a, "lens")
+    tree.setHit(b, "mirror")
+
+    tree.removeSubtree(a)
+    assert tree.elements == ["mirror"]
+    assert "lens" not in tree.elementIds
+    assert len(tree.getIncoming("lens")) == 0
+    assert list(tree.getIncoming("mirror")) == [0]
+
+def test_clear():
+    tree, rng = createTree(1)
+    items = tree.clear()
+    assert len(items) > 0 and len(tree) == 0 and tree.elements == []
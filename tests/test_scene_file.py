@@ -0,0 +1,80 @@
+# test_scene_file.py
+# Binary scene files (.scb) give back exactly the states they were saved from, in the same order
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import os
+import sys
+import glob
+import json
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pytest
+
+from SceneFile import saveBinaryScene, iterBinaryScene, isBinaryScene
+
+SAMPLES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "samples", "*.scn")))
+
+def roundTrip(states, path, chunkSize = 4096):
+    saveBinaryScene(path, states)
+    return list(iterBinaryScene(path, chunkSize))
+
+@pytest.mark.parametrize("sample", SAMPLES, ids=os.path.basename)
+def test_samples(sample, tmp_path):
+    with open(sample) as reader:
+        states = json.load(reader)
+
+    path = str(tmp_path / "scene.scb")
+    assert roundTrip(states, path) == states
+    assert isBinaryScene(path) and not isBinaryScene(sample)
+
+def test_order_is_kept(tmp_path):
+    ### elements of different types interleaved, decoded in small chunks
+    with open(SAMPLES[0]) as reader:
+        states = json.load(reader) * 20
+    random.Random(1).shuffle(states)
+
+    assert roundTrip(states, str(tmp_path / "scene.scb"), chunkSize=3) == states
+
+### one column per case, every list is the value of the key in one element (None: key set to None, missing: no key)
+MISSING = object()
+COLUMNS = {
+    "numbers": [1, 2.5, -3, None, MISSING],
+    "bools": [True, False, None],
+    "strings": ["BK7", "FS", "BK7", None, MISSING],
+    "vectors": [[1, 2], [3.5, 4], MISSING],
+    "ragged": [[1.03], [0.5, 0.6, 0.7], [], None],
+    "nested": [[[1, 2, 3, 4]], [[5, 6, 7, 8], [9, 10, 11, 12]], []],
+    "nested width 1": [[[1], [2], [3]], [[4]]],
+    "mixed nesting": [[[1], [2, 3]], [[4, 5]]],
+    "empty and nested": [[], [[1]]],
+    "empty inner": [[[]], [[], []]],
+    "objects": [{"a": 1}, "text", [1, "x"], None],
+    "all missing": [MISSING, MISSING],
+    "all none": [None, None],
+}
+
+@pytest.mark.parametrize("name", list(COLUMNS))
+def test_columns(name, tmp_path):
+    states = []
+    for value in COLUMNS[name]:
+        state = {"type": "LensElement"}
+        if value is not MISSING:
+            state["value"] = value
+        states.append(state)
+
+    back = roundTrip(states, str(tmp_path / "scene.scb"), chunkSize=2)
+    assert back == states
+    ### numbers may come back as floats, but True == 1 must not hide a lost bool
+    assert [isinstance(x.get("value"), bool) for x in back] == [isinstance(x.get("value"), bool) for x in states]
+
+def test_empty_scene(tmp_path):
+    assert roundTrip([], str(tmp_path / "scene.scb")) == []
+
+def test_not_a_scene(tmp_path):
+    path = tmp_path / "scene.scb"
+    path.write_bytes(b"[]" + bytes(16))
+    with pytest.raises(ValueError):
+        list(iterBinaryScene(str(path)))
@@ -0,0 +1,65 @@
+# test_tolerance.py
+# Seeded Monte Carlo tolerancing does not depend on the chunks or workers the trials are traced in
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+import pytest
+
+from Tolerance import tolerance, makeOffsets, METRICS
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "..", "samples", "trans_grating_1739.scn")
+
+def loadSample():
+    with open(SAMPLE) as reader:
+        return json.load(reader)
+
+def getMetrics(result):
+    return {k: result.getChanges(k) for k in METRICS}
+
+def assertSame(a, b):
+    for k in METRICS:
+        assert np.array_equal(a[k], b[k], equal_nan=True), k
+
+### errors of the first grating and of the source, metrics at the detector plane (element 3)
+TOLERANCES = [(0, "rot", 0.05), (0, "x", 0.5, "uniform"), (4, "rot", 0.02)]
+
+def test_offsets():
+    a = makeOffsets(TOLERANCES, 500, seed=7)
+    b = makeOffsets(TOLERANCES, 500, seed=7)
+    c = makeOffsets(TOLERANCES, 500, seed=8)
+
+    assert np.array_equal(a[0]["rot"], b[0]["rot"]) and not np.array_equal(a[0]["rot"], c[0]["rot"])
+    assert np.abs(a[0]["x"]).max() <= 0.5
+    with pytest.raises(ValueError):
+        makeOffsets([(0, "rot", 0.1, "cauchy")], 10)
+
+def test_chunks_and_workers():
+    states = loadSample()
+    reference = getMetrics(tolerance(states, TOLERANCES, 3, trials=300, seed=5))
+
+    assertSame(reference, getMetrics(tolerance(states, TOLERANCES, 3, trials=300, seed=5, chunkSize=64)))
+    assertSame(reference, getMetrics(tolerance(states, TOLERANCES, 3, trials=300, seed=5, chunkSize=100, workers=2)))
+
+def test_zero_tolerance():
+    ### the output of the grating pair is collimated, it has no focus
+    result = tolerance(loadSample(), [(0, "rot", 0.0)], 3, trials=20, seed=1)
+    for k in METRICS:
+        if k != "focus":
+            assert np.allclose(result.getChanges(k), 0.0, atol=1e-9), k
+
+def test_changes_grow_with_tolerance():
+    ### the walk off of the wavelengths follows the grating angle, the pointing of a parallel grating pair does not
+    states = loadSample()
+    small = tolerance(states, [(0, "rot", 0.01)], 3, trials=200, seed=2).getStats()
+    large = tolerance(states, [(0, "rot", 0.1)], 3, trials=200, seed=2).getStats()
+
+    assert large["walkoff"]["std"] == pytest.approx(10*small["walkoff"]["std"], rel=0.05)
+    assert large["y"]["std"] == pytest.approx(10*small["y"]["std"], rel=0.05)
+    assert large["pointing"]["std"] < 1e-9
@@ -0,0 +1,90 @@
+# test_trace_engine.py
+# The vectorized trace engine gives the same segments as the scene trace
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import os
+import sys
+import json
+import random
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from PyQt5.QtWidgets import QApplication, QGraphicsScene
+
+app = QApplication.instance() or QApplication([])
+
+from TraceScene import TraceScene
+from TraceEngine import TraceGeometry, trace, INTENSITY_THRESHOLD
+import pytest
+
+SAMPLES = ["lenses.scn", "prism.scn", "trans_grating_1739.scn"]
+
+def loadSample(name):
+    with open(os.path.join(os.path.dirname(__file__), "..", "samples", name)) as reader:
+        return json.load(reader)
+
+def perturb(states, rng, fresnel = False, orders = False):
+    ### random small changes of every element and source
+    states = [dict(x) for x in states]
+    for x in states:
+        if x["type"] == "RayElement":
+            x["rot"] += rng.uniform(-2, 2)
+            if fresnel:
+                x["fresnel"] = rng.choice(["s", "p", "unpolarized"])
+            continue
+
+        x["pos"] = [x["pos"][0] + rng.uniform(-30, 30), x["pos"][1] + rng.uniform(-30, 30)]
+        x["rot"] += rng.uniform(-5, 5)
+        if x["type"] == "LensElement" and x.get("r1"):
+            x["r1"] *= rng.uniform(0.8, 1.2)
+        elif x["type"] == "PrismElement":
+            x["apex"] += rng.uniform(-3, 3)
+        elif x["type"] == "GratingElement":
+            x["lines"] *= rng.uniform(0.95, 1.05)
+            if orders:
+                x["orders"] = [-1, 0, 1, -2]
+                x["efficiencies"] = [0.6, 0.2, 0.1, 0.15]
+    return states
+
+def getSceneSegments(states, threshold):
+    scene = TraceScene()
+    scene.setItemIndexMethod(QGraphicsScene.NoIndex)
+    scene.traceCache = None
+    scene.intensityThreshold = threshold
+    scene.loadStates(states)
+
+    segments = []
+    for ray in scene.rayTree.items:
+        p1 = ray.mapToScene(ray.line().p1())
+        p2 = ray.mapToScene(ray.line().p2())
+        segments.append((round(p1.x(), 1), round(p1.y(), 1), round(p2.x()), round(p2.y()), round(ray.intensity, 4)))
+    return sorted(segments)
+
+def getEngineSegments(states, threshold):
+    result = trace(TraceGeometry(states), threshold)
+    return sorted((round(result["start"][i][0], 1), round(result["start"][i][1], 1), round(result["end"][i][0]),
+        round(result["end"][i][1]), round(result["intensity"][i], 4)) for i in range(len(result)))
+
+@pytest.mark.parametrize("name", SAMPLES)
+def test_samples(name):
+    states = loadSample(name)
+    assert getSceneSegments(states, INTENSITY_THRESHOLD) == getEngineSegments(states, INTENSITY_THRESHOLD)
+
+@pytest.mark.parametrize("name", SAMPLES)
+@pytest.mark.parametrize("seed", range(5))
+def test_perturbed(name, seed):
+    states = perturb(loadSample(name), random.Random(seed))
+    assert getSceneSegments(states, INTENSITY_THRESHOLD) == getEngineSegments(states, INTENSITY_THRESHOLD)
+
+@pytest.mark.parametrize("name", SAMPLES)
+@pytest.mark.parametrize("seed", range(3))
+def test_fresnel(name, seed):
+    states = perturb(loadSample(name), random.Random(seed), fresnel=True)
+    assert getSceneSegments(states, 0.01) == getEngineSegments(states, 0.01)
+
+@pytest.mark.parametrize("seed", range(3))
+def test_grating_orders(seed):
+    states = perturb(loadSample("trans_grating_1739.scn"), random.Random(seed), orders=True)
+    assert getSceneSegments(states, INTENSITY_THRESHOLD) == getEngineSegments(states, INTENSITY_THRESHOLD)
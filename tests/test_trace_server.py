@@ -0,0 +1,77 @@
+# test_trace_server.py
+# A warm worker that only applies the changed states traces the same as a worker loading the scene from scratch
+# 19.10.2026, Floery Tobias
+# Released under GNU Public License (GPL)
+
+import os
+import sys
+import json
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pytest
+
+import TraceServer
+
+SAMPLES = os.path.join(os.path.dirname(__file__), "..", "samples")
+
+def loadSample(name):
+    with open(os.path.join(SAMPLES, name)) as reader:
+        return json.load(reader)
+
+def resetWorker():
+    TraceServer.workerScene = None
+    TraceServer.workerElements = []
+    TraceServer.workerStates = []
+
+def getSegments(result):
+    rays = result["rays"]
+    return sorted(zip(*[[tuple(round(v, 6) for v in x) for x in rays[k]] for k in ("start", "end")],
+        [round(x, 6) for x in rays["intensity"]]))
+
+def moveElement(states, index, pos = None, rot = None):
+    states = [dict(x) for x in states]
+    if pos is not None:
+        states[index]["pos"] = pos
+    if rot is not None:
+        states[index]["rot"] = rot
+    return states
+
+### (sample, element, new position, new rotation), lens 2 of lenses.scn ends up overlapping lens 1
+CHANGES = [
+    ("lenses.scn", 2, [840, -100], None),
+    ("lenses.scn", 1, [700, -90], None),
+    ("lenses.scn", 0, None, 20.0),
+    ("prism.scn", 0, None, 3.0),
+    ("trans_grating_1739.scn", 0, None, 60.0),
+]
+
+@pytest.mark.parametrize("name, index, pos, rot", CHANGES)
+def test_reused_equals_fresh(name, index, pos, rot):
+    states = loadSample(name)
+    changed = moveElement(states, index, pos, rot)
+
+    resetWorker()
+    TraceServer.traceStates(states, rayData=False)
+    reused = TraceServer.traceStates(changed)
+
+    resetWorker()
+    fresh = TraceServer.traceStates(changed)
+
+    assert reused["reused"] and not fresh["reused"]
+    assert reused["segments"] == fresh["segments"]
+    assert reused["power"] == pytest.approx(fresh["power"])
+    assert getSegments(reused) == getSegments(fresh)
+
+def test_repeated_jobs_do_not_drift():
+    ### every job on the warm worker is compared with a fresh trace, a wrongly applied state would carry over
+    states = loadSample("lenses.scn")
+    jobs = [moveElement(states, 2, [840, -100]), moveElement(states, 2, [-100, -100]), states]
+
+    resetWorker()
+    reused = [TraceServer.traceStates(x) for x in jobs]
+
+    for job, result in zip(jobs, reused):
+        resetWorker()
+        assert getSegments(result) == getSegments(TraceServer.traceStates(job))